@@ -6,10 +6,21 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(config)
 
-    from app.db import init_db, close_db
+    from app.db import init_db, close_db, connect
     init_db(app)
     app.teardown_appcontext(close_db)
 
+    from app.jobs import fail_stale_jobs
+    conn = connect()
+    fail_stale_jobs(conn)
+    conn.close()
+
+    from app.cli import register_commands
+    register_commands(app)
+
+    from app.search import highlight
+    app.add_template_filter(highlight, 'search_snippet')
+
     from app.routes.dashboard import bp as dashboard_bp
     from app.routes.questions import bp as questions_bp
     from app.routes.exams import bp as exams_bp
@@ -1,9 +1,15 @@
 import json
 import os
+import re
+import threading
+import time
 import anthropic
 import config
 from app.db import get_db
+from app.duplicates import DuplicateScreen
+from app import generation_cache
 from app.pdf_extractor import get_topic_content
+from app.tokens import estimate_tokens
 
 SYSTEM_PROMPT = """# הגדרת תפקיד ומומחיות
 
@@ -242,6 +248,16 @@ A. שחרור עם מעקב פסיכיאטרי תוך 48 שעות  B. הערכת
 
 ענה בפורמט JSON בלבד."""
 
+# With CACHE_TEXTBOOK_CONTENT the textbook excerpt leads the user message, so it
+# forms a cacheable prefix shared by every request for the topic whatever the
+# difficulty/count. The marker splits it off into its own content block.
+TEXTBOOK_PREFIX_TEMPLATE = """חומר מקצועי רלוונטי מתוך ספרי הלימוד:
+---
+{content}
+---"""
+TEXTBOOK_PREFIX_END = '\n\n==== סוף חומר הלימוד ====\n\n'
+TEXTBOOK_REFERENCE = '(ראה את החומר המקצועי בתחילת ההודעה)'
+
 DIFFICULTY_MAP = {
     'easy': """קל - שאלות ברמת בסיס:
   • מקרה קליני עם מצג טיפוסי וקלאסי של הפרעה שכיחה
@@ -266,8 +282,67 @@ DIFFICULTY_MAP = {
 }
 
 
-def generate_questions(topic_id, count=3, difficulty='medium', clinical_task='mixed', subtopic_ids=None):
-    db = get_db()
+def _get_api_key():
+    api_key = os.environ.get('ANTHROPIC_API_KEY', '') or config.CLAUDE_API_KEY
+    if not api_key:
+        raise ValueError("ANTHROPIC_API_KEY not set. Set the environment variable or enter it when starting the app.")
+    return api_key
+
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+
+def get_client(max_retries=None):
+    """Process-wide Anthropic client, so HTTP connections and TLS sessions are reused.
+
+    Built lazily and rebuilt only when the API key (or base URL) changes.
+    max_retries overrides CLAUDE_MAX_RETRIES on a copy sharing the same connections.
+    """
+    global _client, _client_key
+    key = (_get_api_key(), config.ANTHROPIC_BASE_URL)
+    with _client_lock:
+        if _client is None or _client_key != key:
+            # httpx.Limits, taken from the SDK so we don't depend on httpx directly
+            limits = type(anthropic.DEFAULT_CONNECTION_LIMITS)(
+                max_connections=config.CLAUDE_MAX_CONNECTIONS,
+                max_keepalive_connections=config.CLAUDE_MAX_CONNECTIONS,
+            )
+            _client = anthropic.Anthropic(
+                api_key=key[0],
+                base_url=key[1],
+                timeout=anthropic.Timeout(config.CLAUDE_TIMEOUT, connect=config.CLAUDE_CONNECT_TIMEOUT),
+                max_retries=config.CLAUDE_MAX_RETRIES,
+                http_client=anthropic.DefaultHttpxClient(limits=limits),
+            )
+            _client_key = key
+        client = _client
+    return client if max_retries is None else client.with_options(max_retries=max_retries)
+
+
+def _subtopics_list(subtopics):
+    """Bulleted subtopics, cut to SUBTOPICS_MAX_TOKENS."""
+    lines, used = [], 0
+    for i, s in enumerate(subtopics):
+        line = f'- {s["hebrew"]} ({s["english"]})'
+        used += estimate_tokens(line)
+        if used > config.SUBTOPICS_MAX_TOKENS:
+            lines.append(f'- ועוד {len(subtopics) - i} תת-נושאים')
+            break
+        lines.append(line)
+    return '\n'.join(lines) or '(אין תת-נושאים מפורטים)'
+
+
+def max_output_tokens(count):
+    """max_tokens for a request of count questions, so small requests don't reserve 8K."""
+    count = min(max(count, 1), config.MAX_QUESTION_COUNT)
+    return min(config.OUTPUT_TOKENS_BASE + count * config.OUTPUT_TOKENS_PER_QUESTION, config.MAX_OUTPUT_TOKENS)
+
+
+def build_prompt(db, topic_id, count=3, difficulty='medium', clinical_task='mixed', subtopic_ids=None):
+    """Render the user prompt for a topic, including its textbook content."""
+    count = min(max(count, 1), config.MAX_QUESTION_COUNT)
     topic = db.execute("SELECT * FROM topics WHERE id = ?", (topic_id,)).fetchone()
     if not topic:
         raise ValueError(f"Topic {topic_id} not found")
@@ -283,9 +358,7 @@ def generate_questions(topic_id, count=3, difficulty='medium', clinical_task='mi
         subtopics = db.execute(
             "SELECT hebrew, english FROM topics WHERE parent_id = ?", (topic_id,)
         ).fetchall()
-    subtopics_text = '\n'.join(
-        f'- {s["hebrew"]} ({s["english"]})' for s in subtopics
-    ) or '(אין תת-נושאים מפורטים)'
+    subtopics_text = _subtopics_list(subtopics)
 
     # Get mapping - try direct, then parent
     mapping = db.execute(
@@ -296,34 +369,66 @@ def generate_questions(topic_id, count=3, difficulty='medium', clinical_task='mi
             "SELECT * FROM topic_mappings WHERE topic_id = ?", (topic['parent_id'],)
         ).fetchone()
 
-    # Extract textbook content
-    content = get_topic_content(dict(mapping) if mapping else None)
+    # Extract the textbook passages most relevant to the topic and chosen subtopics
+    query_terms = [topic['english'], topic['hebrew']] + [s['english'] for s in subtopics]
+    if mapping and mapping['search_terms']:
+        query_terms += mapping['search_terms'].split(';')
+    def render(content):
+        return USER_PROMPT_TEMPLATE.format(
+            count=count,
+            topic_he=topic['hebrew'],
+            topic_en=topic['english'],
+            difficulty=DIFFICULTY_MAP.get(difficulty, difficulty),
+            clinical_task=CLINICAL_TASK_MAP.get(clinical_task, CLINICAL_TASK_MAP['mixed']),
+            chapter_he=topic['chapter_he'],
+            subtopics_list=subtopics_text,
+            content=TEXTBOOK_REFERENCE if config.CACHE_TEXTBOOK_CONTENT else content,
+        )
+
+    # Textbook passages get whatever the token budget leaves after the fixed parts
+    fixed = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(render(''))
+    if config.CACHE_TEXTBOOK_CONTENT:
+        fixed += estimate_tokens(TEXTBOOK_PREFIX_TEMPLATE.format(content='') + TEXTBOOK_PREFIX_END)
+    budget = min(config.TEXTBOOK_MAX_TOKENS, config.PROMPT_TOKEN_BUDGET - fixed)
+    content = get_topic_content(dict(mapping) if mapping else None, query_terms, budget) if budget > 0 else ''
     if not content:
         content = 'לא נמצא חומר ספציפי - צור שאלות על בסיס הידע הכללי שלך בנושא.'
 
-    user_prompt = USER_PROMPT_TEMPLATE.format(
-        count=count,
-        topic_he=topic['hebrew'],
-        topic_en=topic['english'],
-        difficulty=DIFFICULTY_MAP.get(difficulty, difficulty),
-        clinical_task=CLINICAL_TASK_MAP.get(clinical_task, CLINICAL_TASK_MAP['mixed']),
-        chapter_he=topic['chapter_he'],
-        subtopics_list=subtopics_text,
-        content=content,
-    )
+    prompt = render(content)
+    if config.CACHE_TEXTBOOK_CONTENT:
+        prompt = TEXTBOOK_PREFIX_TEMPLATE.format(content=content) + TEXTBOOK_PREFIX_END + prompt
+    return prompt
+
+
+def message_params(user_prompt, count=config.DEFAULT_QUESTION_COUNT):
+    """Messages API parameters shared by the direct and batch backends.
+
+    The system prompt (and the textbook prefix, when present) carry cache_control
+    so back-to-back generations read them from the prompt cache. max_tokens
+    is sized for count questions.
+    """
+    if TEXTBOOK_PREFIX_END in user_prompt:
+        textbook, rest = user_prompt.split(TEXTBOOK_PREFIX_END, 1)
+        content = [
+            {"type": "text", "text": textbook, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": rest},
+        ]
+    else:
+        content = user_prompt
+    return {
+        'model': config.CLAUDE_MODEL,
+        'max_tokens': max_output_tokens(count),
+        'system': [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}],
+        'messages': [{"role": "user", "content": content}],
+    }
 
-    api_key = os.environ.get('ANTHROPIC_API_KEY', '') or config.CLAUDE_API_KEY
-    if not api_key:
-        raise ValueError("ANTHROPIC_API_KEY not set. Set the environment variable or enter it when starting the app.")
-    client = anthropic.Anthropic(api_key=api_key)
-    response = client.messages.create(
-        model=config.CLAUDE_MODEL,
-        max_tokens=8192,
-        system=SYSTEM_PROMPT,
-        messages=[{"role": "user", "content": user_prompt}],
-    )
 
-    raw = response.content[0].text
+def parse_response(raw):
+    """Extract the question list from a model response.
+
+    A response cut off mid-JSON (max_tokens) keeps the questions completed
+    before the cut; it is an error only if none were.
+    """
     # Strip markdown fences
     text = raw
     if '```json' in text:
@@ -331,35 +436,289 @@ def generate_questions(topic_id, count=3, difficulty='medium', clinical_task='mi
     elif '```' in text:
         text = text.split('```', 1)[1].split('```', 1)[0]
 
-    data = json.loads(text)
-    questions = data.get('questions', [])
-
-    # Log
-    tokens = response.usage.input_tokens + response.usage.output_tokens
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        questions = QuestionStreamParser().feed(raw)
+        if not questions:
+            raise
+        return questions
+    return data.get('questions', [])
+
+
+class QuestionStreamParser:
+    """Incrementally pulls complete question objects out of a streamed JSON response.
+
+    feed() accepts text chunks as they arrive and returns the question dicts that
+    became complete, so each can be stored before the rest of the response exists.
+    """
+
+    _ARRAY_START = re.compile(r'"questions"\s*:\s*\[')
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = None      # scan position once inside the questions array
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.start = None
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.pos is None:
+            match = self._ARRAY_START.search(self.buffer)
+            if not match:
+                return []
+            self.pos = match.end()
+
+        found = []
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf) and not self.done:
+            ch = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == '{':
+                if self.depth == 0:
+                    self.start = i
+                self.depth += 1
+            elif ch == '}':
+                self.depth -= 1
+                if self.depth == 0 and self.start is not None:
+                    try:
+                        found.append(json.loads(buf[self.start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass  # skip a malformed question, keep the rest
+                    self.start = None
+            elif ch == ']' and self.depth == 0:
+                self.done = True
+            i += 1
+        self.pos = i
+        return found
+
+
+def _log_generation(db, topic_id, user_prompt, raw, questions_created, usage, from_cache=False,
+                    stop_reason=''):
+    """Record a generation; stop_reason 'max_tokens' marks a response cut off at max_tokens."""
+    tokens = (usage.input_tokens + usage.output_tokens) if usage else 0
+    cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
+    cache_write = getattr(usage, 'cache_creation_input_tokens', 0) or 0
     db.execute(
-        "INSERT INTO generation_log (topic_id, prompt_used, raw_response, questions_created, model_used, tokens_used) "
-        "VALUES (?, ?, ?, ?, ?, ?)",
-        (topic_id, user_prompt[:2000], raw[:5000], len(questions), config.CLAUDE_MODEL, tokens)
+        "INSERT INTO generation_log (topic_id, prompt_used, raw_response, questions_created, model_used, tokens_used, "
+        "cache_read_tokens, cache_write_tokens, from_cache, output_tokens, stop_reason) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (topic_id, user_prompt[:2000], raw[:5000], questions_created, config.CLAUDE_MODEL, tokens,
+         cache_read, cache_write, int(from_cache), usage.output_tokens if usage else 0, stop_reason or '')
     )
     db.commit()
 
+
+def _cached_questions(db, ids):
+    """[(id, question dict in the model's format)] for questions served from the generation cache."""
+    if not ids:
+        return []
+    rows = db.execute(
+        f"SELECT id, stem_he, option_a, option_b, option_c, option_d, option_e, correct_answer, explanation_he "
+        f"FROM questions WHERE id IN ({','.join('?' * len(ids))})", ids
+    ).fetchall()
+    by_id = {r['id']: r for r in rows}
+    return [(i, {'stem': by_id[i]['stem_he'],
+                 'options': {k: by_id[i][f] for k, f in zip('ABCDE', ('option_a', 'option_b', 'option_c',
+                                                                      'option_d', 'option_e')) if by_id[i][f]},
+                 'correct': by_id[i]['correct_answer'],
+                 'explanation': by_id[i]['explanation_he']})
+            for i in ids if i in by_id]
+
+
+def _insert_question(db, topic_id, q, difficulty, clinical_task, duplicate_of=None, dup_score=None):
+    opts = q.get('options', {})
+    cursor = db.execute(
+        "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, option_e, "
+        "correct_answer, explanation_he, difficulty, bloom_level, question_type, status, ai_generated, "
+        "duplicate_of, dup_score) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'draft', 1, ?, ?)",
+        (topic_id, q.get('stem', ''),
+         opts.get('A', ''), opts.get('B', ''), opts.get('C', ''), opts.get('D', ''),
+         opts.get('E', ''), q.get('correct', 'A'),
+         q.get('explanation', ''),
+         q.get('difficulty', difficulty),
+         q.get('clinical_task', clinical_task),
+         q.get('clinical_task', clinical_task),
+         duplicate_of, dup_score)
+    )
+    return cursor.lastrowid
+
+
+def _insert_screened(db, screen, topic_id, q, difficulty, clinical_task):
+    """Insert q unless it is a near-copy of an existing question; flag it if it is close.
+
+    Returns the new id, or None if it was suppressed.
+    """
+    vector, nearest_id, score = screen.check(q)
+    if screen.suppressed(score):
+        return None
+    qid = _insert_question(db, topic_id, q, difficulty, clinical_task,
+                           nearest_id if screen.flagged(score) else None, round(score, 4))
+    screen.add(db, qid, vector)
+    return qid
+
+
+def store_questions(db, topic_id, user_prompt, raw, usage, difficulty='medium', clinical_task='mixed',
+                    stop_reason=''):
+    """Log a generation and store its questions as drafts. Returns the new question ids.
+
+    Near-duplicates of the bank (or of each other) are flagged or dropped, see app.duplicates.
+    A truncated response (stop_reason 'max_tokens') keeps its complete questions.
+    """
+    questions = parse_response(raw)
+    screen = DuplicateScreen(db)
+
     # Store as drafts
-    created = []
-    for q in questions:
-        opts = q.get('options', {})
-        cursor = db.execute(
-            "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, option_e, "
-            "correct_answer, explanation_he, difficulty, bloom_level, question_type, status, ai_generated) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'draft', 1)",
-            (topic_id, q.get('stem', ''),
-             opts.get('A', ''), opts.get('B', ''), opts.get('C', ''), opts.get('D', ''),
-             opts.get('E', ''), q.get('correct', 'A'),
-             q.get('explanation', ''),
-             q.get('difficulty', difficulty),
-             q.get('clinical_task', clinical_task),
-             q.get('clinical_task', clinical_task))
-        )
-        created.append(cursor.lastrowid)
+    created = [qid for qid in (_insert_screened(db, screen, topic_id, q, difficulty, clinical_task)
+                               for q in questions) if qid is not None]
     db.commit()
+    screen.committed(db)
+    _log_generation(db, topic_id, user_prompt, raw, len(created), usage, stop_reason=stop_reason)
 
     return created
+
+
+def generate_questions(topic_id, count=3, difficulty='medium', clinical_task='mixed', subtopic_ids=None,
+                       fresh=False, max_retries=None):
+    """Generate and store questions; an identical recent request returns its questions instead.
+
+    Returns (question ids, whether they came from the cache). fresh=True always
+    calls the API (and replaces the cached result). max_retries overrides the
+    client's own retries, for callers that retry themselves.
+    """
+    db = get_db()
+    user_prompt = build_prompt(db, topic_id, count, difficulty, clinical_task, subtopic_ids)
+    params = message_params(user_prompt, count)
+    fp = generation_cache.fingerprint(params)
+    if not fresh:
+        cached = generation_cache.claim(db, fp, topic_id)
+        if cached == generation_cache.BUSY:
+            fresh = True  # the identical request is taking too long; call the API as well
+        elif cached is not None:
+            ids = cached['question_ids']
+            _log_generation(db, topic_id, user_prompt, cached['raw_response'], len(ids), None, from_cache=True)
+            return ids, True
+
+    try:
+        response = get_client(max_retries).messages.create(**params)
+        raw = response.content[0].text
+        created = store_questions(db, topic_id, user_prompt, raw, response.usage, difficulty, clinical_task,
+                                  response.stop_reason)
+    except BaseException:
+        if not fresh:
+            generation_cache.release(db, fp)
+        raise
+    generation_cache.complete(db, fp, topic_id, raw, created)
+    return created, False
+
+
+def generate_questions_stream(topic_id, count=3, difficulty='medium', clinical_task='mixed', subtopic_ids=None,
+                              fresh=False):
+    """Stream a generation, storing each question as a draft as soon as it is complete.
+
+    Yields ('question', id, question_dict) per stored question and finally
+    ('done', ids, from_cache). Questions stored before an error or a truncated
+    response are kept. An identical recent request's questions are replayed
+    instead of calling the API, unless fresh.
+    """
+    db = get_db()
+    user_prompt = build_prompt(db, topic_id, count, difficulty, clinical_task, subtopic_ids)
+    params = message_params(user_prompt, count)
+    fp = generation_cache.fingerprint(params)
+    if not fresh:
+        cached = generation_cache.claim(db, fp, topic_id)
+        if cached == generation_cache.BUSY:
+            fresh = True  # the identical request is taking too long; call the API as well
+        elif cached is not None:
+            ids = cached['question_ids']
+            _log_generation(db, topic_id, user_prompt, cached['raw_response'], len(ids), None, from_cache=True)
+            for qid, q in _cached_questions(db, ids):
+                yield 'question', qid, q
+            yield 'done', ids, True
+            return
+
+    parser = QuestionStreamParser()
+    screen = DuplicateScreen(db)
+    created = []
+    usage = None
+    stop_reason = ''
+    finished = False
+    try:
+        with get_client().messages.stream(**params) as stream:
+            for text in stream.text_stream:
+                for q in parser.feed(text):
+                    qid = _insert_screened(db, screen, topic_id, q, difficulty, clinical_task)
+                    if qid is None:
+                        continue
+                    db.commit()
+                    screen.committed(db)
+                    created.append(qid)
+                    yield 'question', qid, q
+            final = stream.get_final_message()
+            usage, stop_reason = final.usage, final.stop_reason
+        finished = True
+    finally:
+        _log_generation(db, topic_id, user_prompt, parser.buffer, len(created), usage, stop_reason=stop_reason)
+        if finished:
+            generation_cache.complete(db, fp, topic_id, parser.buffer, created)
+        elif not fresh:
+            generation_cache.release(db, fp)
+
+    yield 'done', created, False
+
+
+# --- Message Batches backend ---
+
+def submit_message_batch(requests):
+    """Submit [(custom_id, user_prompt, count), ...] as one Message Batch. Returns the batch id."""
+    client = get_client()
+    batch = client.messages.batches.create(requests=[
+        {'custom_id': custom_id, 'params': message_params(user_prompt, count)}
+        for custom_id, user_prompt, count in requests
+    ])
+    return batch.id
+
+
+def wait_for_message_batch(batch_id, poll_seconds=None, on_poll=None, timeout=None):
+    """Block until a Message Batch has finished processing, calling on_poll between checks.
+
+    Raises TimeoutError after timeout seconds (MESSAGE_BATCH_TIMEOUT_SECONDS).
+    """
+    client = get_client()
+    timeout = config.MESSAGE_BATCH_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    while True:
+        batch = client.messages.batches.retrieve(batch_id)
+        if batch.processing_status == 'ended':
+            return batch
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f'Message Batch {batch_id} did not finish within {timeout:g}s')
+        if on_poll:
+            on_poll()
+        time.sleep(poll_seconds or config.MESSAGE_BATCH_POLL_SECONDS)
+
+
+def message_batch_results(batch_id):
+    """Yield (custom_id, message or None, error text) for each request of a finished batch."""
+    client = get_client()
+    for entry in client.messages.batches.results(batch_id):
+        result = entry.result
+        if result.type == 'succeeded':
+            yield entry.custom_id, result.message, ''
+        elif result.type == 'errored':
+            yield entry.custom_id, None, str(result.error.error.message)
+        else:
+            yield entry.custom_id, None, f'request {result.type}'
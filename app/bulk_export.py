@@ -0,0 +1,122 @@
+"""Bulk export: many exams x variants rendered on a process pool, streamed as one ZIP.
+
+Each (exam, variant) document is rendered by the streaming DOCX engine in a
+worker process, so rendering continues while the response thread is writing
+finished documents to the client. The ZIP is written in completion order.
+Rendering is pure-Python CPU work, so threads would serialize on the GIL;
+workers are spawned rather than forked because the web worker is threaded.
+Renders that haven't started are cancelled if the client disconnects, and
+a render that fails is listed in an error entry instead of cutting the ZIP short.
+"""
+import multiprocessing
+import random
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import config
+from app.docx_stream import stream_docx, ChunkSink
+from app.exam_docx import question_rows
+
+# variant -> (file suffix, include questions, include answer key)
+VARIANTS = {
+    'full': ('', True, True),
+    'student': ('שאלון', True, False),
+    'key': ('מפתח', False, True),
+}
+SHUFFLED_RE = re.compile(r'^shuffled-(\d+)$')
+MAX_SHUFFLED_VARIANTS = 10
+ERRORS_NAME = 'שגיאות ייצוא.txt'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=config.EXPORT_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _discard_pool(pool):
+    """Drop a pool whose worker died, so the next export starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def valid_variant(variant):
+    return variant in VARIANTS or bool(SHUFFLED_RE.match(variant))
+
+
+def _safe_name(title):
+    return re.sub(r'[\\/:*?"<>|]+', '_', title).strip() or 'exam'
+
+
+def render_variant(exam, rows, variant):
+    """Render one document (runs in a pool worker). Returns (filename, bytes)."""
+    shuffled = SHUFFLED_RE.match(variant)
+    if shuffled:
+        version = int(shuffled.group(1))
+        # Seeded by exam and version so re-exporting reproduces the same order
+        rows = list(rows)
+        random.Random(f'{exam["id"]}-{version}').shuffle(rows)
+        rows = [dict(q, position=i) for i, q in enumerate(rows, 1)]
+        exam = dict(exam, title=f'{exam["title"]} - גרסה {version}')
+        suffix, with_questions, with_key = '', True, True
+    else:
+        suffix, with_questions, with_key = VARIANTS[variant]
+
+    data = b''.join(stream_docx(exam, rows if with_questions else None, rows if with_key else None))
+    name = _safe_name(f'{exam["title"]} - {suffix}' if suffix else exam['title'])
+    return f'{exam["id"]:03d} {name}.docx', data
+
+
+def load_exams(db, exam_ids):
+    """[(exam dict, [question dicts])] for the exams that exist, in the order given."""
+    exams = []
+    for exam_id in exam_ids:
+        exam = db.execute("SELECT id, title, description FROM exams WHERE id=?", (exam_id,)).fetchone()
+        if exam:
+            exams.append((dict(exam), [dict(q) for q in question_rows(db, exam_id)]))
+    return exams
+
+
+def stream_zip(exams, variants):
+    """Yield a ZIP of every exam in every variant, adding documents as workers finish.
+
+    Documents that fail to render are listed in ERRORS_NAME at the end of the
+    archive; by then the response has started, so it can't become an error page.
+    """
+    pool = _get_pool()
+    futures = {pool.submit(render_variant, exam, rows, variant): (exam, variant)
+               for exam, rows in exams for variant in variants}
+    sink = ChunkSink()
+    errors = []
+    try:
+        # DOCX files are already deflated, so they are stored as-is
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+            for future in as_completed(futures):
+                try:
+                    name, data = future.result()
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        _discard_pool(pool)
+                    exam, variant = futures[future]
+                    errors.append(f'{exam["id"]} {exam["title"]} ({variant}): {e}')
+                    continue
+                zf.writestr(name, data)
+                yield sink.drain()
+            if errors:
+                zf.writestr(ERRORS_NAME, '\n'.join(errors) + '\n')
+        yield sink.drain()
+    finally:
+        # Client gone (GeneratorExit): drop the renders not started yet
+        for future in futures:
+            future.cancel()
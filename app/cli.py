@@ -0,0 +1,222 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+import config
+
+
+@click.command('warm-textbooks')
+@click.option('--workers', type=int, help='Extraction processes (default: TEXTBOOK_INDEX_WORKERS or all CPUs).')
+def warm_textbooks_command(workers):
+    """Extract and index every Synopsis/Dulcan page, skipping pages that haven't changed."""
+    import time
+    from app.pdf_extractor import warm_page_cache
+    for name, path in [('Synopsis', config.SYNOPSIS_PATH), ('Dulcan', config.DULCAN_PATH)]:
+        start = time.perf_counter()
+        try:
+            added = warm_page_cache(path, workers)
+        except FileNotFoundError:
+            click.echo(f'{name}: PDF not found at {path}, skipped.')
+            continue
+        click.echo(f'{name}: extracted {added} new or changed pages in {time.perf_counter() - start:.1f}s.')
+
+
+@click.command('generate-batch')
+@click.option('--gaps', is_flag=True, help='All level-2 topics without questions.')
+@click.option('--chapter', help='All level-2 topics of a chapter code.')
+@click.option('--topic', 'topic_ids', type=int, multiple=True, help='Explicit topic id (repeatable).')
+@click.option('--resume', 'resume_id', type=int, help='Resume an unfinished batch by id.')
+@click.option('--count', default=config.DEFAULT_QUESTION_COUNT, show_default=True,
+              type=click.IntRange(1, config.MAX_QUESTION_COUNT))
+@click.option('--difficulty', default='medium', show_default=True)
+@click.option('--clinical-task', default='mixed', show_default=True)
+@click.option('--concurrency', default=config.BATCH_CONCURRENCY, show_default=True)
+@click.option('--backend', type=click.Choice(['messages', 'message-batches']), default='messages',
+              show_default=True, help='message-batches submits all topics as one Message Batch.')
+@with_appcontext
+def generate_batch_command(gaps, chapter, topic_ids, resume_id, count, difficulty, clinical_task,
+                           concurrency, backend):
+    """Generate questions for many topics concurrently."""
+    from app.db import get_db
+    from app.jobs import gap_topic_ids, chapter_topic_ids, create_batch, run_batch, get_batch
+
+    if resume_id:
+        batch_id = resume_id
+    else:
+        db = get_db()
+        if gaps:
+            ids, description = gap_topic_ids(db), 'gaps'
+        elif chapter:
+            ids, description = chapter_topic_ids(db, chapter), f'chapter {chapter}'
+        elif topic_ids:
+            ids, description = list(topic_ids), 'selected topics'
+        else:
+            raise click.UsageError('Pass --gaps, --chapter, --topic or --resume.')
+        if not ids:
+            click.echo('No topics to generate.')
+            return
+        batch_id = create_batch(ids, count, difficulty, clinical_task, description, backend)
+        click.echo(f'Batch #{batch_id}: {len(ids)} topics.')
+
+    def report(job_id):
+        click.echo(f'  job {job_id} finished')
+
+    run_batch(current_app._get_current_object(), batch_id, concurrency, on_job_done=report)
+    summary = get_batch(batch_id)
+    click.echo(f"Batch #{batch_id} {summary['status']}: {summary['jobs']}, "
+               f"{summary['questions_created']} questions created.")
+    if summary['jobs'].get('running'):
+        click.echo(f"{summary['jobs']['running']} job(s) are running in another process; if it has stopped, "
+                   f"--resume again after {config.JOB_STALE_SECONDS}s.")
+
+
+@click.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any route query plans a full table scan or a temp sort."""
+    from app.query_plans import check_route_query_plans
+    problems = check_route_query_plans()
+    for url, sql, details in problems:
+        click.echo(f'{url}\n  {" ".join(sql.split())}')
+        for detail in details:
+            click.echo(f'    -> {detail}')
+    if problems:
+        raise click.ClickException(f'{len(problems)} statement(s) with a scan or temp sort.')
+    click.echo('All route queries use indexes.')
+
+
+@click.command('benchmark-export')
+@click.option('--questions', 'sizes', type=int, multiple=True, default=[150, 1500], show_default=True,
+              help='Exam size to benchmark (repeatable).')
+@click.option('--repeat', default=3, show_default=True)
+def benchmark_export_command(sizes, repeat):
+    """Compare the python-docx and streaming DOCX engines on synthetic exams."""
+    import io
+    import time
+    import tracemalloc
+    from app.exam_docx import build_document, fragments
+    from app.docx_stream import stream_docx
+
+    exam = {'title': 'מבחן לדוגמה', 'description': 'בחינת שלב א'}
+
+    def rows(n):
+        for i in range(1, n + 1):
+            yield {'position': i, 'stem_he': f'שאלה {i}: ' + 'מטופל בן 12 מופנה להערכה. ' * 6,
+                   'option_a': 'אפשרות ראשונה', 'option_b': 'אפשרות שנייה', 'option_c': 'אפשרות שלישית',
+                   'option_d': 'אפשרות רביעית', 'option_e': '', 'correct_answer': 'B',
+                   'explanation_he': 'הסבר: ' + 'לפי הספרות המקצועית. ' * 10}
+
+    def python_docx(n):
+        fragments.clear()
+        questions = list(rows(n))
+        buffer = io.BytesIO()
+        build_document(exam, questions).save(buffer)
+        return buffer.tell()
+
+    def streamed(n):
+        return sum(len(chunk) for chunk in stream_docx(exam, rows(n), rows(n)))
+
+    for n in sizes:
+        for name, engine in [('python-docx', python_docx), ('stream', streamed)]:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                size = engine(n)
+                times.append(time.perf_counter() - start)
+            # Memory is measured on a separate run; tracing slows python-docx down a lot
+            tracemalloc.start()
+            engine(n)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            click.echo(f'{n:>6} questions  {name:<12} best {min(times) * 1000:8.1f} ms  '
+                       f'peak {peak / 1024 / 1024:7.1f} MB  {size / 1024:8.1f} KB')
+
+
+@click.command('import-questions')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json', 'jsonl', 'docx']),
+              help='Source format (default: from the file extension).')
+@click.option('--topic', 'default_topic_id', type=int, help='Topic id for records that name no topic.')
+@click.option('--status', default='draft', show_default=True,
+              type=click.Choice(['draft', 'review', 'approved', 'rejected']))
+@click.option('--dry-run', is_flag=True, help='Validate and report without inserting.')
+@with_appcontext
+def import_questions_command(path, fmt, default_topic_id, status, dry_run):
+    """Import a question bank from CSV, JSON, JSONL or DOCX."""
+    import time
+    from app.db import get_db
+    from app.importer import import_file, ImportFormatError
+
+    start = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            report = import_file(get_db(), f, path, fmt=fmt, default_topic_id=default_topic_id,
+                                 status=status, dry_run=dry_run)
+    except ImportFormatError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - start
+
+    for number, errors in report['errors']:
+        click.echo(f'  record {number}: {"; ".join(errors)}')
+    for name, count in report['unmatched_topics'].most_common():
+        click.echo(f'  unknown topic {name!r}: {count} record(s)')
+    action = 'would insert' if dry_run else 'inserted'
+    click.echo(f"{report['read']} records read, {report['invalid']} invalid, "
+               f"{report['valid'] if dry_run else report['inserted']} {action} in {elapsed:.2f}s.")
+
+
+@click.command('index-duplicates')
+@click.option('--rescan', is_flag=True, help='Also re-flag every question against the older ones.')
+@with_appcontext
+def index_duplicates_command(rescan):
+    """Embed questions missing from the near-duplicate index."""
+    import time
+    from app.db import get_db
+    from app.duplicates import get_index, rescan as rescan_bank
+
+    db = get_db()
+    start = time.perf_counter()
+    index = get_index(db)
+    click.echo(f'{index.size} questions indexed in {time.perf_counter() - start:.2f}s.')
+    if rescan:
+        start = time.perf_counter()
+        flagged = rescan_bank(db)
+        click.echo(f'{flagged} possible duplicates flagged in {time.perf_counter() - start:.2f}s.')
+
+
+@click.command('output-token-stats')
+@click.option('--days', default=90, show_default=True, help='Only generations from the last N days.')
+@with_appcontext
+def output_token_stats_command(days):
+    """Measure output tokens per question in generation_log to size OUTPUT_TOKENS_PER_QUESTION."""
+    from app.db import get_db
+
+    rows = get_db().execute(
+        "SELECT output_tokens, questions_created, stop_reason FROM generation_log "
+        "WHERE from_cache = 0 AND output_tokens > 0 AND created_at >= datetime('now', ?)",
+        (f'-{days} days',)
+    ).fetchall()
+    truncated = sum(1 for r in rows if r['stop_reason'] == 'max_tokens')
+    # Suppressed duplicates aren't counted in questions_created, which only errs high
+    per_question = sorted(r['output_tokens'] / r['questions_created'] for r in rows
+                          if r['questions_created'] and r['stop_reason'] != 'max_tokens')
+    if not per_question:
+        raise click.ClickException('No logged generations with output token counts yet.')
+
+    def percentile(p):
+        return per_question[min(len(per_question) - 1, int(p * len(per_question)))]
+
+    click.echo(f'{len(rows)} generations, {truncated} cut off at max_tokens.')
+    click.echo(f'Output tokens per question: median {percentile(0.5):.0f}, p95 {percentile(0.95):.0f}, '
+               f'max {per_question[-1]:.0f}.')
+    suggested = -(-int(percentile(0.95) * 1.2) // 100) * 100
+    click.echo(f'OUTPUT_TOKENS_PER_QUESTION is {config.OUTPUT_TOKENS_PER_QUESTION}; '
+               f'p95 + 20% suggests {suggested}.')
+
+
+def register_commands(app):
+    app.cli.add_command(warm_textbooks_command)
+    app.cli.add_command(generate_batch_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(benchmark_export_command)
+    app.cli.add_command(import_questions_command)
+    app.cli.add_command(index_duplicates_command)
+    app.cli.add_command(output_token_stats_command)
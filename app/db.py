@@ -1,7 +1,9 @@
 import sqlite3
 import os
+import threading
 import config
 from app.syllabus_loader import import_syllabus_data
+from app.search import register_functions as register_search_functions
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS topics (
@@ -48,6 +50,8 @@ CREATE TABLE IF NOT EXISTS questions (
     status TEXT DEFAULT 'draft',
     source_info TEXT DEFAULT '',
     ai_generated INTEGER DEFAULT 0,
+    duplicate_of INTEGER,
+    dup_score REAL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (topic_id) REFERENCES topics(id)
@@ -85,42 +89,321 @@ CREATE TABLE IF NOT EXISTS generation_log (
     questions_created INTEGER DEFAULT 0,
     model_used TEXT DEFAULT '',
     tokens_used INTEGER DEFAULT 0,
+    cache_read_tokens INTEGER DEFAULT 0,
+    cache_write_tokens INTEGER DEFAULT 0,
+    from_cache INTEGER DEFAULT 0,
+    output_tokens INTEGER DEFAULT 0,
+    stop_reason TEXT DEFAULT '',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Finished (and in-flight) generation requests by fingerprint, see app.generation_cache
+CREATE TABLE IF NOT EXISTS generation_cache (
+    fingerprint TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    topic_id INTEGER,
+    raw_response TEXT DEFAULT '',
+    question_ids TEXT DEFAULT '[]',
+    hits INTEGER DEFAULT 0,
+    created_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_generation_cache_status_created ON generation_cache(status, created_at);
+
+-- One-time tokens for the generation stream: a POST stores the form, the
+-- EventSource GET consumes it, so a plain GET can never start a generation
+CREATE TABLE IF NOT EXISTS stream_tokens (
+    token TEXT PRIMARY KEY,
+    params TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_stream_tokens_created ON stream_tokens(created_at);
+
+CREATE TABLE IF NOT EXISTS generation_batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    description TEXT DEFAULT '',
+    status TEXT DEFAULT 'queued',
+    backend TEXT DEFAULT 'messages',
+    api_batch_id TEXT DEFAULT '',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic_id INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT DEFAULT 'queued',
+    question_ids TEXT DEFAULT '[]',
+    error TEXT DEFAULT '',
+    batch_id INTEGER,
+    attempts INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    from_cache INTEGER DEFAULT 0,
+    FOREIGN KEY (topic_id) REFERENCES topics(id),
+    FOREIGN KEY (batch_id) REFERENCES generation_batches(id)
+);
+
+-- Change counters, bumped by triggers; used to validate in-process caches
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO data_versions (name) VALUES ('questions');
+
+CREATE TRIGGER IF NOT EXISTS questions_version_insert AFTER INSERT ON questions BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'questions';
+END;
+
+CREATE TRIGGER IF NOT EXISTS questions_version_update AFTER UPDATE ON questions BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'questions';
+END;
+
+CREATE TRIGGER IF NOT EXISTS questions_version_delete AFTER DELETE ON questions BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'questions';
+END;
+
+INSERT OR IGNORE INTO data_versions (name) VALUES ('topics');
+
+CREATE TRIGGER IF NOT EXISTS topics_version_insert AFTER INSERT ON topics BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'topics';
+END;
+
+CREATE TRIGGER IF NOT EXISTS topics_version_update AFTER UPDATE ON topics BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'topics';
+END;
+
+CREATE TRIGGER IF NOT EXISTS topics_version_delete AFTER DELETE ON topics BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'topics';
+END;
+
+CREATE TRIGGER IF NOT EXISTS topic_mappings_version_insert AFTER INSERT ON topic_mappings BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'topics';
+END;
+
+CREATE TRIGGER IF NOT EXISTS topic_mappings_version_update AFTER UPDATE ON topic_mappings BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'topics';
+END;
+
+CREATE TRIGGER IF NOT EXISTS topic_mappings_version_delete AFTER DELETE ON topic_mappings BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'topics';
+END;
+
+INSERT OR IGNORE INTO data_versions (name) VALUES ('exams');
+
+CREATE TRIGGER IF NOT EXISTS exams_version_insert AFTER INSERT ON exams BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'exams';
+END;
+
+CREATE TRIGGER IF NOT EXISTS exams_version_update AFTER UPDATE ON exams BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'exams';
+END;
+
+CREATE TRIGGER IF NOT EXISTS exams_version_delete AFTER DELETE ON exams BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'exams';
+END;
+
+CREATE TRIGGER IF NOT EXISTS exam_questions_version_insert AFTER INSERT ON exam_questions BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'exams';
+END;
+
+CREATE TRIGGER IF NOT EXISTS exam_questions_version_update AFTER UPDATE ON exam_questions BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'exams';
+END;
+
+CREATE TRIGGER IF NOT EXISTS exam_questions_version_delete AFTER DELETE ON exam_questions BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'exams';
+END;
+
+-- Per-topic question counts by status, kept current by the triggers below so
+-- the dashboard and coverage API don't aggregate the whole bank per request.
+CREATE TABLE IF NOT EXISTS topic_coverage (
+    topic_id INTEGER PRIMARY KEY,
+    chapter_code TEXT NOT NULL DEFAULT '',
+    total INTEGER NOT NULL DEFAULT 0,
+    draft INTEGER NOT NULL DEFAULT 0,
+    review INTEGER NOT NULL DEFAULT 0,
+    approved INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS topic_coverage_insert AFTER INSERT ON questions BEGIN
+    INSERT OR IGNORE INTO topic_coverage (topic_id, chapter_code)
+    VALUES (NEW.topic_id, COALESCE((SELECT chapter_code FROM topics WHERE id = NEW.topic_id), ''));
+    UPDATE topic_coverage SET total = total + 1,
+        draft = draft + (NEW.status = 'draft'), review = review + (NEW.status = 'review'),
+        approved = approved + (NEW.status = 'approved'), rejected = rejected + (NEW.status = 'rejected')
+    WHERE topic_id = NEW.topic_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS topic_coverage_update AFTER UPDATE OF topic_id, status ON questions BEGIN
+    UPDATE topic_coverage SET total = total - 1,
+        draft = draft - (OLD.status = 'draft'), review = review - (OLD.status = 'review'),
+        approved = approved - (OLD.status = 'approved'), rejected = rejected - (OLD.status = 'rejected')
+    WHERE topic_id = OLD.topic_id;
+    INSERT OR IGNORE INTO topic_coverage (topic_id, chapter_code)
+    VALUES (NEW.topic_id, COALESCE((SELECT chapter_code FROM topics WHERE id = NEW.topic_id), ''));
+    UPDATE topic_coverage SET total = total + 1,
+        draft = draft + (NEW.status = 'draft'), review = review + (NEW.status = 'review'),
+        approved = approved + (NEW.status = 'approved'), rejected = rejected + (NEW.status = 'rejected')
+    WHERE topic_id = NEW.topic_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS topic_coverage_delete AFTER DELETE ON questions BEGIN
+    UPDATE topic_coverage SET total = total - 1,
+        draft = draft - (OLD.status = 'draft'), review = review - (OLD.status = 'review'),
+        approved = approved - (OLD.status = 'approved'), rejected = rejected - (OLD.status = 'rejected')
+    WHERE topic_id = OLD.topic_id;
+END;
+
+-- Full-text index over questions, kept in sync by the triggers below.
+-- he_normalize/he_index_terms are registered on every connection (app.search).
+CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+    stem, options, explanation, terms,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+    INSERT INTO questions_fts (rowid, stem, options, explanation, terms)
+    VALUES (NEW.id, he_normalize(NEW.stem_he),
+            he_normalize(NEW.option_a || ' ' || NEW.option_b || ' ' || NEW.option_c || ' ' ||
+                         NEW.option_d || ' ' || COALESCE(NEW.option_e, '')),
+            he_normalize(NEW.explanation_he),
+            he_index_terms(NEW.stem_he,
+                           NEW.option_a || ' ' || NEW.option_b || ' ' || NEW.option_c || ' ' ||
+                           NEW.option_d || ' ' || COALESCE(NEW.option_e, ''),
+                           NEW.explanation_he));
+END;
+
+CREATE TRIGGER IF NOT EXISTS questions_fts_update
+AFTER UPDATE OF stem_he, option_a, option_b, option_c, option_d, option_e, explanation_he ON questions BEGIN
+    DELETE FROM questions_fts WHERE rowid = OLD.id;
+    INSERT INTO questions_fts (rowid, stem, options, explanation, terms)
+    VALUES (NEW.id, he_normalize(NEW.stem_he),
+            he_normalize(NEW.option_a || ' ' || NEW.option_b || ' ' || NEW.option_c || ' ' ||
+                         NEW.option_d || ' ' || COALESCE(NEW.option_e, '')),
+            he_normalize(NEW.explanation_he),
+            he_index_terms(NEW.stem_he,
+                           NEW.option_a || ' ' || NEW.option_b || ' ' || NEW.option_c || ' ' ||
+                           NEW.option_d || ' ' || COALESCE(NEW.option_e, ''),
+                           NEW.explanation_he));
+END;
+
+CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+    DELETE FROM questions_fts WHERE rowid = OLD.id;
+END;
+
+-- Near-duplicate vectors (app.duplicates); dropped when the question's text
+-- changes so it is re-embedded, and counted so processes can tell their
+-- in-memory index is stale.
+CREATE TABLE IF NOT EXISTS question_vectors (
+    question_id INTEGER PRIMARY KEY,
+    vector BLOB NOT NULL
+);
+
+INSERT OR IGNORE INTO data_versions (name) VALUES ('vectors');
+
+CREATE TRIGGER IF NOT EXISTS question_vectors_version_insert AFTER INSERT ON question_vectors BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'vectors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS question_vectors_version_delete AFTER DELETE ON question_vectors BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'vectors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS question_vectors_text_update
+AFTER UPDATE OF stem_he, option_a, option_b, option_c, option_d, option_e ON questions BEGIN
+    DELETE FROM question_vectors WHERE question_id = OLD.id;
+    INSERT OR IGNORE INTO questions_unembedded (question_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS question_vectors_question_delete AFTER DELETE ON questions BEGIN
+    DELETE FROM question_vectors WHERE question_id = OLD.id;
+    DELETE FROM questions_unembedded WHERE question_id = OLD.id;
+END;
+
+-- Questions without a vector yet (imported, edited), so the index only has to
+-- embed these instead of searching the whole bank for them
+CREATE TABLE IF NOT EXISTS questions_unembedded (
+    question_id INTEGER PRIMARY KEY
+);
+
+CREATE TRIGGER IF NOT EXISTS questions_unembedded_insert AFTER INSERT ON questions BEGIN
+    INSERT OR IGNORE INTO questions_unembedded (question_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS questions_unembedded_vector AFTER INSERT ON question_vectors BEGIN
+    DELETE FROM questions_unembedded WHERE question_id = NEW.question_id;
+END;
+
+-- Composite indexes matching the routes' WHERE + ORDER BY so hot queries
+-- neither scan nor sort; `flask check-query-plans` guards this.
 CREATE INDEX IF NOT EXISTS idx_questions_topic ON questions(topic_id);
-CREATE INDEX IF NOT EXISTS idx_questions_status ON questions(status);
-CREATE INDEX IF NOT EXISTS idx_exam_questions_exam ON exam_questions(exam_id);
+CREATE INDEX IF NOT EXISTS idx_questions_created ON questions(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_questions_status_created ON questions(status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_questions_status_difficulty ON questions(status, difficulty, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_questions_difficulty_created ON questions(difficulty, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_questions_topic_created ON questions(topic_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_topics_level_chapter ON topics(level, chapter_code);
+CREATE INDEX IF NOT EXISTS idx_topics_level_parent ON topics(level, parent_id);
+CREATE INDEX IF NOT EXISTS idx_topics_parent ON topics(parent_id);
+CREATE INDEX IF NOT EXISTS idx_topics_chapter ON topics(chapter_code);
+CREATE INDEX IF NOT EXISTS idx_exams_created ON exams(created_at);
+CREATE INDEX IF NOT EXISTS idx_exam_questions_position ON exam_questions(exam_id, position);
+CREATE INDEX IF NOT EXISTS idx_exam_questions_question ON exam_questions(question_id);
 CREATE INDEX IF NOT EXISTS idx_question_tags_qid ON question_tags(question_id);
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs(status);
 """
 
 
+_local = threading.local()
+
+
+def connect(path=None):
+    """Open a SQLite connection with the app's pragmas applied."""
+    conn = sqlite3.connect(path or config.DB_PATH, timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    register_search_functions(conn)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA busy_timeout = {int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{int(config.SQLITE_CACHE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(config.SQLITE_MMAP_BYTES)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
 def get_db():
-    """Get a database connection, reusing one from Flask's g if available."""
-    try:
-        from flask import g
-        if 'db' not in g:
-            g.db = sqlite3.connect(config.DB_PATH)
-            g.db.row_factory = sqlite3.Row
-            g.db.execute("PRAGMA foreign_keys = ON")
-        return g.db
-    except RuntimeError:
-        # Outside Flask request context (e.g., CLI scripts, init)
-        conn = sqlite3.connect(config.DB_PATH)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+    """Get this thread's database connection, opening it on first use.
+
+    Connections are kept per thread and reused across requests instead of
+    reconnecting each time; close_db only ends any open transaction.
+    """
+    conn = getattr(_local, 'db', None)
+    if conn is None or _local.db_path != config.DB_PATH:
+        conn = connect()
+        _local.db = conn
+        _local.db_path = config.DB_PATH
+    return conn
 
 
 def close_db(e=None):
-    """Close the database connection at the end of a request."""
-    try:
-        from flask import g
-        db = g.pop('db', None)
-        if db is not None:
-            db.close()
-    except RuntimeError:
-        pass
+    """Return the connection to a clean state at the end of a request."""
+    conn = getattr(_local, 'db', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def data_version(db, name):
+    """Current change counter for a group of tables (see data_versions)."""
+    row = db.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+    return row['version'] if row else 0
 
 
 def _migrate_db(conn):
@@ -130,11 +413,111 @@ def _migrate_db(conn):
     if 'question_type' not in columns:
         conn.execute("ALTER TABLE questions ADD COLUMN question_type TEXT DEFAULT ''")
         conn.commit()
+    if 'duplicate_of' not in columns:
+        conn.execute("ALTER TABLE questions ADD COLUMN duplicate_of INTEGER")
+        conn.execute("ALTER TABLE questions ADD COLUMN dup_score REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_duplicate ON questions(duplicate_of)")
+    conn.commit()
+
+    # Index questions that predate the full-text table
+    indexed = conn.execute("SELECT COUNT(*) FROM questions_fts").fetchone()[0]
+    if not indexed and conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]:
+        conn.execute("""
+            INSERT INTO questions_fts (rowid, stem, options, explanation, terms)
+            SELECT id, he_normalize(stem_he),
+                   he_normalize(option_a || ' ' || option_b || ' ' || option_c || ' ' ||
+                                option_d || ' ' || COALESCE(option_e, '')),
+                   he_normalize(explanation_he),
+                   he_index_terms(stem_he,
+                                  option_a || ' ' || option_b || ' ' || option_c || ' ' ||
+                                  option_d || ' ' || COALESCE(option_e, ''),
+                                  explanation_he)
+            FROM questions
+        """)
+        conn.commit()
+
+    # Vector triggers from before questions_unembedded: recreate them from SCHEMA
+    stale_triggers = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+        "AND name IN ('question_vectors_text_update', 'question_vectors_question_delete') "
+        "AND sql NOT LIKE '%questions_unembedded%'")]
+    if stale_triggers:
+        for name in stale_triggers:
+            conn.execute(f"DROP TRIGGER {name}")
+        conn.executescript(SCHEMA)
+
+    # Queue questions that predate questions_unembedded and have no vector
+    if (not conn.execute("SELECT COUNT(*) FROM questions_unembedded").fetchone()[0]
+            and conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+            != conn.execute("SELECT COUNT(*) FROM question_vectors").fetchone()[0]):
+        conn.execute("""
+            INSERT OR IGNORE INTO questions_unembedded (question_id)
+            SELECT q.id FROM questions q
+            LEFT JOIN question_vectors v ON v.question_id = q.id
+            WHERE v.question_id IS NULL
+        """)
+        conn.commit()
+
+    cursor = conn.execute("PRAGMA table_info(generation_log)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'cache_read_tokens' not in columns:
+        conn.execute("ALTER TABLE generation_log ADD COLUMN cache_read_tokens INTEGER DEFAULT 0")
+        conn.execute("ALTER TABLE generation_log ADD COLUMN cache_write_tokens INTEGER DEFAULT 0")
+        conn.commit()
+    if 'from_cache' not in columns:
+        conn.execute("ALTER TABLE generation_log ADD COLUMN from_cache INTEGER DEFAULT 0")
+        conn.commit()
+    if 'output_tokens' not in columns:
+        conn.execute("ALTER TABLE generation_log ADD COLUMN output_tokens INTEGER DEFAULT 0")
+        conn.execute("ALTER TABLE generation_log ADD COLUMN stop_reason TEXT DEFAULT ''")
+        conn.commit()
+
+    cursor = conn.execute("PRAGMA table_info(generation_jobs)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'batch_id' not in columns:
+        conn.execute("ALTER TABLE generation_jobs ADD COLUMN batch_id INTEGER")
+        conn.execute("ALTER TABLE generation_jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+    if 'updated_at' not in columns:
+        conn.execute("ALTER TABLE generation_jobs ADD COLUMN updated_at TIMESTAMP")
+        conn.execute("UPDATE generation_jobs SET updated_at = COALESCE(finished_at, started_at, created_at)")
+    if 'from_cache' not in columns:
+        conn.execute("ALTER TABLE generation_jobs ADD COLUMN from_cache INTEGER DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_batch ON generation_jobs(batch_id)")
+    conn.commit()
+
+    cursor = conn.execute("PRAGMA table_info(generation_batches)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'backend' not in columns:
+        conn.execute("ALTER TABLE generation_batches ADD COLUMN backend TEXT DEFAULT 'messages'")
+        conn.execute("ALTER TABLE generation_batches ADD COLUMN api_batch_id TEXT DEFAULT ''")
+        conn.commit()
+
+    # Build the coverage summary for questions that predate it
+    if (not conn.execute("SELECT COUNT(*) FROM topic_coverage").fetchone()[0]
+            and conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]):
+        conn.execute("""
+            INSERT INTO topic_coverage (topic_id, chapter_code, total, draft, review, approved, rejected)
+            SELECT q.topic_id, COALESCE(t.chapter_code, ''), COUNT(*),
+                   SUM(q.status = 'draft'), SUM(q.status = 'review'),
+                   SUM(q.status = 'approved'), SUM(q.status = 'rejected')
+            FROM questions q
+            LEFT JOIN topics t ON t.id = q.topic_id
+            GROUP BY q.topic_id
+        """)
+        conn.commit()
+
+    # Superseded by the composite indexes in SCHEMA
+    conn.execute("DROP INDEX IF EXISTS idx_questions_status")
+    conn.execute("DROP INDEX IF EXISTS idx_exam_questions_exam")
+    conn.commit()
 
 
 def init_db(app):
     os.makedirs(config.DATA_DIR, exist_ok=True)
-    conn = sqlite3.connect(config.DB_PATH)
+    conn = connect()
+    # WAL lets readers keep going while generation jobs write; the mode is
+    # stored in the database file, so setting it once here covers every connection.
+    conn.execute("PRAGMA journal_mode = WAL")
     conn.executescript(SCHEMA)
     _migrate_db(conn)
     conn.close()
@@ -0,0 +1,132 @@
+"""Streaming DOCX writer: emits word/document.xml directly into a zip stream.
+
+python-docx builds the whole document as an lxml tree before saving, so memory
+and time grow with the exam. This engine writes the same markup (RTL
+w:bidi/w:rtl, David font, answer key on its own page) from string templates
+while iterating the question rows, and hands out the zip bytes as they are
+produced. Every part other than document.xml is copied from python-docx's
+default template, so styles and settings match the python-docx engine.
+"""
+import os
+import zipfile
+from xml.sax.saxutils import escape
+import docx
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(docx.__file__), 'templates', 'default.docx')
+DOCUMENT_PART = 'word/document.xml'
+
+# Sizes in half-points, indents in twips (1 cm = 567)
+PARAGRAPH = '<w:p><w:pPr><w:bidi/>{ind}{jc}</w:pPr>{runs}</w:p>'
+RUN = ('<w:r><w:rPr><w:rFonts w:ascii="David" w:hAnsi="David" w:cs="David"/>{bold}'
+       '<w:sz w:val="{size}"/><w:szCs w:val="{size}"/><w:rtl/></w:rPr>'
+       '<w:t xml:space="preserve">{text}</w:t></w:r>')
+EMPTY_PARAGRAPH = '<w:p/>'
+PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+OPTION_LETTERS = [('א', 'option_a'), ('ב', 'option_b'), ('ג', 'option_c'), ('ד', 'option_d'),
+                  ('ה', 'option_e')]
+ANSWER_MAP = {'A': 'א', 'B': 'ב', 'C': 'ג', 'D': 'ד', 'E': 'ה'}
+
+_template = None
+
+
+def _template_parts():
+    """(other parts as [(name, bytes)], document.xml head, tail) from the default template."""
+    global _template
+    if _template is None:
+        with zipfile.ZipFile(TEMPLATE_PATH) as zf:
+            parts = [(info.filename, zf.read(info)) for info in zf.infolist() if info.filename != DOCUMENT_PART]
+            xml = zf.read(DOCUMENT_PART).decode('utf-8')
+        head, rest = xml.split('<w:body>', 1)
+        sect_pr = rest.split('</w:body>', 1)[0].strip()
+        tail = sect_pr.replace('</w:sectPr>', '<w:bidi/></w:sectPr>') + '</w:body></w:document>'
+        _template = (parts, head + '<w:body>', tail)
+    return _template
+
+
+def _paragraph(text, size=12, bold=False, indent_twips=0, center=False):
+    run = RUN.format(bold='<w:b/>' if bold else '', size=size * 2, text=escape(text))
+    return PARAGRAPH.format(ind=f'<w:ind w:left="{indent_twips}"/>' if indent_twips else '',
+                            jc='<w:jc w:val="center"/>' if center else '', runs=run)
+
+
+def document_chunks(exam, questions, answers):
+    """Yield document.xml as strings, one question block at a time.
+
+    questions and answers are iterables of rows (they are read once each, so
+    they can be two database cursors over the same ordered rows). Either may be
+    None to leave out the questions or the answer key.
+    """
+    _, head, tail = _template_parts()
+    yield head
+    yield _paragraph(exam['title'], size=18, bold=True, center=True)
+    if exam['description']:
+        yield _paragraph(exam['description'], size=11, center=True)
+    yield EMPTY_PARAGRAPH
+
+    for q in questions or ():
+        block = [_paragraph(f'{q["position"]}. {q["stem_he"]}', bold=True)]
+        for letter, field in OPTION_LETTERS:
+            if q[field]:
+                block.append(_paragraph(f'   {letter}. {q[field]}', indent_twips=567))
+        block.append(EMPTY_PARAGRAPH)
+        yield ''.join(block)
+
+    if answers is None:
+        yield tail
+        return
+    if questions is not None:
+        yield PAGE_BREAK
+    yield _paragraph('מפתח תשובות', size=16, bold=True, center=True)
+    yield EMPTY_PARAGRAPH
+
+    for q in answers:
+        correct_he = ANSWER_MAP.get(q['correct_answer'], q['correct_answer'])
+        block = [_paragraph(f'{q["position"]}. {correct_he}', bold=True)]
+        if q['explanation_he']:
+            block.append(_paragraph(q['explanation_he'], size=10, indent_twips=284))
+        block.append(EMPTY_PARAGRAPH)
+        yield ''.join(block)
+
+    yield tail
+
+
+class ChunkSink:
+    """Write-only file object whose contents are drained as a zip is written into it."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_docx(exam, questions, answers, flush_bytes=64 * 1024):
+    """Yield the bytes of a DOCX file for exam, built as the rows are read."""
+    parts, _, _ = _template_parts()
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts:
+            zf.writestr(name, data)
+        yield sink.drain()
+        with zf.open(DOCUMENT_PART, 'w', force_zip64=True) as part:
+            pending = 0
+            for chunk in document_chunks(exam, questions, answers):
+                encoded = chunk.encode('utf-8')
+                part.write(encoded)
+                pending += len(encoded)
+                if pending >= flush_bytes:
+                    pending = 0
+                    data = sink.drain()
+                    if data:
+                        yield data
+    yield sink.drain()
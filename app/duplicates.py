@@ -0,0 +1,232 @@
+"""Near-duplicate detection for questions with an in-memory vector index.
+
+Each question (stem and options, normalized as for search) is embedded as a
+hashed bag of character trigrams: log term frequencies folded into
+DUPLICATE_VECTOR_DIM signed buckets by CRC32 and L2-normalized, so the cosine
+similarity of two questions is one dot product. Vectors are stored in the
+question_vectors table; each process keeps them as one float32 matrix and
+scores a new question against the whole bank with a single matrix-vector
+product. The matrix is reloaded when the 'vectors' change counter moves in a
+way this process didn't cause (another worker, deletes, edits), and questions
+without a vector (imported, edited), which triggers queue in
+questions_unembedded, are embedded on the next lookup.
+"""
+import threading
+import zlib
+from collections import Counter
+import numpy as np
+import config
+from app.db import data_version
+from app.search import normalize, WORD_RE
+
+NGRAM = 3
+OPTION_KEYS = ('A', 'B', 'C', 'D', 'E')
+OPTION_COLUMNS = ('option_a', 'option_b', 'option_c', 'option_d', 'option_e')
+
+
+def question_text(q):
+    """Text compared for duplicates: a generated question dict or a questions row."""
+    if 'stem' in q:
+        opts = q.get('options', {})
+        parts = [q.get('stem', '')] + [opts.get(k, '') for k in OPTION_KEYS]
+    else:
+        parts = [q['stem_he']] + [q[c] or '' for c in OPTION_COLUMNS]
+    return ' '.join(WORD_RE.findall(normalize(' '.join(parts))))
+
+
+def embed(text, dim=None):
+    dim = dim or config.DUPLICATE_VECTOR_DIM
+    padded = f' {text} '
+    counts = Counter(padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1))
+    vector = np.zeros(dim, dtype=np.float32)
+    if not counts:
+        return vector
+    hashes = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in counts), dtype=np.uint32, count=len(counts))
+    weights = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    weights[(hashes & 0x80000000) != 0] *= -1
+    np.add.at(vector, hashes % dim, weights)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    """Snapshot of the stored vectors: ids[i] is the question of matrix row i.
+
+    The backing array has spare rows so the newest snapshot can be extended
+    without copying; older snapshots only ever read their first `size` rows.
+    """
+
+    def __init__(self, version, ids, matrix, size=None):
+        self.version = version
+        self.questions_version = None
+        self.size = len(ids) if size is None else size
+        self._ids = ids
+        self._matrix = matrix
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def matrix(self):
+        return self._matrix[:self.size]
+
+    def nearest(self, vector):
+        """(question id, cosine similarity) of the closest stored question, or (None, 0.0)."""
+        if not self.size:
+            return None, 0.0
+        scores = self.matrix @ vector
+        best = int(np.argmax(scores))
+        return int(self.ids[best]), float(scores[best])
+
+    def extended(self, version, ids, vectors):
+        size = self.size + len(ids)
+        if size > len(self._ids):
+            capacity = max(size, 2 * len(self._ids), 1024)
+            new_ids = np.empty(capacity, dtype=np.int64)
+            new_matrix = np.empty((capacity, self._matrix.shape[1]), dtype=np.float32)
+            new_ids[:self.size] = self.ids
+            new_matrix[:self.size] = self.matrix
+        else:
+            new_ids, new_matrix = self._ids, self._matrix
+        new_ids[self.size:size] = ids
+        new_matrix[self.size:size] = vectors
+        index = VectorIndex(version, new_ids, new_matrix, size)
+        index.questions_version = self.questions_version
+        return index
+
+
+_cached = None
+_lock = threading.Lock()
+
+
+def _load(db, version):
+    rows = db.execute("SELECT question_id, vector FROM question_vectors ORDER BY question_id").fetchall()
+    dim = config.DUPLICATE_VECTOR_DIM
+    ids = np.fromiter((r['question_id'] for r in rows), dtype=np.int64, count=len(rows))
+    matrix = np.frombuffer(b''.join(r['vector'] for r in rows), dtype=np.float32).reshape(len(rows), dim).copy()
+    return VectorIndex(version, ids, matrix)
+
+
+def _embed_missing(db):
+    """Store vectors for questions that have none. Returns (ids, vectors) added."""
+    # CROSS JOIN keeps the (small) queue as the outer loop
+    rows = db.execute("""
+        SELECT q.id, q.stem_he, q.option_a, q.option_b, q.option_c, q.option_d, q.option_e
+        FROM questions_unembedded u
+        CROSS JOIN questions q ON q.id = u.question_id
+    """).fetchall()
+    ids = [r['id'] for r in rows]
+    vectors = [embed(question_text(r)) for r in rows]
+    if ids:
+        save_vectors(db, ids, vectors)
+        db.commit()
+    return ids, vectors
+
+
+def save_vectors(db, ids, vectors):
+    """Store question vectors (in the caller's transaction; call remember() after commit)."""
+    db.executemany("INSERT OR REPLACE INTO question_vectors (question_id, vector) VALUES (?, ?)",
+                   [(qid, np.asarray(v, dtype=np.float32).tobytes()) for qid, v in zip(ids, vectors)])
+
+
+def remember(db, ids, vectors):
+    """Add committed vectors to this process's index without reloading it.
+
+    Each stored vector bumps the 'vectors' counter once, so if it moved by
+    exactly len(ids) nobody else wrote in between; otherwise the index is left
+    stale and is reloaded on next use.
+    """
+    global _cached
+    if not ids:
+        return
+    with _lock:
+        version = data_version(db, 'vectors')
+        if _cached is not None and _cached.version + len(ids) == version:
+            _cached = _cached.extended(version, ids, np.asarray(vectors, dtype=np.float32))
+
+
+def get_index(db):
+    """The vector index of every question, up to date with the database."""
+    global _cached
+    with _lock:
+        questions_version = data_version(db, 'questions')
+        if _cached is None or _cached.questions_version != questions_version:
+            ids, vectors = _embed_missing(db)
+            version = data_version(db, 'vectors')
+            if _cached is not None and ids and _cached.version + len(ids) == version:
+                _cached = _cached.extended(version, ids, np.asarray(vectors, dtype=np.float32))
+        version = data_version(db, 'vectors')
+        if _cached is None or _cached.version != version:
+            _cached = _load(db, version)
+        _cached.questions_version = questions_version
+        return _cached
+
+
+class DuplicateScreen:
+    """Scores a generation's new questions against the bank and each other.
+
+    check() returns (vector, nearest question id, similarity); add() records an
+    inserted question so later questions of the same generation are compared
+    with it too, and stores its vector in the current transaction.
+    """
+
+    def __init__(self, db):
+        self.index = get_index(db)
+        self.ids = []
+        self.vectors = []
+        self._pending = 0
+
+    def check(self, q):
+        vector = embed(question_text(q))
+        best_id, best = self.index.nearest(vector)
+        if self.vectors:
+            scores = np.asarray(self.vectors) @ vector
+            i = int(np.argmax(scores))
+            if scores[i] > best:
+                best_id, best = self.ids[i], float(scores[i])
+        return vector, best_id, best
+
+    @staticmethod
+    def flagged(score):
+        return score >= config.DUPLICATE_FLAG_THRESHOLD
+
+    @staticmethod
+    def suppressed(score):
+        return config.DUPLICATE_SUPPRESS_THRESHOLD is not None and score >= config.DUPLICATE_SUPPRESS_THRESHOLD
+
+    def add(self, db, qid, vector):
+        save_vectors(db, [qid], [vector])
+        self.ids.append(qid)
+        self.vectors.append(vector)
+        self._pending += 1
+
+    def committed(self, db):
+        """Call after the inserts are committed to publish them to the shared index."""
+        if self._pending:
+            remember(db, self.ids[-self._pending:], self.vectors[-self._pending:])
+            self._pending = 0
+
+
+def rescan(db, block=1024):
+    """Set duplicate_of/dup_score for every question from its nearest older question.
+
+    Returns the number of questions flagged.
+    """
+    index = get_index(db)
+    order = np.argsort(index.ids)
+    ids, matrix = index.ids[order], index.matrix[order]
+    updates = []
+    for start in range(1, len(ids), block):
+        rows = matrix[start:start + block]
+        scores = rows @ matrix[:start + len(rows)].T
+        # Only compare with older questions (lower ids)
+        scores[np.triu_indices(len(rows), k=start, m=scores.shape[1])] = -1
+        best = scores.argmax(axis=1)
+        for offset, j in enumerate(best):
+            score = float(scores[offset, j])
+            duplicate_of = int(ids[j]) if DuplicateScreen.flagged(score) else None
+            updates.append((duplicate_of, round(score, 4), int(ids[start + offset])))
+    db.executemany("UPDATE questions SET duplicate_of = ?, dup_score = ? WHERE id = ?", updates)
+    db.commit()
+    return sum(1 for u in updates if u[0] is not None)
@@ -0,0 +1,276 @@
+"""Rendering of exams to DOCX, with on-disk and per-question caches.
+
+A rendered document is stored under EXPORT_CACHE_DIR keyed by exam id and a
+hash of everything it is built from (title, description and the ordered
+question rows), so an unchanged exam is served straight from disk. When it
+does change, each question's paragraphs are taken from an in-process cache of
+rendered XML fragments keyed by that question's own content, so editing one
+question only re-renders its block.
+"""
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from docx import Document
+from docx.shared import Pt, Cm
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from lxml import etree
+import config
+
+# Bump when the layout changes so cached documents and fragments are rebuilt
+RENDER_VERSION = 1
+
+QUESTION_FIELDS = ('position', 'stem_he', 'option_a', 'option_b', 'option_c', 'option_d', 'option_e',
+                   'correct_answer', 'explanation_he')
+
+OPTION_LETTERS = [('א', 'option_a'), ('ב', 'option_b'), ('ג', 'option_c'), ('ד', 'option_d')]
+ANSWER_MAP = {'A': 'א', 'B': 'ב', 'C': 'ג', 'D': 'ד', 'E': 'ה'}
+
+
+def set_rtl_paragraph(paragraph):
+    pPr = paragraph._element.get_or_add_pPr()
+    bidi = pPr.makeelement(qn('w:bidi'), {})
+    pPr.append(bidi)
+
+
+def set_rtl_run(run, font_name='David', font_size=12):
+    run.font.name = font_name
+    run.font.size = Pt(font_size)
+    rPr = run._element.get_or_add_rPr()
+    rtl_elem = rPr.makeelement(qn('w:rtl'), {})
+    rPr.append(rtl_elem)
+
+
+class FragmentCache:
+    """LRU of rendered paragraph XML, keyed by a hash of the content rendered."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            xml = self._entries.get(key)
+            if xml is not None:
+                self._entries.move_to_end(key)
+            return xml
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def put(self, key, xml):
+        with self._lock:
+            self._entries[key] = xml
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+fragments = FragmentCache(config.EXPORT_FRAGMENT_CACHE_SIZE)
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps([RENDER_VERSION, *parts], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _cached_block(doc, kind, q, fields, render):
+    """Append a question's block to doc, from the fragment cache when possible."""
+    key = _digest(kind, [q[f] for f in fields])
+    body = doc.element.body
+    xml = fragments.get(key)
+    if xml is not None:
+        for fragment in xml:
+            body.sectPr.addprevious(parse_xml(fragment))
+        return
+    last = body.sectPr.getprevious()  # new paragraphs are inserted before the trailing sectPr
+    render(doc, q)
+    added = []
+    el = last.getnext() if last is not None else body[0]
+    while el is not body.sectPr:
+        added.append(el)
+        el = el.getnext()
+    fragments.put(key, [etree.tostring(el) for el in added])
+
+
+def _render_question(doc, q):
+    q_para = doc.add_paragraph()
+    set_rtl_paragraph(q_para)
+    run = q_para.add_run(f'{q["position"]}. {q["stem_he"]}')
+    set_rtl_run(run)
+    run.bold = True
+
+    for letter, field in OPTION_LETTERS:
+        text = q[field]
+        if text:
+            opt_p = doc.add_paragraph()
+            set_rtl_paragraph(opt_p)
+            opt_p.paragraph_format.left_indent = Cm(1)
+            run = opt_p.add_run(f'   {letter}. {text}')
+            set_rtl_run(run)
+
+    if q['option_e']:
+        opt_p = doc.add_paragraph()
+        set_rtl_paragraph(opt_p)
+        opt_p.paragraph_format.left_indent = Cm(1)
+        run = opt_p.add_run(f'   ה. {q["option_e"]}')
+        set_rtl_run(run)
+
+    doc.add_paragraph()
+
+
+def _render_answer(doc, q):
+    ans_p = doc.add_paragraph()
+    set_rtl_paragraph(ans_p)
+    correct_he = ANSWER_MAP.get(q['correct_answer'], q['correct_answer'])
+    run = ans_p.add_run(f'{q["position"]}. {correct_he}')
+    set_rtl_run(run)
+    run.bold = True
+
+    if q['explanation_he']:
+        exp_p = doc.add_paragraph()
+        set_rtl_paragraph(exp_p)
+        exp_p.paragraph_format.left_indent = Cm(0.5)
+        run = exp_p.add_run(q['explanation_he'])
+        set_rtl_run(run, font_size=10)
+
+    doc.add_paragraph()
+
+
+def build_document(exam, questions):
+    """Render an exam (questions then answer key) to a python-docx Document."""
+    doc = Document()
+
+    # Document-level RTL
+    sect = doc.sections[0]._sectPr
+    bidi = sect.makeelement(qn('w:bidi'), {})
+    sect.append(bidi)
+
+    # Title
+    title_p = doc.add_paragraph()
+    set_rtl_paragraph(title_p)
+    title_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    run = title_p.add_run(exam['title'])
+    set_rtl_run(run, font_size=18)
+    run.bold = True
+
+    if exam['description']:
+        desc_p = doc.add_paragraph()
+        set_rtl_paragraph(desc_p)
+        desc_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        run = desc_p.add_run(exam['description'])
+        set_rtl_run(run, font_size=11)
+
+    doc.add_paragraph()  # spacing
+
+    for q in questions:
+        _cached_block(doc, 'question', q, QUESTION_FIELDS[:7], _render_question)
+
+    # Answer key
+    doc.add_page_break()
+    key_p = doc.add_paragraph()
+    set_rtl_paragraph(key_p)
+    key_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    run = key_p.add_run('מפתח תשובות')
+    set_rtl_run(run, font_size=16)
+    run.bold = True
+
+    doc.add_paragraph()
+
+    for q in questions:
+        _cached_block(doc, 'answer', q, ('position', 'correct_answer', 'explanation_he'), _render_answer)
+
+    return doc
+
+
+def question_rows(db, exam_id):
+    """Cursor over an exam's questions in order, with the fields the renderers use."""
+    return db.execute(f"""
+        SELECT eq.position, {', '.join('q.' + f for f in QUESTION_FIELDS[1:])}
+        FROM exam_questions eq
+        JOIN questions q ON q.id = eq.question_id
+        WHERE eq.exam_id = ?
+        ORDER BY eq.position
+    """, (exam_id,))
+
+
+def exam_rows(db, exam_id):
+    """(exam, ordered question rows) or (None, []) if the exam doesn't exist."""
+    exam = db.execute("SELECT * FROM exams WHERE id=?", (exam_id,)).fetchone()
+    if not exam:
+        return None, []
+    return exam, question_rows(db, exam_id).fetchall()
+
+
+def exam_digest(exam, questions, fields=QUESTION_FIELDS):
+    """Digest of an exam's content, naming its cached rendering and serving as its ETag.
+
+    fields=None covers every column of the question rows.
+    """
+    return _digest(exam['title'], exam['description'],
+                   [list(dict(q).items()) if fields is None else [q[f] for f in fields] for q in questions])
+
+
+def exam_docx_path(db, exam_id):
+    """Path of the exam's rendered DOCX, rendering it only if its content changed.
+
+    Returns (path, exam), or (None, None) if the exam doesn't exist.
+    """
+    exam, questions = exam_rows(db, exam_id)
+    if exam is None:
+        return None, None
+    return render_exam_docx(exam, questions), exam
+
+
+def render_exam_docx(exam, questions, digest=None):
+    """Path of the DOCX of exam with questions (exam_rows), rendered unless already cached."""
+    exam_id = exam['id']
+    digest = digest or exam_digest(exam, questions)
+    path = os.path.join(config.EXPORT_CACHE_DIR, f'exam-{exam_id}-{digest[:24]}.docx')
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(config.EXPORT_CACHE_DIR, exist_ok=True)
+    doc = build_document(exam, questions)
+    fd, tmp_path = tempfile.mkstemp(dir=config.EXPORT_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            doc.save(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    discard_exam(exam_id, keep=path)
+    return path
+
+
+def discard_exam(exam_id, keep=None):
+    """Remove an exam's cached renderings (e.g. after it is deleted).
+
+    With keep, only renderings older than keep go: a newer one belongs to a
+    concurrent request that rendered a later edit and may be about to send it.
+    """
+    cutoff = None
+    if keep is not None:
+        try:
+            cutoff = os.path.getmtime(keep)
+        except OSError:
+            return
+    for path in glob.glob(os.path.join(config.EXPORT_CACHE_DIR, f'exam-{exam_id}-*.docx')):
+        if path == keep:
+            continue
+        try:
+            if cutoff is None or os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
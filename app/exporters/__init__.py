@@ -0,0 +1,77 @@
+"""Exporter registry: each output format is a plugin module in this package.
+
+An exporter is a function decorated with @exporter(name, ...). It receives the
+document's meta ({'title', 'description'}) and an iterator of question dicts
+(see fetch_questions) and yields the file's bytes, so formats can stream and
+none of them queries the database itself.
+"""
+from collections import namedtuple
+
+Exporter = namedtuple('Exporter', 'name label extension mimetype render')
+
+EXPORTERS = {}
+
+# Answer letter -> question column
+CHOICES = [('A', 'option_a'), ('B', 'option_b'), ('C', 'option_c'), ('D', 'option_d'), ('E', 'option_e')]
+
+# Columns every exporter may rely on
+QUESTION_COLUMNS = """
+    q.id, q.topic_id, q.stem_he, q.option_a, q.option_b, q.option_c, q.option_d, q.option_e,
+    q.correct_answer, q.explanation_he, q.difficulty, q.bloom_level, q.question_type, q.status,
+    q.created_at, t.hebrew as topic_he, t.english as topic_en, t.chapter_code, t.chapter_he
+"""
+FETCH_BATCH = 500
+
+
+def exporter(name, label, extension, mimetype):
+    def register(render):
+        EXPORTERS[name] = Exporter(name, label, extension, mimetype, render)
+        return render
+    return register
+
+
+def get_exporter(name):
+    return EXPORTERS.get(name)
+
+
+def _batched(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+
+
+def fetch_questions(db, exam_id=None, status=None):
+    """Iterate question dicts for an exam (in exam order) or for the bank, fetched in batches.
+
+    Each dict has QUESTION_COLUMNS plus 'position' (the exam position, or a
+    running number for bank exports).
+    """
+    if exam_id is not None:
+        cursor = db.execute(f"""
+            SELECT eq.position, {QUESTION_COLUMNS}
+            FROM exam_questions eq
+            JOIN questions q ON q.id = eq.question_id
+            JOIN topics t ON t.id = q.topic_id
+            WHERE eq.exam_id = ?
+            ORDER BY eq.position
+        """, (exam_id,))
+        yield from _batched(cursor)
+        return
+
+    where, params = ("WHERE q.status = ?", (status,)) if status else ("", ())
+    cursor = db.execute(f"""
+        SELECT {QUESTION_COLUMNS}
+        FROM questions q
+        JOIN topics t ON t.id = q.topic_id
+        {where}
+        ORDER BY q.created_at, q.id
+    """, params)
+    for position, q in enumerate(_batched(cursor), 1):
+        q['position'] = position
+        yield q
+
+
+from app.exporters import docx, pdf, qti, moodle, json_dump  # noqa: E402,F401  (register plugins)
@@ -0,0 +1,9 @@
+from app.docx_stream import stream_docx
+from app.exporters import exporter
+
+
+@exporter('docx', 'Word', 'docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+def render(meta, questions):
+    # The answer key needs a second pass over the rows
+    questions = list(questions)
+    yield from stream_docx(meta, questions, questions)
@@ -0,0 +1,34 @@
+"""Compact JSON dump of questions, one object per question."""
+import json
+from app.exporters import exporter, CHOICES
+
+
+def question_dict(q):
+    return {
+        'id': q['id'],
+        'position': q['position'],
+        'topic_id': q['topic_id'],
+        'topic': q['topic_he'],
+        'topic_en': q['topic_en'],
+        'chapter': q['chapter_code'],
+        'stem': q['stem_he'],
+        'options': {letter: q[field] for letter, field in CHOICES if q[field]},
+        'answer': q['correct_answer'],
+        'explanation': q['explanation_he'],
+        'difficulty': q['difficulty'],
+        'bloom_level': q['bloom_level'],
+        'question_type': q['question_type'],
+        'status': q['status'],
+    }
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+@exporter('json', 'JSON', 'json', 'application/json')
+def render(meta, questions):
+    yield f'{{"title":{_dumps(meta["title"])},"questions":['.encode('utf-8')
+    for i, q in enumerate(questions):
+        yield (',' if i else '').encode('utf-8') + _dumps(question_dict(q)).encode('utf-8')
+    yield b']}'
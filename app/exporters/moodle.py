@@ -0,0 +1,40 @@
+"""Moodle XML (multichoice questions), for import through Moodle's question bank."""
+from html import escape
+from xml.sax.saxutils import escape as xml_escape
+from app.exporters import exporter, CHOICES
+
+
+def _html(text):
+    # HTML-escaped text can't contain "]]>", so it is safe inside CDATA
+    return f'<![CDATA[<div dir="rtl">{escape(text)}</div>]]>'
+
+
+def question_xml(q):
+    name = f'{q["position"]}. {q["stem_he"][:60]}'
+    answers = ''.join(
+        f'<answer fraction="{100 if letter == q["correct_answer"] else 0}" format="html">'
+        f'<text>{_html(q[field])}</text></answer>\n'
+        for letter, field in CHOICES if q[field]
+    )
+    tags = ''.join(f'<tag><text>{xml_escape(tag)}</text></tag>'
+                   for tag in (q['chapter_code'], q['topic_en'], q['difficulty']) if tag)
+    return (
+        '<question type="multichoice">\n'
+        f'<name><text>{xml_escape(name)}</text></name>\n'
+        f'<questiontext format="html"><text>{_html(q["stem_he"])}</text></questiontext>\n'
+        f'<generalfeedback format="html"><text>{_html(q["explanation_he"] or "")}</text></generalfeedback>\n'
+        '<defaultgrade>1</defaultgrade><penalty>0</penalty><hidden>0</hidden>\n'
+        '<single>true</single><shuffleanswers>false</shuffleanswers><answernumbering>none</answernumbering>\n'
+        f'{answers}<tags>{tags}</tags>\n'
+        '</question>\n'
+    )
+
+
+@exporter('moodle', 'Moodle XML', 'xml', 'application/xml')
+def render(meta, questions):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n<quiz>\n'
+           '<question type="category"><category><text>'
+           f'$course$/{xml_escape(meta["title"])}</text></category></question>\n').encode('utf-8')
+    for q in questions:
+        yield question_xml(q).encode('utf-8')
+    yield b'</quiz>\n'
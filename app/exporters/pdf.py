@@ -0,0 +1,62 @@
+"""RTL PDF export through PyMuPDF's Story (HTML layout with bidi support)."""
+import io
+from html import escape
+import fitz
+from app.docx_stream import OPTION_LETTERS, ANSWER_MAP
+from app.exporters import exporter
+
+CSS = """
+body { font-family: sans-serif; font-size: 11pt; }
+h1 { text-align: center; font-size: 18pt; }
+.desc { text-align: center; color: #555; }
+.stem { font-weight: bold; margin-top: 10pt; }
+.option { margin-right: 20pt; }
+.explanation { margin-right: 10pt; font-size: 9pt; color: #333; }
+"""
+
+PAGE_MARGIN = 50
+
+
+def _question_html(q):
+    parts = [f'<p class="stem">{q["position"]}. {escape(q["stem_he"])}</p>']
+    for letter, field in OPTION_LETTERS:
+        if q[field]:
+            parts.append(f'<p class="option">{letter}. {escape(q[field])}</p>')
+    return ''.join(parts)
+
+
+def _answer_html(q):
+    correct_he = ANSWER_MAP.get(q['correct_answer'], q['correct_answer'])
+    html = f'<p class="stem">{q["position"]}. {correct_he}</p>'
+    if q['explanation_he']:
+        html += f'<p class="explanation">{escape(q["explanation_he"])}</p>'
+    return html
+
+
+def _place(writer, story):
+    mediabox = fitz.paper_rect('a4')
+    where = mediabox + (PAGE_MARGIN, PAGE_MARGIN, -PAGE_MARGIN, -PAGE_MARGIN)
+    more = True
+    while more:
+        device = writer.begin_page(mediabox)
+        more, _ = story.place(where)
+        story.draw(device)
+        writer.end_page()
+
+
+@exporter('pdf', 'PDF', 'pdf', 'application/pdf')
+def render(meta, questions):
+    questions = list(questions)
+    head = f'<h1>{escape(meta["title"])}</h1>'
+    if meta.get('description'):
+        head += f'<p class="desc">{escape(meta["description"])}</p>'
+    body = ''.join(_question_html(q) for q in questions)
+    key = ''.join(_answer_html(q) for q in questions)
+
+    buffer = io.BytesIO()
+    writer = fitz.DocumentWriter(buffer)
+    _place(writer, fitz.Story(html=f'<body dir="rtl">{head}{body}</body>', user_css=CSS))
+    # The answer key starts on its own page
+    _place(writer, fitz.Story(html=f'<body dir="rtl"><h1>מפתח תשובות</h1>{key}</body>', user_css=CSS))
+    writer.close()
+    yield buffer.getvalue()
@@ -0,0 +1,59 @@
+"""IMS QTI 2.1 content package: one assessmentItem per question plus imsmanifest.xml."""
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+from app.docx_stream import ChunkSink
+from app.exporters import exporter, CHOICES
+
+ITEM = """<?xml version="1.0" encoding="UTF-8"?>
+<assessmentItem xmlns="http://www.imsglobal.org/xsd/imsqti_v2p1" identifier="{identifier}" title={title}
+    adaptive="false" timeDependent="false" xml:lang="he">
+  <responseDeclaration identifier="RESPONSE" cardinality="single" baseType="identifier">
+    <correctResponse><value>{correct}</value></correctResponse>
+  </responseDeclaration>
+  <outcomeDeclaration identifier="SCORE" cardinality="single" baseType="float">
+    <defaultValue><value>0</value></defaultValue>
+  </outcomeDeclaration>
+  <itemBody>
+    <choiceInteraction responseIdentifier="RESPONSE" shuffle="false" maxChoices="1">
+      <prompt>{stem}</prompt>
+{choices}
+    </choiceInteraction>
+  </itemBody>
+  <responseProcessing template="http://www.imsglobal.org/question/qti_v2p1/rptemplates/match_correct"/>
+</assessmentItem>
+"""
+CHOICE = '      <simpleChoice identifier="{identifier}">{text}</simpleChoice>'
+
+MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1" identifier="MANIFEST-EXPORT">
+  <metadata><schema>IMS Content</schema><schemaversion>1.1</schemaversion></metadata>
+  <organizations/>
+  <resources>
+{resources}
+  </resources>
+</manifest>
+"""
+RESOURCE = ('    <resource identifier="{identifier}" type="imsqti_item_xmlv2p1" href="{href}">'
+            '<file href="{href}"/></resource>')
+
+
+def item_xml(identifier, q):
+    choices = '\n'.join(CHOICE.format(identifier=letter, text=escape(q[field]))
+                        for letter, field in CHOICES if q[field])
+    return ITEM.format(identifier=identifier, title=quoteattr(f'{q["position"]}. {q["topic_he"]}'),
+                       correct=escape(q['correct_answer']), stem=escape(q['stem_he']), choices=choices)
+
+
+@exporter('qti', 'QTI 2.1', 'zip', 'application/zip')
+def render(meta, questions):
+    sink = ChunkSink()
+    resources = []
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for q in questions:
+            identifier = f'q{q["id"]}'
+            href = f'items/{identifier}.xml'
+            zf.writestr(href, item_xml(identifier, q))
+            resources.append(RESOURCE.format(identifier=identifier, href=href))
+            yield sink.drain()
+        zf.writestr('imsmanifest.xml', MANIFEST.format(resources='\n'.join(resources)))
+    yield sink.drain()
@@ -0,0 +1,108 @@
+"""Cache of generation results keyed by a fingerprint of the exact API request.
+
+Re-submitting the generate form with the same selections renders the same
+prompt, so the request's fingerprint (model, system prompt, max_tokens and the
+user prompt) identifies a call that was already paid for. A finished entry
+maps it to the questions that call created, which are returned instead of
+calling the API again, for GENERATION_CACHE_TTL_SECONDS.
+
+Concurrent identical requests are coalesced through the same table: the
+first one inserts a 'pending' row and makes the call, later ones wait for the
+row to turn 'done' and share its result. The row lives in the database, so
+this also works across worker processes; a pending row older than
+GENERATION_CACHE_LEASE_SECONDS is treated as abandoned. A waiter gives up
+after GENERATION_CACHE_WAIT_SECONDS and makes its own call rather than hold
+its request thread for the whole lease.
+"""
+import hashlib
+import json
+import time
+import config
+
+# claim() result when another request with the same fingerprint is still in flight
+BUSY = 'busy'
+
+
+def fingerprint(params):
+    """Hash of the Messages API parameters of a request."""
+    return hashlib.sha256(json.dumps(params, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _expire(db, now):
+    db.execute("DELETE FROM generation_cache WHERE (status = 'done' AND created_at < ?) "
+               "OR (status = 'pending' AND created_at < ?)",
+               (now - config.GENERATION_CACHE_TTL_SECONDS, now - config.GENERATION_CACHE_LEASE_SECONDS))
+
+
+def claim(db, fp, topic_id):
+    """Return a finished entry for fp, or None once this caller owns the pending entry.
+
+    A finished entry whose questions have all been deleted since is a miss.
+
+    Waits while another request with the same fingerprint is in flight, for at
+    most GENERATION_CACHE_WAIT_SECONDS; then returns BUSY and the caller makes
+    its own call without touching the other request's entry. The owner must
+    call complete() or release().
+    """
+    deadline = time.monotonic() + config.GENERATION_CACHE_WAIT_SECONDS
+    while True:
+        now = time.time()
+        _expire(db, now)
+        cursor = db.execute(
+            "INSERT OR IGNORE INTO generation_cache (fingerprint, status, topic_id, created_at) "
+            "VALUES (?, 'pending', ?, ?)", (fp, topic_id, now))
+        db.commit()
+        if cursor.rowcount:
+            return None
+        row = db.execute("SELECT * FROM generation_cache WHERE fingerprint = ?", (fp,)).fetchone()
+        if row and row['status'] == 'done':
+            ids = _existing(db, json.loads(row['question_ids']))
+            if not ids:
+                # Every cached question was deleted since: a miss, claim the entry on the next pass
+                db.execute("DELETE FROM generation_cache WHERE fingerprint = ? AND status = 'done'", (fp,))
+                db.commit()
+                continue
+            db.execute("UPDATE generation_cache SET hits = hits + 1 WHERE fingerprint = ?", (fp,))
+            db.commit()
+            return dict(row, question_ids=ids)
+        if time.monotonic() >= deadline:
+            return BUSY
+        time.sleep(config.GENERATION_CACHE_POLL_SECONDS)
+
+
+def _existing(db, ids):
+    """The ids that still exist (cached questions may have been deleted since)."""
+    if not ids:
+        return []
+    rows = db.execute(f"SELECT id FROM questions WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+    found = {r['id'] for r in rows}
+    return [i for i in ids if i in found]
+
+
+def complete(db, fp, topic_id, raw, question_ids):
+    """Store the result of fp's request and evict the oldest entries past the size limit.
+
+    A request that created no questions isn't cached, so the next one retries.
+    """
+    if not question_ids:
+        db.execute("DELETE FROM generation_cache WHERE fingerprint = ?", (fp,))
+        db.commit()
+        return
+    db.execute(
+        "INSERT OR REPLACE INTO generation_cache "
+        "(fingerprint, status, topic_id, raw_response, question_ids, created_at) VALUES (?, 'done', ?, ?, ?, ?)",
+        (fp, topic_id, raw, json.dumps(question_ids), time.time()))
+    db.execute("""
+        DELETE FROM generation_cache WHERE fingerprint IN (
+            SELECT fingerprint FROM generation_cache WHERE status = 'done'
+            ORDER BY created_at DESC LIMIT -1 OFFSET ?
+        )
+    """, (config.GENERATION_CACHE_MAX_ENTRIES,))
+    db.commit()
+
+
+def release(db, fp):
+    """Give up a pending entry (the request failed), letting a waiting request make the call."""
+    db.rollback()
+    db.execute("DELETE FROM generation_cache WHERE fingerprint = ? AND status = 'pending'", (fp,))
+    db.commit()
@@ -0,0 +1,45 @@
+"""Conditional GET (ETag / Last-Modified) backed by the data_versions counters.
+
+The validators come from one small query, so a client that already has the
+current version gets a 304 without the response being queried or rendered.
+"""
+from datetime import datetime, timezone
+from flask import request, make_response, current_app
+
+
+def data_stamp(db, *names):
+    """(etag, last_modified) for the current versions of the named data_versions counters."""
+    placeholders = ', '.join('?' for _ in names)
+    rows = {r['name']: r for r in db.execute(
+        f"SELECT name, version, updated_at FROM data_versions WHERE name IN ({placeholders})", names
+    )}
+    etag = '-'.join(f"{name}{rows[name]['version'] if name in rows else 0}" for name in names)
+    stamps = [rows[name]['updated_at'] for name in names if name in rows and rows[name]['updated_at']]
+    last_modified = None
+    if stamps:
+        last_modified = datetime.strptime(max(stamps), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return etag, last_modified
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(etag, last_modified, build):
+    """Return 304 if the client's validators match, else the response built by build().
+
+    Clients must revalidate every time (no-cache), so edits show up immediately.
+    """
+    if _not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,301 @@
+"""Bulk import of existing question banks (CSV, JSON, JSONL, DOCX).
+
+Sources are read record by record, each record is validated against the
+questions schema and its topic is resolved by id or Hebrew/English name, and
+valid rows are inserted with executemany in batches of IMPORT_BATCH_SIZE inside
+one transaction, so an import either lands whole or not at all. A dry run does
+the same reading and validation without writing anything.
+"""
+import csv
+import io
+import json
+import os
+import re
+from collections import Counter
+import config
+from app.taxonomy import get_taxonomy
+
+FORMATS = ('csv', 'json', 'jsonl', 'docx')
+EXTENSIONS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.docx': 'docx'}
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+STATUSES = ('draft', 'review', 'approved', 'rejected')
+LETTERS = 'ABCDE'
+OPTION_FIELDS = ['option_a', 'option_b', 'option_c', 'option_d', 'option_e']
+# Hebrew option letters and 1-5 are accepted for the correct answer as well as A-E
+ANSWER_ALIASES = {**{he: en for he, en in zip('אבגדה', LETTERS)},
+                  **{str(i): en for i, en in enumerate(LETTERS, 1)}}
+
+# Source column -> questions column (the json exporter's keys and the column names themselves)
+FIELD_ALIASES = {
+    'stem': 'stem_he', 'question': 'stem_he',
+    'a': 'option_a', 'b': 'option_b', 'c': 'option_c', 'd': 'option_d', 'e': 'option_e',
+    'answer': 'correct_answer', 'correct': 'correct_answer',
+    'explanation': 'explanation_he',
+    'clinical_task': 'question_type',
+}
+TOPIC_KEYS = ('topic', 'topic_he', 'topic_en', 'topic_id')
+
+INSERT_SQL = (
+    "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, option_e, "
+    "correct_answer, explanation_he, difficulty, bloom_level, question_type, status, source_info, ai_generated) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)"
+)
+MAX_REPORTED_ERRORS = 200
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def detect_format(filename):
+    fmt = EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if fmt is None:
+        raise ImportFormatError(f'סוג קובץ לא נתמך: {filename}')
+    return fmt
+
+
+# --- Readers: yield (record number, raw dict or None, parse error or None) ---
+
+def _text(stream):
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def read_csv(stream):
+    reader = csv.DictReader(_text(stream))
+    for row in reader:
+        yield reader.line_num, row, None
+
+
+def read_jsonl(stream):
+    for line_no, line in enumerate(_text(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f'JSON לא תקין: {e}'
+            continue
+        yield line_no, record, None
+
+
+def read_json(stream):
+    """A list of questions, or an object with a 'questions' list (as exported)."""
+    try:
+        data = json.load(_text(stream))
+    except ValueError as e:
+        raise ImportFormatError(f'JSON לא תקין: {e}')
+    if isinstance(data, dict):
+        data = data.get('questions')
+    if not isinstance(data, list):
+        raise ImportFormatError('קובץ JSON צריך להכיל רשימת שאלות')
+    for i, record in enumerate(data, 1):
+        yield i, record, None
+
+
+STEM_RE = re.compile(r'^(\d+)\s*[.)]\s*(.*)$')
+OPTION_RE = re.compile(r'^([א-הA-Ea-e])\s*[.)]\s*(.+)$')
+ANSWER_RE = re.compile(r'^(?:תשובה נכונה|תשובה|answer)\s*[:：]\s*(\S+)', re.IGNORECASE)
+EXPLANATION_RE = re.compile(r'^(?:הסבר|explanation)\s*[:：]\s*(.*)$', re.IGNORECASE)
+KEY_HEADING = 'מפתח תשובות'
+
+
+def read_docx(stream):
+    """Numbered stems followed by lettered options (א./A.), as the DOCX export writes them.
+
+    The answer comes from an inline "תשובה: ב" line or from a "מפתח תשובות"
+    section of "N. ב" lines, each optionally followed by its explanation.
+    """
+    import docx
+    try:
+        document = docx.Document(stream)
+    except Exception as e:
+        raise ImportFormatError(f'קובץ DOCX לא תקין: {e}')
+
+    questions = {}
+    current = None
+    in_key = False
+    for paragraph in document.paragraphs:
+        text = paragraph.text.strip()
+        if not text:
+            continue
+        if text == KEY_HEADING:
+            in_key, current = True, None
+            continue
+        stem = STEM_RE.match(text)
+        if in_key:
+            if stem and int(stem.group(1)) in questions:
+                current = questions[int(stem.group(1))]
+                answer = stem.group(2).split()
+                current['answer'] = answer[0] if answer else ''
+            elif current is not None:
+                current['explanation'] = (current['explanation'] + '\n' + text).strip()
+            continue
+
+        option = OPTION_RE.match(text)
+        answer = ANSWER_RE.match(text)
+        explanation = EXPLANATION_RE.match(text)
+        if stem:
+            current = {'stem': stem.group(2), 'options': {}, 'answer': '', 'explanation': ''}
+            questions.setdefault(int(stem.group(1)), current)
+        elif current is None:
+            continue  # title and description
+        elif option:
+            letter = ANSWER_ALIASES.get(option.group(1), option.group(1).upper())
+            current['options'][letter] = option.group(2)
+        elif answer:
+            current['answer'] = answer.group(1)
+        elif explanation:
+            current['explanation'] = explanation.group(1)
+        elif not current['options']:
+            current['stem'] += '\n' + text
+
+    for number, record in questions.items():
+        yield number, record, None
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'jsonl': read_jsonl, 'docx': read_docx}
+
+
+# --- Validation ---
+
+def topic_lookup(db):
+    """Lower-cased Hebrew/English topic name -> id; level-2 names win over subtopics."""
+    taxonomy = get_taxonomy(db)
+    names = {}
+    for topic in sorted(taxonomy.topics.values(), key=lambda t: -t['level']):
+        for name in (topic['hebrew'], topic['english']):
+            if name:
+                names[name.strip().casefold()] = topic['id']
+    return set(taxonomy.topics), names
+
+
+def _normalize(raw):
+    record = {}
+    for key, value in raw.items():
+        if key is None:
+            continue  # extra CSV cells
+        key = key.strip().lower()
+        if key == 'options' and isinstance(value, dict):
+            for letter, text in value.items():
+                letter = ANSWER_ALIASES.get(str(letter), str(letter).upper())
+                if letter in LETTERS:
+                    record[OPTION_FIELDS[LETTERS.index(letter)]] = text
+            continue
+        record[FIELD_ALIASES.get(key, key)] = value
+    return {k: (v.strip() if isinstance(v, str) else v) for k, v in record.items()}
+
+
+def _resolve_topic(record, topic_ids, names, default_topic_id):
+    """(topic id or None, the unmatched name/id if any). Names win over ids from another install."""
+    for key in ('topic', 'topic_he', 'topic_en'):
+        name = record.get(key)
+        if name:
+            found = names.get(str(name).casefold())
+            if found is not None:
+                return found, None
+    topic_id = record.get('topic_id')
+    if topic_id not in (None, ''):
+        try:
+            if int(topic_id) in topic_ids:
+                return int(topic_id), None
+        except (TypeError, ValueError):
+            pass
+    wanted = next((str(record[k]) for k in TOPIC_KEYS if record.get(k) not in (None, '')), None)
+    if wanted is None and default_topic_id is not None:
+        if default_topic_id in topic_ids:
+            return default_topic_id, None
+        wanted = str(default_topic_id)
+    return None, wanted
+
+
+def validate(raw, topic_ids, names, default_topic_id=None, status='draft', source=''):
+    """(row tuple for INSERT_SQL, [], unmatched topic name) or (None, [errors], unmatched topic name)."""
+    if not isinstance(raw, dict):
+        return None, ['רשומה אינה אובייקט'], None
+    record = _normalize(raw)
+    errors = []
+
+    stem = record.get('stem_he') or ''
+    if not stem:
+        errors.append('חסר גוף שאלה')
+    options = [str(record.get(field) or '') for field in OPTION_FIELDS]
+    missing = [LETTERS[i] for i in range(4) if not options[i]]
+    if missing:
+        errors.append(f'חסרים מסיחים: {", ".join(missing)}')
+
+    answer = str(record.get('correct_answer') or '').upper()
+    answer = ANSWER_ALIASES.get(answer, answer)
+    if answer not in LETTERS or not options[LETTERS.index(answer)]:
+        errors.append(f'תשובה נכונה לא תקינה: {record.get("correct_answer") or "(ריק)"}')
+
+    difficulty = record.get('difficulty') or 'medium'
+    if difficulty not in DIFFICULTIES:
+        errors.append(f'רמת קושי לא חוקית: {difficulty}')
+    row_status = record.get('status') or status
+    if row_status not in STATUSES:
+        errors.append(f'סטטוס לא חוקי: {row_status}')
+
+    topic_id, unmatched = _resolve_topic(record, topic_ids, names, default_topic_id)
+    if topic_id is None:
+        errors.append(f'נושא לא נמצא: {unmatched}' if unmatched else 'חסר נושא')
+
+    if errors:
+        return None, errors, unmatched
+    return (topic_id, stem, *options, answer, record.get('explanation_he') or '', difficulty,
+            record.get('bloom_level') or 'application', record.get('question_type') or '', row_status,
+            source), [], None
+
+
+# --- Import ---
+
+def import_questions(db, records, default_topic_id=None, status='draft', dry_run=False, source='',
+                     batch_size=None):
+    """Validate and insert records from a reader; returns the report dict.
+
+    Invalid records are skipped and reported; the valid ones are inserted
+    together, or not at all if anything fails mid-way.
+    """
+    batch_size = batch_size or config.IMPORT_BATCH_SIZE
+    topic_ids, names = topic_lookup(db)
+    report = {'read': 0, 'valid': 0, 'inserted': 0, 'invalid': 0, 'errors': [],
+              'unmatched_topics': Counter(), 'dry_run': dry_run}
+    batch = []
+
+    def flush():
+        if batch:
+            db.executemany(INSERT_SQL, batch)
+            report['inserted'] += len(batch)
+            batch.clear()
+
+    try:
+        for number, raw, parse_error in records:
+            report['read'] += 1
+            if parse_error:
+                row, errors, unmatched = None, [parse_error], None
+            else:
+                row, errors, unmatched = validate(raw, topic_ids, names, default_topic_id, status, source)
+            if unmatched:
+                report['unmatched_topics'][unmatched] += 1
+            if errors:
+                report['invalid'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append((number, errors))
+                continue
+            report['valid'] += 1
+            if not dry_run:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    flush()
+        flush()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return report
+
+
+def import_file(db, stream, filename, fmt=None, **options):
+    """Import an open binary file (a path's file object or an upload stream)."""
+    fmt = fmt or detect_format(filename)
+    return import_questions(db, READERS[fmt](stream), source=f'import:{os.path.basename(filename)}', **options)
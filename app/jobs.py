@@ -0,0 +1,422 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import anthropic
+import config
+from app.db import get_db
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Set when any worker gets a 429 with retry-after; every worker waits it out
+# before its next API call so a burst of 429s doesn't turn into a retry storm.
+# Other retryable errors only back off the job that got them.
+_rate_limited_until = 0.0
+_rate_limit_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.GENERATION_WORKERS,
+                                           thread_name_prefix='generation')
+    return _executor
+
+
+def _job_params(count, difficulty, clinical_task, subtopic_ids, fresh=False):
+    params = {
+        'count': count,
+        'difficulty': difficulty,
+        'clinical_task': clinical_task,
+        'subtopic_ids': subtopic_ids,
+    }
+    if fresh:
+        params['fresh'] = True  # bypass the generation cache (batch jobs always do, see _run_job)
+    return json.dumps(params)
+
+
+def enqueue_generation(app, topic_id, count=3, difficulty='medium', clinical_task='mixed', subtopic_ids=None,
+                       fresh=False):
+    """Record a generation job and run it on the background pool. Returns the job id."""
+    db = get_db()
+    cursor = db.execute(
+        "INSERT INTO generation_jobs (topic_id, params) VALUES (?, ?)",
+        (topic_id, _job_params(count, difficulty, clinical_task, subtopic_ids, fresh))
+    )
+    db.commit()
+    job_id = cursor.lastrowid
+    _get_executor().submit(_run_job, app, job_id)
+    return job_id
+
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before retrying error, or None if it is not retryable."""
+    if isinstance(error, anthropic.APIStatusError):
+        if error.status_code not in (429, 500, 502, 503, 529):
+            return None
+        retry_after = error.response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    elif not isinstance(error, anthropic.APIConnectionError):
+        return None
+    return config.BATCH_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.8, 1.2)
+
+
+def _is_rate_limit(error):
+    return (isinstance(error, anthropic.APIStatusError) and error.status_code == 429
+            and bool(error.response.headers.get('retry-after')))
+
+
+def _wait_for_rate_limit():
+    delay = _rate_limited_until - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _generate_with_backoff(db, job_id, topic_id, params):
+    global _rate_limited_until
+    from app.ai_generator import generate_questions
+
+    attempt = 0
+    while True:
+        _wait_for_rate_limit()
+        db.execute("UPDATE generation_jobs SET attempts = attempts + 1, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                   (job_id,))
+        db.commit()
+        try:
+            # This loop owns the retries; SDK retries underneath would multiply the calls
+            return generate_questions(topic_id, max_retries=0, **params)
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= config.BATCH_MAX_RETRIES:
+                raise
+            db.rollback()
+            if _is_rate_limit(e):
+                with _rate_limit_lock:
+                    _rate_limited_until = max(_rate_limited_until, time.monotonic() + delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+
+
+def _claim_job(db, job_id):
+    """Mark a job running unless it is done or a live worker has it. Returns whether this caller got it.
+
+    Failed batch jobs and running jobs whose worker stopped updating them are
+    claimed again, so resuming a batch retries them.
+    """
+    cursor = db.execute(
+        "UPDATE generation_jobs SET status='running', error='', started_at=CURRENT_TIMESTAMP, "
+        "updated_at=CURRENT_TIMESTAMP "
+        "WHERE id=? AND (status = 'queued' OR (status = 'failed' AND batch_id IS NOT NULL) "
+        "OR (status = 'running' AND COALESCE(updated_at, created_at) < datetime('now', ?)))",
+        (job_id, _stale_cutoff())
+    )
+    db.commit()
+    return cursor.rowcount == 1
+
+
+def _run_job(app, job_id):
+    with app.app_context():
+        db = get_db()
+        if not _claim_job(db, job_id):
+            return
+        job = db.execute("SELECT * FROM generation_jobs WHERE id = ?", (job_id,)).fetchone()
+        params = json.loads(job['params'])
+        if job['batch_id'] is not None:
+            # A batch asks for new questions; a cached result would mark the job
+            # done with questions an earlier run already created
+            params['fresh'] = True
+        try:
+            created, from_cache = _generate_with_backoff(db, job_id, job['topic_id'], params)
+        except Exception as e:
+            db.rollback()
+            _finish_job(db, job_id, error=str(e))
+        else:
+            _finish_job(db, job_id, created, from_cache=from_cache)
+
+
+STALE_JOB_ERROR = 'העבודה הופסקה (השרת הופעל מחדש); יש להפעיל את היצירה שוב'
+
+
+def _stale_cutoff():
+    return f'-{int(config.JOB_STALE_SECONDS)} seconds'
+
+
+def fail_stale_jobs(db, job_id=None):
+    """Fail single generation jobs left queued or running by a process that is gone.
+
+    A live job touches updated_at whenever it starts or retries, so one that
+    hasn't for JOB_STALE_SECONDS was lost in a restart. Batch jobs are picked
+    up again by `flask generate-batch --resume` instead.
+    """
+    sql = ("UPDATE generation_jobs SET status='failed', error=?, finished_at=CURRENT_TIMESTAMP, "
+           "updated_at=CURRENT_TIMESTAMP "
+           "WHERE status IN ('queued', 'running') AND batch_id IS NULL "
+           "AND COALESCE(updated_at, created_at) < datetime('now', ?)")
+    args = [STALE_JOB_ERROR, _stale_cutoff()]
+    if job_id is not None:
+        sql += " AND id = ?"
+        args.append(job_id)
+    count = db.execute(sql, args).rowcount
+    db.commit()
+    return count
+
+
+def get_job(job_id):
+    db = get_db()
+    query = (
+        "SELECT id, topic_id, params, status, question_ids, error, batch_id, attempts, from_cache, "
+        "created_at, started_at, finished_at, "
+        "COALESCE(updated_at, created_at) < datetime('now', ?) AS stale "
+        "FROM generation_jobs WHERE id = ?"
+    )
+    row = db.execute(query, (_stale_cutoff(), job_id)).fetchone()
+    if not row:
+        return None
+    if row['stale'] and row['status'] in ('queued', 'running') and fail_stale_jobs(db, job_id):
+        row = db.execute(query, (_stale_cutoff(), job_id)).fetchone()
+    job = dict(row)
+    del job['stale']
+    job['from_cache'] = bool(job['from_cache'])
+    job['params'] = json.loads(job['params'])
+    job['question_ids'] = json.loads(job['question_ids'])
+    return job
+
+
+# --- Batch generation ---
+
+def gap_topic_ids(db):
+    """Level-2 topics that have no questions yet."""
+    rows = db.execute("""
+        SELECT t.id FROM topics t
+        LEFT JOIN topic_coverage c ON c.topic_id = t.id
+        WHERE t.level = 2 AND COALESCE(c.total, 0) = 0
+        ORDER BY t.chapter_code, t.id
+    """).fetchall()
+    return [r['id'] for r in rows]
+
+
+def chapter_topic_ids(db, chapter_code):
+    rows = db.execute(
+        "SELECT id FROM topics WHERE level=2 AND chapter_code=? ORDER BY id", (chapter_code,)
+    ).fetchall()
+    return [r['id'] for r in rows]
+
+
+def create_batch(topic_ids, count=3, difficulty='medium', clinical_task='mixed', description='',
+                 backend='messages'):
+    """Record a batch with one queued job per topic. Returns the batch id.
+
+    backend is 'messages' (one API call per job) or 'message-batches' (all jobs
+    submitted together through the Message Batches API).
+    """
+    db = get_db()
+    cursor = db.execute(
+        "INSERT INTO generation_batches (description, backend) VALUES (?, ?)", (description, backend)
+    )
+    batch_id = cursor.lastrowid
+    params = _job_params(count, difficulty, clinical_task, None)
+    db.executemany(
+        "INSERT INTO generation_jobs (topic_id, params, batch_id) VALUES (?, ?, ?)",
+        [(tid, params, batch_id) for tid in topic_ids]
+    )
+    db.commit()
+    return batch_id
+
+
+def run_batch(app, batch_id, concurrency=None, on_job_done=None):
+    """Run every job of a batch that hasn't finished.
+
+    Jobs left queued or failed by an earlier run, or running under a worker that
+    stopped updating them, are picked up again, so calling this twice resumes
+    rather than duplicates. Jobs still running elsewhere are left to that worker
+    and the batch stays 'running'.
+    """
+    with app.app_context():
+        db = get_db()
+        backend = db.execute(
+            "SELECT backend FROM generation_batches WHERE id=?", (batch_id,)
+        ).fetchone()['backend']
+        db.execute("UPDATE generation_batches SET status='running' WHERE id=?", (batch_id,))
+        db.commit()
+
+    if backend == 'message-batches':
+        _run_message_batch(app, batch_id, on_job_done)
+    else:
+        _run_job_pool(app, batch_id, concurrency, on_job_done)
+
+    with app.app_context():
+        db = get_db()
+        counts = db.execute(
+            "SELECT COALESCE(SUM(status = 'running'), 0) AS running, COALESCE(SUM(status != 'done'), 0) AS failed "
+            "FROM generation_jobs WHERE batch_id=?", (batch_id,)
+        ).fetchone()
+        if not counts['running']:
+            db.execute(
+                "UPDATE generation_batches SET status=?, finished_at=CURRENT_TIMESTAMP WHERE id=?",
+                ('failed' if counts['failed'] else 'done', batch_id)
+            )
+            db.commit()
+
+
+def _pending_jobs(db, batch_id):
+    return db.execute(
+        "SELECT * FROM generation_jobs WHERE batch_id=? AND status != 'done' ORDER BY id", (batch_id,)
+    ).fetchall()
+
+
+def _run_job_pool(app, batch_id, concurrency, on_job_done):
+    """Run a batch's jobs with at most `concurrency` API calls in flight."""
+    with app.app_context():
+        job_ids = [r['id'] for r in _pending_jobs(get_db(), batch_id)]
+
+    def run_one(job_id):
+        _run_job(app, job_id)
+        if on_job_done:
+            on_job_done(job_id)
+
+    with ThreadPoolExecutor(max_workers=concurrency or config.BATCH_CONCURRENCY,
+                            thread_name_prefix=f'batch-{batch_id}') as pool:
+        list(pool.map(run_one, job_ids))
+
+
+def _finish_job(db, job_id, created=None, error='', from_cache=False):
+    if error:
+        db.execute(
+            "UPDATE generation_jobs SET status='failed', error=?, finished_at=CURRENT_TIMESTAMP, "
+            "updated_at=CURRENT_TIMESTAMP WHERE id=?",
+            (error, job_id)
+        )
+    else:
+        db.execute(
+            "UPDATE generation_jobs SET status='done', error='', question_ids=?, from_cache=?, "
+            "finished_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+            (json.dumps(created), int(from_cache), job_id)
+        )
+    db.commit()
+
+
+MISSING_RESULT_ERROR = 'לא התקבלה תוצאה עבור העבודה מאצוות ה-API; יש להפעיל את האצווה שוב'
+
+
+def _run_message_batch(app, batch_id, on_job_done):
+    """Submit a batch's pending jobs as one Message Batch, wait for it and ingest the results.
+
+    The API batch id is stored on the batch, so a resumed run keeps polling the
+    batch already submitted instead of paying for it twice. Once its results are
+    ingested the id is cleared; claimed jobs it didn't contain are then submitted
+    as a new batch, and jobs that failed are resubmitted on the next run. An API
+    error fails every job still waiting, keeping the id so a resume polls again.
+    """
+    from app.ai_generator import (build_prompt, submit_message_batch, wait_for_message_batch,
+                                  message_batch_results, store_questions)
+
+    with app.app_context():
+        db = get_db()
+        batch = db.execute("SELECT * FROM generation_batches WHERE id=?", (batch_id,)).fetchone()
+        jobs = {}
+        for job in _pending_jobs(db, batch_id):
+            if not _claim_job(db, job['id']):
+                continue
+            params = json.loads(job['params'])
+            try:
+                prompt = build_prompt(db, job['topic_id'], **params)
+            except Exception as e:
+                _finish_job(db, job['id'], error=str(e))
+                continue
+            jobs[job['id']] = (job, params, prompt)
+        waiting = set(jobs)
+
+        def heartbeat():
+            # Keep the claim on the jobs alive while the API batch is processing
+            db.executemany("UPDATE generation_jobs SET updated_at=CURRENT_TIMESTAMP WHERE id=? AND status='running'",
+                           [(job_id,) for job_id in waiting])
+            db.commit()
+
+        def finish(job_id, created=None, error=''):
+            _finish_job(db, job_id, created, error)
+            waiting.discard(job_id)
+            if on_job_done:
+                on_job_done(job_id)
+
+        api_batch_id = batch['api_batch_id']
+        try:
+            while waiting:
+                resumed = bool(api_batch_id)
+                if not resumed:
+                    api_batch_id = submit_message_batch(
+                        [(f'job-{job_id}', jobs[job_id][2], jobs[job_id][1]['count']) for job_id in sorted(waiting)]
+                    )
+                    db.execute("UPDATE generation_batches SET api_batch_id=? WHERE id=?", (api_batch_id, batch_id))
+                    db.executemany("UPDATE generation_jobs SET attempts = attempts + 1 WHERE id=?",
+                                   [(job_id,) for job_id in waiting])
+                    db.commit()
+
+                wait_for_message_batch(api_batch_id, on_poll=heartbeat)
+
+                for custom_id, message, error in message_batch_results(api_batch_id):
+                    job_id = int(custom_id.split('-', 1)[1])
+                    if job_id not in waiting:
+                        continue  # already ingested by an earlier run
+                    job, params, prompt = jobs[job_id]
+                    if message is None:
+                        finish(job_id, error=error)
+                        continue
+                    try:
+                        created = store_questions(db, job['topic_id'], prompt, message.content[0].text,
+                                                  message.usage, params['difficulty'], params['clinical_task'],
+                                                  message.stop_reason)
+                    except Exception as e:
+                        db.rollback()
+                        finish(job_id, error=str(e))
+                    else:
+                        finish(job_id, created)
+
+                api_batch_id = ''
+                db.execute("UPDATE generation_batches SET api_batch_id='' WHERE id=?", (batch_id,))
+                db.commit()
+                if not resumed:
+                    break
+                # Jobs left were claimed after the resumed batch was submitted; submit them now
+        except Exception as e:
+            # TimeoutError included: api_batch_id is kept, so a resumed run polls the same batch again
+            db.rollback()
+            for job_id in sorted(waiting):
+                finish(job_id, error=str(e))
+            return
+
+        for job_id in sorted(waiting):
+            finish(job_id, error=MISSING_RESULT_ERROR)
+
+
+def start_batch(app, batch_id, concurrency=None):
+    """Run a batch on a background thread."""
+    thread = threading.Thread(target=run_batch, args=(app, batch_id, concurrency),
+                              name=f'batch-{batch_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_batch(batch_id):
+    db = get_db()
+    batch = db.execute("SELECT * FROM generation_batches WHERE id = ?", (batch_id,)).fetchone()
+    if not batch:
+        return None
+    result = dict(batch)
+    rows = db.execute(
+        "SELECT status, COUNT(*) as c FROM generation_jobs WHERE batch_id=? GROUP BY status", (batch_id,)
+    ).fetchall()
+    result['jobs'] = {r['status']: r['c'] for r in rows}
+    result['questions_created'] = sum(
+        len(json.loads(r['question_ids'])) for r in db.execute(
+            "SELECT question_ids FROM generation_jobs WHERE batch_id=? AND status='done'", (batch_id,)
+        ).fetchall()
+    )
+    return result
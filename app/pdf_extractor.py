@@ -1,5 +1,372 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from contextlib import contextmanager
 import fitz
 import config
+from app.db import connect
+from app.tokens import estimate_tokens, truncate_to_tokens
+
+# Extracted page text is kept in a sidecar SQLite file so repeated generations
+# for the same topic don't re-parse the textbooks. Each page is stored as
+# extracted with a digest of its content stream; when the PDF's size + mtime
+# change, pages are re-checked against their digest and only the ones that
+# actually changed are extracted again. Pages are cleaned (de-hyphenated,
+# running headers/footers removed) when read and when chunked; the header/footer
+# set is detected over the whole book by warm_page_cache, which re-chunks every
+# page when it changes. The chunks are indexed with FTS5, so a topic's context
+# is the best BM25-ranked passages rather than the first pages of its range.
+# Bump PAGE_CACHE_VERSION when the stored text changes shape; older caches are
+# dropped and rebuilt.
+PAGE_CACHE_VERSION = 4
+PAGE_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pdf_files (
+    pdf_path TEXT PRIMARY KEY,
+    stamp TEXT NOT NULL,
+    page_count INTEGER NOT NULL,
+    boilerplate TEXT NOT NULL DEFAULT '[]'
+);
+
+CREATE TABLE IF NOT EXISTS page_text (
+    pdf_path TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text BLOB NOT NULL,
+    digest TEXT NOT NULL DEFAULT '',
+    verified INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (pdf_path, page)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    pdf_path TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_chunks_page ON chunks(pdf_path, page);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(
+    text, content = 'chunks', content_rowid = 'id',
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunk_fts (rowid, text) VALUES (NEW.id, NEW.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunk_fts (chunk_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+END;
+"""
+
+QUERY_WORD_RE = re.compile(r'\w+')
+
+# Page text cleanup
+HYPHENATED_RE = re.compile(r'([A-Za-z]+)-\n([a-z]+)')
+LATIN_WORD_RE = re.compile(r'[A-Za-z]+')
+PAGE_NUMBER_RE = re.compile(r'^\s*(?:page\s*)?\d{1,4}\s*$', re.IGNORECASE)
+DIGITS_RE = re.compile(r'\d+')
+EDGE_LINES = 2                # lines at the top and bottom of a page checked for headers/footers
+BOILERPLATE_MIN_SHARE = 0.2   # an edge line repeated on this share of pages is a running header/footer
+BOILERPLATE_MIN_PAGES = 20    # books with fewer pages keep the previously detected set
+BOILERPLATE_MAX_CHARS = 100   # running heads are short; longer repeated lines are left alone
+STOPWORDS = {'and', 'or', 'the', 'of', 'in', 'on', 'with', 'for', 'to', 'a', 'an', 'by', 'vs', 'its', 'not'}
+
+_local = threading.local()
+
+
+class DocumentPool:
+    """Process-wide LRU pool of open fitz.Documents.
+
+    Opening a large PDF re-reads its xref table, so handles are kept open and
+    reused until the file changes on disk or they are evicted. PyMuPDF is not
+    thread-safe, so a document is only used while holding the pool lock.
+    """
+
+    def __init__(self, max_docs, max_bytes):
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._docs = OrderedDict()  # pdf_path -> (stamp, size, doc)
+
+    @contextmanager
+    def document(self, pdf_path):
+        with self._lock:
+            stamp = _file_stamp(pdf_path)
+            entry = self._docs.get(pdf_path)
+            if entry and entry[0] != stamp:
+                self._close(pdf_path)
+                entry = None
+            if entry is None:
+                doc = fitz.open(pdf_path)
+                entry = (stamp, os.path.getsize(pdf_path), doc)
+                self._docs[pdf_path] = entry
+                self._evict(keep=pdf_path)
+            self._docs.move_to_end(pdf_path)
+            yield entry[2]
+
+    def _evict(self, keep):
+        while len(self._docs) > 1:
+            total = sum(size for _, size, _ in self._docs.values())
+            if len(self._docs) <= self.max_docs and total <= self.max_bytes:
+                break
+            oldest = next(iter(self._docs))
+            if oldest == keep:
+                break
+            self._close(oldest)
+
+    def _close(self, pdf_path):
+        _, _, doc = self._docs.pop(pdf_path)
+        doc.close()
+
+    def clear(self):
+        with self._lock:
+            for pdf_path in list(self._docs):
+                self._close(pdf_path)
+
+
+doc_pool = DocumentPool(config.PDF_POOL_MAX_DOCS, config.PDF_POOL_MAX_BYTES)
+
+
+def _cache_conn():
+    """Per-thread connection to the page-text cache."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(config.TEXTBOOK_CACHE_PATH), exist_ok=True)
+        conn = connect(config.TEXTBOOK_CACHE_PATH)
+        conn.execute("PRAGMA journal_mode = WAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != PAGE_CACHE_VERSION:
+            for table in ('chunk_fts', 'chunks', 'page_text', 'pdf_files'):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"PRAGMA user_version = {PAGE_CACHE_VERSION}")
+        conn.executescript(PAGE_CACHE_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def _file_stamp(pdf_path):
+    try:
+        st = os.stat(pdf_path)
+    except OSError:
+        return None
+    return f'{st.st_size}:{st.st_mtime_ns}'
+
+
+def _sync_file(conn, pdf_path):
+    """Return (page_count, pdf_available), marking cached pages for re-checking if the PDF changed.
+
+    When the PDF is missing but pages were cached earlier, the cache is served as-is.
+    """
+    stamp = _file_stamp(pdf_path)
+    row = conn.execute(
+        "SELECT stamp, page_count FROM pdf_files WHERE pdf_path = ?", (pdf_path,)
+    ).fetchone()
+    if stamp is None:
+        if row:
+            return row[1], False
+        raise FileNotFoundError(f"PDF not found: {pdf_path}")
+    if row and row[0] == stamp:
+        return row[1], True
+
+    with doc_pool.document(pdf_path) as doc:
+        page_count = len(doc)
+    with conn:
+        conn.execute("DELETE FROM page_text WHERE pdf_path = ? AND page >= ?", (pdf_path, page_count))
+        conn.execute("DELETE FROM chunks WHERE pdf_path = ? AND page >= ?", (pdf_path, page_count))
+        conn.execute("UPDATE page_text SET verified = 0 WHERE pdf_path = ?", (pdf_path,))
+        conn.execute(
+            "INSERT INTO pdf_files (pdf_path, stamp, page_count) VALUES (?, ?, ?) "
+            "ON CONFLICT (pdf_path) DO UPDATE SET stamp = excluded.stamp, page_count = excluded.page_count",
+            (pdf_path, stamp, page_count)
+        )
+    return page_count, True
+
+
+def page_digest(page):
+    """Digest of a fitz page's content stream; unchanged pages keep their cached text."""
+    return hashlib.blake2b(page.read_contents(), digest_size=16).hexdigest()
+
+
+def _edge_key(line):
+    return DIGITS_RE.sub('#', ' '.join(line.split())).lower()
+
+
+def _edge_lines(text):
+    lines = [line for line in text.splitlines() if line.strip()]
+    return lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+
+
+def find_boilerplate(texts):
+    """Running headers/footers: edge lines (digits ignored) repeated across many pages."""
+    counts = Counter(key for text in texts for key in {_edge_key(line) for line in _edge_lines(text)})
+    threshold = max(3, len(texts) * BOILERPLATE_MIN_SHARE)
+    return sorted(key for key, n in counts.items()
+                  if n >= threshold and key and len(key) <= BOILERPLATE_MAX_CHARS)
+
+
+def _rejoin_hyphenated(text):
+    """Rejoin a word split across lines ("treat-\nment") when the joined form is used elsewhere
+    on the page; otherwise it is a compound ("obsessive-\ncompulsive") and keeps its hyphen."""
+    words = {w.lower() for w in LATIN_WORD_RE.findall(HYPHENATED_RE.sub(' ', text))}
+
+    def join(match):
+        head, tail = match.groups()
+        return head + tail if (head + tail).lower() in words else f'{head}-{tail}'
+
+    return HYPHENATED_RE.sub(join, text)
+
+
+def clean_page_text(text, boilerplate=()):
+    """Drop running headers/footers and page numbers, and rejoin words hyphenated across lines."""
+    text = text.replace('\u00ad', '')
+    lines = text.splitlines()
+    edges = [i for i, line in enumerate(lines) if line.strip()]
+    edges = set(edges[:EDGE_LINES] + edges[-EDGE_LINES:])
+    boilerplate = set(boilerplate)
+    kept = [line for i, line in enumerate(lines)
+            if i not in edges or not (PAGE_NUMBER_RE.match(line) or _edge_key(line) in boilerplate)]
+    return _rejoin_hyphenated('\n'.join(kept))
+
+
+def _boilerplate(conn, pdf_path):
+    row = conn.execute("SELECT boilerplate FROM pdf_files WHERE pdf_path = ?", (pdf_path,)).fetchone()
+    return json.loads(row[0]) if row else []
+
+
+def _cached_page(conn, pdf_path, page_num, available=True):
+    """Cached raw text of a page, or None if it isn't cached or changed since it was extracted."""
+    row = conn.execute(
+        "SELECT text, digest, verified FROM page_text WHERE pdf_path = ? AND page = ?", (pdf_path, page_num)
+    ).fetchone()
+    if not row:
+        return None
+    if not row[2] and available:
+        with doc_pool.document(pdf_path) as doc:
+            if page_digest(doc[page_num]) != row[1]:
+                return None
+        conn.execute("UPDATE page_text SET verified = 1 WHERE pdf_path = ? AND page = ?", (pdf_path, page_num))
+    return zlib.decompress(row[0]).decode('utf-8')
+
+
+def _extract_page(conn, pdf_path, page_num):
+    """Extract and store one page on demand. Returns its raw text."""
+    with doc_pool.document(pdf_path) as doc:
+        page = doc[page_num]
+        raw, digest = page.get_text(), page_digest(page)
+    _store_page(conn, pdf_path, page_num, raw, digest)
+    _store_chunks(conn, pdf_path, page_num, clean_page_text(raw, _boilerplate(conn, pdf_path)))
+    return raw
+
+
+def _store_page(conn, pdf_path, page_num, raw, digest):
+    conn.execute(
+        "INSERT OR REPLACE INTO page_text (pdf_path, page, text, digest, verified) VALUES (?, ?, ?, ?, 1)",
+        (pdf_path, page_num, zlib.compress(raw.encode('utf-8')), digest)
+    )
+
+
+def split_chunks(text, size=None):
+    """Split page text into passages of about size chars, breaking between lines."""
+    size = size or config.RETRIEVAL_CHUNK_CHARS
+    chunks, current, length = [], [], 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        current.append(line)
+        length += len(line) + 1
+        if length >= size:
+            chunks.append('\n'.join(current))
+            current, length = [], 0
+    if current:
+        # A short tail is merged into the previous passage rather than standing alone
+        if chunks and length < size // 3:
+            chunks[-1] += '\n' + '\n'.join(current)
+        else:
+            chunks.append('\n'.join(current))
+    return chunks
+
+
+def _store_chunks(conn, pdf_path, page_num, text):
+    """Replace a page's chunks with those of its cleaned text."""
+    conn.execute("DELETE FROM chunks WHERE pdf_path = ? AND page = ?", (pdf_path, page_num))
+    conn.executemany("INSERT INTO chunks (pdf_path, page, text) VALUES (?, ?, ?)",
+                     [(pdf_path, page_num, chunk) for chunk in split_chunks(text)])
+
+
+def _extract_slice(pdf_path, pages, known_digests):
+    """Worker: [(page, digest, raw text or None if unchanged)] for pages, with its own fitz handle."""
+    results = []
+    with fitz.open(pdf_path) as doc:
+        for page_num in pages:
+            page = doc[page_num]
+            digest = page_digest(page)
+            if known_digests.get(page_num) == digest:
+                results.append((page_num, digest, None))
+            else:
+                results.append((page_num, digest, page.get_text()))
+    return results
+
+
+def warm_page_cache(pdf_path, workers=None):
+    """Extract every page of pdf_path into the cache across a process pool.
+
+    Pages already verified against the current file are skipped, and pages
+    whose content digest didn't change are kept without re-extracting them.
+    The running headers/footers are then detected over every page of the book;
+    if they differ from the stored set, every page is re-chunked with the new
+    one (including pages extracted on demand before). Returns the number of
+    pages extracted.
+    """
+    conn = _cache_conn()
+    page_count, available = _sync_file(conn, pdf_path)
+    if not available:
+        return 0
+    cached = {r[0]: (r[1], r[2]) for r in conn.execute(
+        "SELECT page, digest, verified FROM page_text WHERE pdf_path = ?", (pdf_path,)
+    )}
+    todo = [p for p in range(page_count) if not cached.get(p, ('', 0))[1]]
+    if not todo:
+        return 0
+
+    workers = workers or config.TEXTBOOK_INDEX_WORKERS or os.cpu_count() or 1
+    size = max(1, -(-len(todo) // (workers * 4)))  # a few slices per worker evens out slow pages
+    slices = [todo[i:i + size] for i in range(0, len(todo), size)]
+    jobs = [(pdf_path, pages, {p: cached[p][0] for p in pages if p in cached}) for pages in slices]
+    if workers == 1:
+        results = [_extract_slice(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_extract_slice, *zip(*jobs)))
+    results = [r for batch in results for r in batch]
+
+    extracted = {page_num: raw for page_num, _, raw in results if raw is not None}
+    with conn:
+        conn.executemany("UPDATE page_text SET verified = 1 WHERE pdf_path = ? AND page = ?",
+                         [(pdf_path, page_num) for page_num, _, raw in results if raw is None])
+        for page_num, digest, raw in results:
+            if raw is not None:
+                _store_page(conn, pdf_path, page_num, raw, digest)
+
+        raws = {r[0]: zlib.decompress(r[1]).decode('utf-8') for r in conn.execute(
+            "SELECT page, text FROM page_text WHERE pdf_path = ?", (pdf_path,))}
+        old = _boilerplate(conn, pdf_path)
+        boilerplate = find_boilerplate(list(raws.values())) if len(raws) >= BOILERPLATE_MIN_PAGES else old
+        if boilerplate != old:
+            conn.execute("UPDATE pdf_files SET boilerplate = ? WHERE pdf_path = ?",
+                         (json.dumps(boilerplate), pdf_path))
+            rechunk = raws
+        else:
+            rechunk = extracted
+        for page_num, raw in rechunk.items():
+            _store_chunks(conn, pdf_path, page_num, clean_page_text(raw, boilerplate))
+    return len(extracted)
 
 
 def parse_page_ranges(page_str):
@@ -19,38 +386,157 @@ def parse_page_ranges(page_str):
     return ranges
 
 
-def extract_text_for_topic(pdf_path, page_ranges, max_chars=8000):
+def _page_texts(conn, pdf_path, page_ranges):
+    """Yield (page_num, text) for page_ranges (1-based, inclusive), extracting uncached pages."""
+    page_count, available = _sync_file(conn, pdf_path)
+    boilerplate = _boilerplate(conn, pdf_path)
+    try:
+        for start, end in page_ranges:
+            for page_num in range(start - 1, min(end, page_count)):
+                raw = _cached_page(conn, pdf_path, page_num, available)
+                if raw is None:
+                    if not available:
+                        continue
+                    raw = _extract_page(conn, pdf_path, page_num)
+                yield page_num, clean_page_text(raw, boilerplate)
+    finally:
+        if conn.in_transaction:
+            conn.commit()
+
+
+def extract_text_for_topic(pdf_path, page_ranges, max_tokens=2000):
+    """Pages of page_ranges in order, cut at an estimated max_tokens."""
     if not page_ranges:
         return ""
-    doc = fitz.open(pdf_path)
     texts = []
     total = 0
-    for start, end in page_ranges:
-        for page_num in range(start - 1, min(end, len(doc))):
-            text = doc[page_num].get_text()
+    pages = _page_texts(_cache_conn(), pdf_path, page_ranges)
+    try:
+        for page_num, text in pages:
             texts.append(f"--- Page {page_num + 1} ---\n{text}")
-            total += len(text)
-            if total >= max_chars:
+            total += estimate_tokens(texts[-1])
+            if total >= max_tokens:
                 break
-        if total >= max_chars:
-            break
-    doc.close()
-    return '\n'.join(texts)[:max_chars]
+    finally:
+        pages.close()
+    return truncate_to_tokens('\n'.join(texts), max_tokens)
+
+
+def fts_query(terms):
+    """FTS5 MATCH expression: any of the terms' words, or any multi-word term as a phrase."""
+    words, phrases = [], []
+    for term in terms:
+        tokens = [w.lower() for w in QUERY_WORD_RE.findall(term or '')]
+        if len(tokens) > 1:
+            phrases.append(' '.join(tokens))
+        words.extend(w for w in tokens if w not in STOPWORDS and len(w) > 1)
+    quoted = [f'"{t}"' for t in dict.fromkeys(phrases + words)]
+    return ' OR '.join(quoted)
+
+
+def search_chunks(pdf_path, query, limit=None, page_ranges=None):
+    """[(page_num, text, score)] of pdf_path's best chunks for an FTS5 query, best first.
+
+    With page_ranges only chunks on those (1-based, inclusive) pages are searched.
+    """
+    where, params = '', []
+    if page_ranges:
+        where = 'AND (' + ' OR '.join('c.page BETWEEN ? AND ?' for _ in page_ranges) + ')'
+        params = [page for start, end in page_ranges for page in (start - 1, end - 1)]
+    rows = _cache_conn().execute(f"""
+        SELECT c.page, c.text, -bm25(chunk_fts) as score
+        FROM chunk_fts
+        JOIN chunks c ON c.id = chunk_fts.rowid
+        WHERE chunk_fts MATCH ? AND c.pdf_path = ? {where}
+        ORDER BY bm25(chunk_fts)
+        LIMIT ?
+    """, (query, pdf_path, *params, limit or config.RETRIEVAL_CANDIDATES)).fetchall()
+    return [tuple(r) for r in rows]
+
+
+def retrieve_passages(sources, query_terms, budget):
+    """Fill a budget of estimated tokens with the best-ranked chunks of several books.
+
+    sources is [(label, pdf_path, page_ranges)]; the mapped pages are always
+    extracted (so they are indexed) and their chunks are boosted over matches
+    elsewhere in the book. Returns {label: [(page_num, text)] in page order},
+    or None if no chunk matches the terms.
+    """
+    query = fts_query(query_terms)
+    if not query:
+        return None
+    conn = _cache_conn()
+    candidates = []
+    for label, pdf_path, ranges in sources:
+        for _ in _page_texts(conn, pdf_path, ranges):
+            pass
+        # The mapped pages are searched on their own so that common words matching
+        # all over the book can't crowd them out of the candidate limit
+        mapped = search_chunks(pdf_path, query, page_ranges=ranges) if ranges else []
+        for page_num, text, score in mapped:
+            candidates.append((score * config.RETRIEVAL_MAPPED_BOOST, label, page_num, text))
+        seen = {(page_num, text) for page_num, text, _ in mapped}
+        for page_num, text, score in search_chunks(pdf_path, query):
+            if (page_num, text) not in seen:
+                candidates.append((score, label, page_num, text))
+    if not candidates:
+        return None
+
+    selected, used = {}, 0
+    for score, label, page_num, text in sorted(candidates, key=lambda c: -c[0]):
+        cost = estimate_tokens(text)
+        if used + cost > budget:
+            continue
+        selected.setdefault(label, []).append((page_num, text))
+        used += cost
+    for passages in selected.values():
+        passages.sort(key=lambda p: p[0])
+    return selected
+
+
+BOOKS = [('From Synopsis of Psychiatry', 'SYNOPSIS_PATH', 'synopsis_pages'),
+         ("From Dulcan's Textbook", 'DULCAN_PATH', 'dulcan_pages')]
+
+
+def get_topic_content(mapping, query_terms=None, budget=None):
+    """Textbook context for a topic's mapped pages, at most budget estimated tokens.
+
+    With query_terms (search terms, topic and subtopic names) the passages most
+    relevant to them are chosen by BM25; otherwise, or if nothing matches, the
+    mapped pages are taken in page order.
+    """
+    budget = budget or config.TEXTBOOK_MAX_TOKENS
+    if not mapping:
+        return ''
+    sources = [(label, getattr(config, path_key), parse_page_ranges(mapping[pages_key]))
+               for label, path_key, pages_key in BOOKS if mapping[pages_key]]
+    selected = retrieve_passages(sources, query_terms, budget) if query_terms else None
+    if selected is None:
+        return _page_order_content(mapping, budget)
+
+    parts = []
+    for label, _, _ in sources:
+        if selected.get(label):
+            pages = '\n'.join(f"--- Page {page_num + 1} ---\n" + '\n'.join(text for _, text in passages)
+                              for page_num, passages in groupby(selected[label], key=lambda p: p[0]))
+            parts.append(f"{label}:\n{pages}")
+    return '\n\n'.join(parts)
 
 
-def get_topic_content(mapping):
+def _page_order_content(mapping, budget):
+    """The mapped pages in order: Synopsis first with up to half the budget, Dulcan gets the rest."""
     parts = []
-    if mapping and mapping['synopsis_pages']:
+    if mapping['synopsis_pages']:
         ranges = parse_page_ranges(mapping['synopsis_pages'])
-        text = extract_text_for_topic(config.SYNOPSIS_PATH, ranges, max_chars=8000)
+        text = extract_text_for_topic(config.SYNOPSIS_PATH, ranges, max_tokens=budget // 2)
         if text:
             parts.append(f"From Synopsis of Psychiatry:\n{text}")
 
-    if mapping and mapping['dulcan_pages']:
-        remaining = config.MAX_EXTRACT_CHARS - sum(len(p) for p in parts)
-        if remaining > 2000:
+    if mapping['dulcan_pages']:
+        remaining = budget - sum(estimate_tokens(p) for p in parts)
+        if remaining > budget // 8:
             ranges = parse_page_ranges(mapping['dulcan_pages'])
-            text = extract_text_for_topic(config.DULCAN_PATH, ranges, max_chars=min(7000, remaining))
+            text = extract_text_for_topic(config.DULCAN_PATH, ranges, max_tokens=remaining)
             if text:
                 parts.append(f"From Dulcan's Textbook:\n{text}")
 
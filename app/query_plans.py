@@ -0,0 +1,159 @@
+"""Query-plan regression check for the SQL issued by the routes.
+
+Seeds a throwaway database, drives every page and API endpoint through the
+Flask test client with SQLite's trace callback capturing each statement, then
+runs EXPLAIN QUERY PLAN on them. A full table scan, or a temp B-tree for
+ORDER BY/GROUP BY/DISTINCT, is reported.
+"""
+import os
+import re
+import tempfile
+import config
+
+# Statements allowed to sort, matched by substring, with the reason
+ALLOWED = [
+    # Search results are ranked by relevance, which no index can provide
+    'bm25(questions_fts',
+]
+
+# A table read start to finish without an index (FTS virtual tables report
+# their own access paths and are excluded)
+SCAN_RE = re.compile(r'^SCAN (\w+)$')
+
+# Tables with at most one row per syllabus topic; scanning them is fine
+BOUNDED_TABLES = {'topic_coverage'}
+
+SEED_QUESTIONS = 400
+
+
+def _seed(db):
+    topics = []
+    topic_id = 1
+    for ch in range(1, 6):
+        for _ in range(6):
+            parent = topic_id
+            topics.append((topic_id, f'C{ch:02d}', f'Chapter {ch}', f'פרק {ch}', 2, f'נושא {topic_id}',
+                           f'Topic {topic_id}', None))
+            topic_id += 1
+            for _ in range(3):
+                topics.append((topic_id, f'C{ch:02d}', f'Chapter {ch}', f'פרק {ch}', 3, f'תת-נושא {topic_id}',
+                               f'Subtopic {topic_id}', parent))
+                topic_id += 1
+    db.executemany(
+        "INSERT INTO topics (id, chapter_code, chapter_en, chapter_he, level, hebrew, english, parent_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", topics
+    )
+    level2 = [t[0] for t in topics if t[4] == 2]
+    db.executemany(
+        "INSERT INTO topic_mappings (topic_id, synopsis_pages, dulcan_pages, synopsis_confidence, "
+        "dulcan_confidence, search_terms) VALUES (?, '', '', 'HIGH', 'LOW', '')",
+        [(t,) for t in level2]
+    )
+    db.executemany(
+        "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, correct_answer, "
+        "explanation_he, difficulty, status) VALUES (?, ?, 'א', 'ב', 'ג', 'ד', 'A', 'הסבר', ?, ?)",
+        [(level2[i % (len(level2) - 3)], f'שאלה {i} על טיפול', ('easy', 'medium', 'hard')[i % 3],
+          ('draft', 'review', 'approved', 'rejected')[i % 4]) for i in range(SEED_QUESTIONS)]
+    )
+    db.execute("INSERT INTO exams (title) VALUES ('מבחן')")
+    db.executemany(
+        "INSERT INTO exam_questions (exam_id, question_id, position) VALUES (1, ?, ?)",
+        [(qid, pos) for pos, qid in enumerate(range(2, 60, 2), 1)]
+    )
+    db.commit()
+
+
+def _requests():
+    """(method, url, form) for every route that reads or writes the database."""
+    return [
+        ('GET', '/', None),
+        ('GET', '/questions/', None),
+        ('GET', '/questions/?status=draft', None),
+        ('GET', '/questions/?status=approved&difficulty=hard', None),
+        ('GET', '/questions/?chapter=C02', None),
+        ('GET', '/questions/?topic_id=5', None),
+        ('GET', '/questions/?search=טיפול', None),
+        ('GET', '/questions/?search=טיפול&status=draft', None),
+        ('GET', '/questions/generate', None),
+        ('POST', '/questions/generate/stream', {'topic_id': '2', 'count': '3'}),
+        ('GET', '/questions/generate/stream?token=unknown', None),
+        ('GET', '/questions/3', None),
+        ('POST', '/questions/3/status/review', {}),
+        ('GET', '/exams/', None),
+        ('GET', '/exams/new', None),
+        ('GET', '/exams/1', None),
+        ('GET', '/exams/1/preview', None),
+        ('POST', '/exams/1/add', {'question_ids': ['61', '63']}),
+        ('POST', '/exams/1/remove/4', {}),
+        ('GET', '/export/exam/1/docx', None),
+        ('GET', '/export/exam/1/json', None),
+        ('GET', '/export/bank/json', None),
+        ('GET', '/export/bank/json?status=approved', None),
+        ('GET', '/api/topics', None),
+        ('GET', '/api/topics?chapter=C01', None),
+        ('GET', '/api/subtopics/1', None),
+        ('GET', '/api/coverage', None),
+        ('GET', '/api/questions?cursor=2999-01-01 00:00:00|1000', None),
+        ('GET', '/api/questions?status=review&cursor=2999-01-01 00:00:00|1000', None),
+        ('GET', '/api/questions?search=טיפול&cursor=-100.0|1', None),
+        ('GET', '/api/jobs/1', None),
+        ('GET', '/api/batches/1', None),
+        ('POST', '/questions/9/delete', {}),
+        ('POST', '/exams/1/delete', {}),
+    ]
+
+
+def _problems(db, sql):
+    if any(allowed in sql for allowed in ALLOWED):
+        return []
+    problems = []
+    for row in db.execute(f"EXPLAIN QUERY PLAN {sql}"):
+        detail = row['detail']
+        scan = SCAN_RE.match(detail)
+        if (scan and scan.group(1) not in BOUNDED_TABLES) or 'USE TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def check_route_query_plans():
+    """Exercise the routes and return [(url, sql, [plan problems]), ...]."""
+    from app import create_app
+    from app.db import get_db
+
+    saved = (config.DATA_DIR, config.DB_PATH, config.EXPORT_CACHE_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        config.DATA_DIR = tmp
+        config.DB_PATH = os.path.join(tmp, 'plans.db')
+        config.EXPORT_CACHE_DIR = os.path.join(tmp, 'exports')
+        try:
+            from app.db import connect, SCHEMA, _migrate_db
+            conn = connect()
+            conn.executescript(SCHEMA)
+            _migrate_db(conn)
+            _seed(conn)
+            conn.close()
+
+            app = create_app()
+            client = app.test_client()
+            results, seen = [], set()
+            with app.app_context():
+                db = get_db()
+                for method, url, form in _requests():
+                    statements = []
+                    db.set_trace_callback(statements.append)
+                    response = client.open(url, method=method, data=form)
+                    response.get_data()  # run streamed responses to the end
+                    response.close()
+                    db.set_trace_callback(None)
+                    for sql in statements:
+                        if sql in seen or not re.match(r'\s*(SELECT|UPDATE|DELETE|INSERT)', sql, re.I):
+                            continue
+                        seen.add(sql)
+                        problems = _problems(db, sql)
+                        if problems:
+                            results.append((f'{method} {url}', sql.strip(), problems))
+            # db is this thread's shared connection (see get_db): leave it open for
+            # the app-context teardown; get_db reconnects once DB_PATH is restored.
+        finally:
+            config.DATA_DIR, config.DB_PATH, config.EXPORT_CACHE_DIR = saved
+    return results
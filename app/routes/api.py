@@ -1,5 +1,7 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, render_template
 from app.db import get_db
+from app.taxonomy import get_taxonomy
+from app.http_cache import conditional, data_stamp
 
 bp = Blueprint('api', __name__)
 
@@ -8,40 +10,72 @@ bp = Blueprint('api', __name__)
 def topics():
     db = get_db()
     chapter = request.args.get('chapter', '')
-    if chapter:
-        rows = db.execute(
-            "SELECT id, hebrew, english, chapter_code FROM topics WHERE level=2 AND chapter_code=? ORDER BY id",
-            (chapter,)
-        ).fetchall()
-    else:
-        rows = db.execute(
-            "SELECT id, hebrew, english, chapter_code FROM topics WHERE level=2 ORDER BY chapter_code, id"
-        ).fetchall()
-    return jsonify([dict(r) for r in rows])
+
+    def build():
+        taxonomy = get_taxonomy(db)
+        rows = taxonomy.chapter_topics(chapter) if chapter else taxonomy.level2
+        return jsonify([{k: t[k] for k in ('id', 'hebrew', 'english', 'chapter_code')} for t in rows])
+
+    return conditional(*data_stamp(db, 'topics'), build)
 
 
 @bp.route('/subtopics/<int:topic_id>')
 def subtopics(topic_id):
     db = get_db()
-    rows = db.execute(
-        "SELECT id, hebrew, english FROM topics WHERE parent_id=? ORDER BY id",
-        (topic_id,)
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+
+    def build():
+        return jsonify([{k: t[k] for k in ('id', 'hebrew', 'english')}
+                        for t in get_taxonomy(db).subtopics_of(topic_id)])
+
+    return conditional(*data_stamp(db, 'topics'), build)
+
+
+@bp.route('/questions')
+def questions_page():
+    """Next page of the question bank for infinite scroll (rendered rows + cursor)."""
+    from app.routes.questions import bank_page
+    questions, next_cursor = bank_page(get_db(), request.args, request.args.get('cursor'))
+    return jsonify({
+        'html': render_template('_question_rows.html', questions=questions),
+        'next_cursor': next_cursor,
+    })
 
 
 @bp.route('/coverage')
 def coverage():
     db = get_db()
+    return conditional(*data_stamp(db, 'questions', 'topics'), lambda: _coverage(db))
+
+
+def _coverage(db):
     rows = db.execute("""
         SELECT t.id, t.hebrew, t.english, t.chapter_code, t.chapter_he,
-               COUNT(q.id) as total,
-               SUM(CASE WHEN q.status='approved' THEN 1 ELSE 0 END) as approved,
-               SUM(CASE WHEN q.status='draft' THEN 1 ELSE 0 END) as drafts
+               COALESCE(c.total, 0) as total,
+               COALESCE(c.approved, 0) as approved,
+               COALESCE(c.draft, 0) as drafts,
+               COALESCE(c.review, 0) as review,
+               COALESCE(c.rejected, 0) as rejected
         FROM topics t
-        LEFT JOIN questions q ON q.topic_id = t.id
+        LEFT JOIN topic_coverage c ON c.topic_id = t.id
         WHERE t.level = 2
-        GROUP BY t.id
         ORDER BY t.chapter_code, t.id
     """).fetchall()
     return jsonify([dict(r) for r in rows])
+
+
+@bp.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    from app.jobs import get_job
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job)
+
+
+@bp.route('/batches/<int:batch_id>')
+def batch_status(batch_id):
+    from app.jobs import get_batch
+    batch = get_batch(batch_id)
+    if not batch:
+        return jsonify({'error': 'batch not found'}), 404
+    return jsonify(batch)
@@ -8,20 +8,24 @@ bp = Blueprint('dashboard', __name__)
 def index():
     db = get_db()
 
-    # Stats
-    total_q = db.execute("SELECT COUNT(*) as c FROM questions").fetchone()['c']
-    draft_q = db.execute("SELECT COUNT(*) as c FROM questions WHERE status='draft'").fetchone()['c']
-    review_q = db.execute("SELECT COUNT(*) as c FROM questions WHERE status='review'").fetchone()['c']
-    approved_q = db.execute("SELECT COUNT(*) as c FROM questions WHERE status='approved'").fetchone()['c']
+    # Stats, from the per-topic summary maintained by triggers (see topic_coverage)
+    stats = db.execute("""
+        SELECT COALESCE(SUM(total), 0) as total, COALESCE(SUM(draft), 0) as draft,
+               COALESCE(SUM(review), 0) as review, COALESCE(SUM(approved), 0) as approved
+        FROM topic_coverage
+    """).fetchone()
+    total_q, draft_q, review_q, approved_q = (
+        stats['total'], stats['draft'], stats['review'], stats['approved']
+    )
 
     # Coverage per chapter
     chapters = db.execute("""
         SELECT t.chapter_he, t.chapter_en, t.chapter_code,
-               COUNT(DISTINCT t.id) as topic_count,
-               COUNT(DISTINCT q.id) as question_count,
-               SUM(CASE WHEN q.status = 'approved' THEN 1 ELSE 0 END) as approved_count
+               COUNT(*) as topic_count,
+               COALESCE(SUM(c.total), 0) as question_count,
+               COALESCE(SUM(c.approved), 0) as approved_count
         FROM topics t
-        LEFT JOIN questions q ON q.topic_id = t.id
+        LEFT JOIN topic_coverage c ON c.topic_id = t.id
         WHERE t.level = 2
         GROUP BY t.chapter_code
         ORDER BY t.chapter_code
@@ -32,13 +36,11 @@ def index():
         SELECT t.id, t.hebrew, t.english, t.chapter_he,
                COALESCE(tm.synopsis_confidence, '') as syn_conf,
                COALESCE(tm.dulcan_confidence, '') as dul_conf,
-               COUNT(q.id) as q_count
+               0 as q_count
         FROM topics t
-        LEFT JOIN questions q ON q.topic_id = t.id
+        LEFT JOIN topic_coverage c ON c.topic_id = t.id
         LEFT JOIN topic_mappings tm ON tm.topic_id = t.id
-        WHERE t.level = 2
-        GROUP BY t.id
-        HAVING q_count = 0
+        WHERE t.level = 2 AND COALESCE(c.total, 0) = 0
         ORDER BY t.chapter_code, t.id
     """).fetchall()
 
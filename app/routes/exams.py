@@ -1,5 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from app.db import get_db
+from app.taxonomy import get_taxonomy
+from app.exam_docx import discard_exam
 
 bp = Blueprint('exams', __name__)
 
@@ -8,10 +10,8 @@ bp = Blueprint('exams', __name__)
 def list_exams():
     db = get_db()
     exams = db.execute("""
-        SELECT e.*, COUNT(eq.id) as question_count
+        SELECT e.*, (SELECT COUNT(*) FROM exam_questions eq WHERE eq.exam_id = e.id) as question_count
         FROM exams e
-        LEFT JOIN exam_questions eq ON eq.exam_id = e.id
-        GROUP BY e.id
         ORDER BY e.created_at DESC
     """).fetchall()
     return render_template('exam_list.html', exams=exams)
@@ -20,18 +20,17 @@ def list_exams():
 @bp.route('/new', methods=['GET'])
 def new_exam():
     db = get_db()
+    # CROSS JOIN pins the join order: topics in chapter order, then each
+    # topic's questions by id, so the listing needs no sort
     questions = db.execute("""
         SELECT q.id, q.stem_he, q.difficulty, q.status, t.hebrew as topic_he, t.chapter_he
-        FROM questions q JOIN topics t ON t.id = q.topic_id
+        FROM topics t CROSS JOIN questions q ON q.topic_id = t.id
         WHERE q.status IN ('approved', 'review')
         ORDER BY t.chapter_code, t.id, q.id
     """).fetchall()
 
-    chapters = db.execute(
-        "SELECT DISTINCT chapter_code, chapter_he FROM topics WHERE level=2 ORDER BY chapter_code"
-    ).fetchall()
     return render_template('exam_builder.html', exam=None, questions=questions,
-                           exam_questions=[], chapters=chapters)
+                           exam_questions=[], chapters=get_taxonomy(db).chapters)
 
 
 @bp.route('/create', methods=['POST'])
@@ -74,22 +73,18 @@ def view_exam(exam_id):
         ORDER BY eq.position
     """, (exam_id,)).fetchall()
 
-    # Available questions not in this exam
+    # Available questions not in this exam (join order pinned as in new_exam)
     available = db.execute("""
         SELECT q.id, q.stem_he, q.difficulty, t.hebrew as topic_he, t.chapter_he
-        FROM questions q
-        JOIN topics t ON t.id = q.topic_id
+        FROM topics t
+        CROSS JOIN questions q ON q.topic_id = t.id
         WHERE q.status IN ('approved', 'review')
           AND q.id NOT IN (SELECT question_id FROM exam_questions WHERE exam_id=?)
-        ORDER BY t.chapter_code, q.id
+        ORDER BY t.chapter_code, t.id, q.id
     """, (exam_id,)).fetchall()
 
-    chapters = db.execute(
-        "SELECT DISTINCT chapter_code, chapter_he FROM topics WHERE level=2 ORDER BY chapter_code"
-    ).fetchall()
-
     return render_template('exam_builder.html', exam=exam, exam_questions=exam_qs,
-                           questions=available, chapters=chapters)
+                           questions=available, chapters=get_taxonomy(db).chapters)
 
 
 @bp.route('/<int:exam_id>/add', methods=['POST'])
@@ -144,5 +139,6 @@ def delete_exam(exam_id):
     db.execute("DELETE FROM exam_questions WHERE exam_id=?", (exam_id,))
     db.execute("DELETE FROM exams WHERE id=?", (exam_id,))
     db.commit()
+    discard_exam(exam_id)
     flash('המבחן נמחק', 'success')
     return redirect(url_for('exams.list_exams'))
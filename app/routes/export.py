@@ -1,125 +1,103 @@
-import io
-from flask import Blueprint, send_file
-from docx import Document
-from docx.shared import Pt, Cm
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.ns import qn
+from urllib.parse import quote
+from flask import Blueprint, Response, send_file, abort, request, stream_with_context, flash, redirect, url_for
 from app.db import get_db
+from app.exam_docx import exam_digest, exam_rows, render_exam_docx
+from app.docx_stream import stream_docx
+from app.bulk_export import load_exams, stream_zip, valid_variant, MAX_SHUFFLED_VARIANTS
+from app.http_cache import conditional, data_stamp
+from app.exporters import EXPORTERS, get_exporter, fetch_questions
 
 bp = Blueprint('export', __name__)
 
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
 
-def set_rtl_paragraph(paragraph):
-    pPr = paragraph._element.get_or_add_pPr()
-    bidi = pPr.makeelement(qn('w:bidi'), {})
-    pPr.append(bidi)
 
-
-def set_rtl_run(run, font_name='David', font_size=12):
-    run.font.name = font_name
-    run.font.size = Pt(font_size)
-    rPr = run._element.get_or_add_rPr()
-    rtl_elem = rPr.makeelement(qn('w:rtl'), {})
-    rPr.append(rtl_elem)
+@bp.app_context_processor
+def inject_exporters():
+    return {'exporters': list(EXPORTERS.values())}
 
 
 @bp.route('/exam/<int:exam_id>/docx')
 def export_docx(exam_id):
+    """Exam as DOCX. ?engine=stream writes the OOXML directly instead of via python-docx.
+
+    The ETag is the exam's content digest, so editing another exam doesn't invalidate it.
+    """
+    db = get_db()
+    engine = request.args.get('engine', 'python-docx')
+    exam, questions = exam_rows(db, exam_id)
+    if exam is None:
+        abort(404)
+    digest = exam_digest(exam, questions)
+    _, last_modified = data_stamp(db, 'exams', 'questions')
+    if engine == 'stream':
+        return conditional(f'exam{exam_id}-{digest[:24]}-stream', last_modified,
+                           lambda: _attachment(stream_docx(exam, questions, questions), DOCX_MIMETYPE,
+                                               f'{exam["title"]}.docx', f'exam-{exam_id}.docx'))
+    return conditional(f'exam{exam_id}-{digest[:24]}', last_modified,
+                       lambda: send_file(render_exam_docx(exam, questions, digest), as_attachment=True,
+                                         download_name=f'{exam["title"]}.docx', mimetype=DOCX_MIMETYPE))
+
+
+def _attachment(chunks, mimetype, filename, ascii_filename):
+    """Streamed download; filename may be Hebrew, ascii_filename is the fallback."""
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f"attachment; filename={ascii_filename}; filename*=UTF-8''{quote(filename)}",
+    })
+
+
+@bp.route('/exam/<int:exam_id>/<fmt>')
+def export_exam(exam_id, fmt):
+    """Exam in any registered format (pdf, qti, moodle, json, ...)."""
+    exp = get_exporter(fmt)
+    if exp is None:
+        abort(404)
+    db = get_db()
+    exam = db.execute("SELECT title, description FROM exams WHERE id=?", (exam_id,)).fetchone()
+    if not exam:
+        abort(404)
+    # Exporters use topic and metadata columns too, so the digest covers every column
+    questions = list(fetch_questions(db, exam_id=exam_id))
+    digest = exam_digest(exam, questions, fields=None)
+    _, last_modified = data_stamp(db, 'exams', 'questions')
+
+    def build():
+        chunks = exp.render(dict(exam), iter(questions))
+        return _attachment(chunks, exp.mimetype, f'{exam["title"]}.{exp.extension}',
+                           f'exam-{exam_id}.{exp.extension}')
+
+    return conditional(f'exam{exam_id}-{digest[:24]}-{fmt}', last_modified, build)
+
+
+@bp.route('/bank/<fmt>')
+def export_bank(fmt):
+    """The whole question bank (optionally ?status=approved) in a registered format."""
+    exp = get_exporter(fmt)
+    if exp is None:
+        abort(404)
     db = get_db()
-    exam = db.execute("SELECT * FROM exams WHERE id=?", (exam_id,)).fetchone()
-    questions = db.execute("""
-        SELECT eq.position, q.*
-        FROM exam_questions eq
-        JOIN questions q ON q.id = eq.question_id
-        WHERE eq.exam_id = ?
-        ORDER BY eq.position
-    """, (exam_id,)).fetchall()
-    doc = Document()
-
-    # Document-level RTL
-    sect = doc.sections[0]._sectPr
-    bidi = sect.makeelement(qn('w:bidi'), {})
-    sect.append(bidi)
-
-    # Title
-    title_p = doc.add_paragraph()
-    set_rtl_paragraph(title_p)
-    title_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    run = title_p.add_run(exam['title'])
-    set_rtl_run(run, font_size=18)
-    run.bold = True
-
-    if exam['description']:
-        desc_p = doc.add_paragraph()
-        set_rtl_paragraph(desc_p)
-        desc_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        run = desc_p.add_run(exam['description'])
-        set_rtl_run(run, font_size=11)
-
-    doc.add_paragraph()  # spacing
-
-    # Questions
-    for q in questions:
-        pos = q['position']
-        q_para = doc.add_paragraph()
-        set_rtl_paragraph(q_para)
-        run = q_para.add_run(f'{pos}. {q["stem_he"]}')
-        set_rtl_run(run)
-        run.bold = True
-
-        for letter, field in [('א', 'option_a'), ('ב', 'option_b'),
-                               ('ג', 'option_c'), ('ד', 'option_d')]:
-            text = q[field]
-            if text:
-                opt_p = doc.add_paragraph()
-                set_rtl_paragraph(opt_p)
-                opt_p.paragraph_format.left_indent = Cm(1)
-                run = opt_p.add_run(f'   {letter}. {text}')
-                set_rtl_run(run)
-
-        if q['option_e']:
-            opt_p = doc.add_paragraph()
-            set_rtl_paragraph(opt_p)
-            opt_p.paragraph_format.left_indent = Cm(1)
-            run = opt_p.add_run(f'   ה. {q["option_e"]}')
-            set_rtl_run(run)
-
-        doc.add_paragraph()
-
-    # Answer key
-    doc.add_page_break()
-    key_p = doc.add_paragraph()
-    set_rtl_paragraph(key_p)
-    key_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    run = key_p.add_run('מפתח תשובות')
-    set_rtl_run(run, font_size=16)
-    run.bold = True
-
-    doc.add_paragraph()
-
-    answer_map = {'A': 'א', 'B': 'ב', 'C': 'ג', 'D': 'ד', 'E': 'ה'}
-
-    for q in questions:
-        ans_p = doc.add_paragraph()
-        set_rtl_paragraph(ans_p)
-        correct_he = answer_map.get(q['correct_answer'], q['correct_answer'])
-        run = ans_p.add_run(f'{q["position"]}. {correct_he}')
-        set_rtl_run(run)
-        run.bold = True
-
-        if q['explanation_he']:
-            exp_p = doc.add_paragraph()
-            set_rtl_paragraph(exp_p)
-            exp_p.paragraph_format.left_indent = Cm(0.5)
-            run = exp_p.add_run(q['explanation_he'])
-            set_rtl_run(run, font_size=10)
-
-        doc.add_paragraph()
-
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-
-    filename = f'{exam["title"]}.docx'
-    return send_file(buffer, as_attachment=True, download_name=filename,
-                     mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+    status = request.args.get('status', '')
+    etag, last_modified = data_stamp(db, 'questions', 'topics')
+
+    def build():
+        chunks = exp.render({'title': 'מאגר שאלות', 'description': ''}, fetch_questions(db, status=status))
+        return _attachment(chunks, exp.mimetype, f'מאגר שאלות.{exp.extension}', f'bank.{exp.extension}')
+
+    return conditional(f'bank-{status}-{etag}-{fmt}', last_modified, build)
+
+
+@bp.route('/bulk')
+def export_bulk():
+    """ZIP of several exams, each in the requested variants (full/student/key/shuffled-N)."""
+    exam_ids = [int(i) for i in request.args.getlist('exam_id') if i.isdigit()]
+    variants = list(dict.fromkeys(v for v in request.args.getlist('variant') if valid_variant(v)))
+    shuffled = request.args.get('shuffled', '0')
+    if shuffled.isdigit():
+        variants += [f'shuffled-{n}' for n in range(1, min(int(shuffled), MAX_SHUFFLED_VARIANTS) + 1)]
+    exams = load_exams(get_db(), exam_ids)
+    if not exams or not variants:
+        flash('יש לבחור לפחות מבחן אחד וגרסה אחת לייצוא', 'error')
+        return redirect(url_for('exams.list_exams'))
+    return Response(stream_with_context(stream_zip(exams, variants)), mimetype='application/zip', headers={
+        'Content-Disposition': 'attachment; filename=exams.zip',
+    })
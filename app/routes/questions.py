@@ -1,88 +1,164 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from app.db import get_db
+import json
+import secrets
+import time
+import config
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app,
+                   Response, stream_with_context)
+from app.db import get_db, data_version
+from app.taxonomy import get_taxonomy
+from app.search import match_query, snippet_sql, best_snippet
 
 bp = Blueprint('questions', __name__)
 
 
-@bp.route('/')
-def bank():
-    db = get_db()
+# Total-count cache: (filters, questions version) -> count
+_count_cache = {}
+COUNT_CACHE_SIZE = 256
+
+
+def _bank_filters(args):
+    """WHERE clause for the bank filters. Returns (where, params, fts match or None)."""
     filters = []
     params = []
 
-    chapter = request.args.get('chapter', '')
+    chapter = args.get('chapter', '')
     if chapter:
-        filters.append("t.chapter_code = ?")
+        # Unary + keeps the planner walking idx_questions_created in page order
+        # instead of merging per-topic ranges and sorting them
+        filters.append("+q.topic_id IN (SELECT id FROM topics WHERE chapter_code = ?)")
         params.append(chapter)
 
-    topic_id = request.args.get('topic_id', '')
+    topic_id = args.get('topic_id', '')
     if topic_id:
         filters.append("q.topic_id = ?")
         params.append(int(topic_id))
 
-    status = request.args.get('status', '')
+    status = args.get('status', '')
     if status:
         filters.append("q.status = ?")
         params.append(status)
 
-    difficulty = request.args.get('difficulty', '')
+    difficulty = args.get('difficulty', '')
     if difficulty:
         filters.append("q.difficulty = ?")
         params.append(difficulty)
 
-    search = request.args.get('search', '')
-    if search:
-        filters.append("q.stem_he LIKE ?")
-        params.append(f'%{search}%')
+    match = match_query(args.get('search', ''))
+    if match:
+        filters.append("questions_fts MATCH ?")
+        params.append(match)
 
     where = " AND ".join(filters) if filters else "1=1"
-    questions = db.execute(f"""
-        SELECT q.*, t.hebrew as topic_he, t.english as topic_en, t.chapter_he
-        FROM questions q
-        JOIN topics t ON t.id = q.topic_id
-        WHERE {where}
-        ORDER BY q.created_at DESC
-    """, params).fetchall()
+    return where, params, match
+
+
+def _bank_from(match):
+    if match:
+        return """FROM questions_fts
+            JOIN questions q ON q.id = questions_fts.rowid
+            JOIN topics t ON t.id = q.topic_id"""
+    return """FROM questions q
+            JOIN topics t ON t.id = q.topic_id"""
+
+
+def _parse_cursor(cursor, numeric):
+    try:
+        key, last_id = cursor.rsplit('|', 1)
+        return (float(key) if numeric else key), int(last_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def bank_page(db, args, cursor=None):
+    """One page of bank results following cursor. Returns (questions, next_cursor).
+
+    Keyset pagination: rows are ordered by (created_at, id) descending, or by
+    (bm25 score, id) for searches, and the cursor is the last row's sort key,
+    so every page costs the same however deep it is.
+    """
+    where, params, match = _bank_filters(args)
+    after = _parse_cursor(cursor, numeric=bool(match)) if cursor else None
+    limit = config.BANK_PAGE_SIZE
 
-    chapters = db.execute(
-        "SELECT DISTINCT chapter_code, chapter_he FROM topics WHERE level=2 ORDER BY chapter_code"
-    ).fetchall()
+    if match:
+        # Ranked by bm25, stem hits weighted above options and explanation
+        rows = db.execute(f"""
+            SELECT * FROM (
+                SELECT q.*, t.hebrew as topic_he, t.english as topic_en, t.chapter_he,
+                       bm25(questions_fts, 10.0, 4.0, 2.0, 1.0) as score,
+                       {snippet_sql(0)} as snippet_stem,
+                       {snippet_sql(1)} as snippet_options,
+                       {snippet_sql(2)} as snippet_explanation
+                {_bank_from(match)}
+                WHERE {where}
+            )
+            {"WHERE (score, id) > (?, ?)" if after else ""}
+            ORDER BY score, id
+            LIMIT ?
+        """, params + list(after or ()) + [limit + 1]).fetchall()
+        questions = [dict(r, snippet=best_snippet(r['snippet_stem'], r['snippet_explanation'],
+                                                  r['snippet_options']))
+                     for r in rows]
+        sort_key = 'score'
+    else:
+        questions = db.execute(f"""
+            SELECT q.*, t.hebrew as topic_he, t.english as topic_en, t.chapter_he, '' as snippet
+            {_bank_from(match)}
+            WHERE {where} {"AND (q.created_at, q.id) < (?, ?)" if after else ""}
+            ORDER BY q.created_at DESC, q.id DESC
+            LIMIT ?
+        """, params + list(after or ()) + [limit + 1]).fetchall()
+        sort_key = 'created_at'
 
-    topics = db.execute(
-        "SELECT id, hebrew, english, chapter_code FROM topics WHERE level=2 ORDER BY chapter_code, id"
-    ).fetchall()
+    next_cursor = None
+    if len(questions) > limit:
+        questions = questions[:limit]
+        last = questions[-1]
+        key = repr(last[sort_key]) if match else last[sort_key]
+        next_cursor = f"{key}|{last['id']}"
+    return questions, next_cursor
 
-    return render_template('question_bank.html', questions=questions,
-                           chapters=chapters, topics=topics,
-                           f_chapter=chapter, f_topic=topic_id,
-                           f_status=status, f_difficulty=difficulty, f_search=search)
+
+def bank_total(db, args):
+    """Number of questions matching the filters, cached until the questions change."""
+    cache_key = tuple(sorted((k, args.get(k, '')) for k in
+                             ('chapter', 'topic_id', 'status', 'difficulty', 'search')))
+    version = data_version(db, 'questions')
+    cached = _count_cache.get(cache_key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    where, params, match = _bank_filters(args)
+    total = db.execute(f"SELECT COUNT(*) as c {_bank_from(match)} WHERE {where}", params).fetchone()['c']
+    if len(_count_cache) >= COUNT_CACHE_SIZE:
+        _count_cache.clear()
+    _count_cache[cache_key] = (version, total)
+    return total
+
+
+@bp.route('/')
+def bank():
+    db = get_db()
+    questions, next_cursor = bank_page(db, request.args)
+    total = bank_total(db, request.args)
+
+    taxonomy = get_taxonomy(db)
+
+    return render_template('question_bank.html', questions=questions, total=total,
+                           next_cursor=next_cursor,
+                           chapters=taxonomy.chapters, topics=taxonomy.level2,
+                           f_chapter=request.args.get('chapter', ''),
+                           f_topic=request.args.get('topic_id', ''),
+                           f_status=request.args.get('status', ''),
+                           f_difficulty=request.args.get('difficulty', ''),
+                           f_search=request.args.get('search', ''))
 
 
 @bp.route('/generate', methods=['GET'])
 def generate_form():
-    db = get_db()
-    chapters = db.execute("""
-        SELECT DISTINCT chapter_code, chapter_he, chapter_en
-        FROM topics WHERE level=2
-        ORDER BY chapter_code
-    """).fetchall()
-
-    topics = db.execute("""
-        SELECT t.id, t.hebrew, t.english, t.chapter_code,
-               COALESCE(tm.synopsis_confidence, '') as syn_conf,
-               COALESCE(tm.dulcan_confidence, '') as dul_conf,
-               tm.synopsis_pages, tm.dulcan_pages
-        FROM topics t
-        LEFT JOIN topic_mappings tm ON tm.topic_id = t.id
-        WHERE t.level = 2
-        ORDER BY t.chapter_code, t.id
-    """).fetchall()
-
-    subtopics = db.execute(
-        "SELECT id, hebrew, english, parent_id FROM topics WHERE level=3 ORDER BY parent_id, id"
-    ).fetchall()
-
-    return render_template('generate.html', chapters=chapters, topics=topics, subtopics=subtopics)
+    taxonomy = get_taxonomy(get_db())
+    return render_template('generate.html', chapters=taxonomy.chapters, topics=taxonomy.level2,
+                           subtopics=taxonomy.subtopics)
 
 
 @bp.route('/generate', methods=['POST'])
@@ -92,34 +168,154 @@ def generate_run():
     difficulty = request.form.get('difficulty', 'medium')
     clinical_task = request.form.get('clinical_task', 'mixed')
     subtopic_ids = request.form.getlist('subtopic_ids', type=int) or None
+    fresh = bool(request.form.get('fresh'))
 
-    try:
-        from app.ai_generator import generate_questions
-        created_ids = generate_questions(topic_id, count, difficulty, clinical_task, subtopic_ids)
-        flash(f'נוצרו {len(created_ids)} שאלות חדשות בהצלחה!', 'success')
-    except Exception as e:
-        flash(f'שגיאה ביצירת שאלות: {str(e)}', 'error')
-        return redirect(url_for('questions.generate_form'))
+    from app.jobs import enqueue_generation
+    job_id = enqueue_generation(current_app._get_current_object(), topic_id, count,
+                                difficulty, clinical_task, subtopic_ids, fresh)
 
-    return redirect(url_for('questions.bank', topic_id=topic_id, status='draft'))
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job_id, 'status_url': url_for('api.job_status', job_id=job_id)}), 202
+    return redirect(url_for('questions.generate_form', topic_id=topic_id, job_id=job_id))
+
+
+@bp.route('/generate/stream', methods=['POST'])
+def generate_stream_token():
+    """Store the generate form under a one-time token; returns the URL for the EventSource."""
+    params = {
+        'topic_id': int(request.form['topic_id']),
+        'count': int(request.form.get('count', 3)),
+        'difficulty': request.form.get('difficulty', 'medium'),
+        'clinical_task': request.form.get('clinical_task', 'mixed'),
+        'subtopic_ids': request.form.getlist('subtopic_ids', type=int) or None,
+        'fresh': bool(request.form.get('fresh')),
+    }
+    token = secrets.token_urlsafe(24)
+    now = time.time()
+    db = get_db()
+    db.execute("DELETE FROM stream_tokens WHERE created_at < ?", (now - config.STREAM_TOKEN_TTL_SECONDS,))
+    db.execute("INSERT INTO stream_tokens (token, params, created_at) VALUES (?, ?, ?)",
+               (token, json.dumps(params), now))
+    db.commit()
+    return jsonify({'stream_url': url_for('questions.generate_stream', token=token)}), 201
+
+
+def _consume_stream_token(db, token):
+    """The form stored under token, once; None if unknown, expired or already used."""
+    row = db.execute("SELECT params, created_at FROM stream_tokens WHERE token = ?", (token,)).fetchone()
+    if not row or not db.execute("DELETE FROM stream_tokens WHERE token = ?", (token,)).rowcount:
+        return None
+    db.commit()
+    if row['created_at'] < time.time() - config.STREAM_TOKEN_TTL_SECONDS:
+        return None
+    return json.loads(row['params'])
+
+
+@bp.route('/generate/stream')
+def generate_stream():
+    """Server-Sent Events feed of questions as they are generated and stored.
+
+    Opened with a token from a POST to the same URL, so link prefetchers and
+    crawlers following a GET can't start a paid generation.
+    """
+    params = _consume_stream_token(get_db(), request.args.get('token', ''))
+
+    def sse(event, data):
+        return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+    if params is None:
+        return Response(sse('failure', {'error': 'קישור היצירה אינו תקף או שכבר נוצל; שלח את הטופס שוב'}),
+                        mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    topic_id, count, difficulty, clinical_task, subtopic_ids, fresh = (
+        params['topic_id'], params['count'], params['difficulty'], params['clinical_task'],
+        params['subtopic_ids'], params['fresh'])
+
+    def events():
+        from app.ai_generator import generate_questions_stream
+        try:
+            for kind, value, q in generate_questions_stream(topic_id, count, difficulty,
+                                                            clinical_task, subtopic_ids, fresh):
+                if kind == 'question':
+                    yield sse('question', {'id': value, 'stem': q.get('stem', ''),
+                                           'options': q.get('options', {}), 'correct': q.get('correct', '')})
+                else:
+                    yield sse('done', {'question_ids': value, 'topic_id': topic_id, 'from_cache': q})
+        except Exception as e:
+            yield sse('failure', {'error': str(e)})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/batch', methods=['POST'])
+def batch_run():
+    from app.jobs import gap_topic_ids, chapter_topic_ids, create_batch, start_batch
+    db = get_db()
+    mode = request.form.get('mode', 'gaps')
+    if mode == 'chapter':
+        chapter = request.form.get('chapter', '')
+        topic_ids = chapter_topic_ids(db, chapter)
+        description = f'chapter {chapter}'
+    elif mode == 'topics':
+        topic_ids = request.form.getlist('topic_ids', type=int)
+        description = 'selected topics'
+    else:
+        topic_ids = gap_topic_ids(db)
+        description = 'gaps'
+
+    if not topic_ids:
+        flash('לא נמצאו נושאים ליצירה', 'error')
+        return redirect(request.referrer or url_for('dashboard.index'))
+
+    batch_id = create_batch(topic_ids,
+                            count=int(request.form.get('count', 3)),
+                            difficulty=request.form.get('difficulty', 'medium'),
+                            clinical_task=request.form.get('clinical_task', 'mixed'),
+                            description=description)
+    start_batch(current_app._get_current_object(), batch_id)
+    flash(f'הופעלה יצירה ברקע עבור {len(topic_ids)} נושאים (אצווה #{batch_id})', 'success')
+    return redirect(request.referrer or url_for('dashboard.index'))
+
+
+@bp.route('/import', methods=['GET', 'POST'])
+def import_bank():
+    """Upload a CSV/JSON/JSONL/DOCX question bank; with dry_run only the report is shown."""
+    from app.importer import import_file, ImportFormatError
+    db = get_db()
+    topics = get_taxonomy(db).level2
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('יש לבחור קובץ לייבוא', 'error')
+            return redirect(url_for('questions.import_bank'))
+        try:
+            report = import_file(db, upload.stream, upload.filename,
+                                 default_topic_id=request.form.get('topic_id', type=int),
+                                 status=request.form.get('status', 'draft'),
+                                 dry_run=bool(request.form.get('dry_run')))
+        except ImportFormatError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('questions.import_bank'))
+        if not report['dry_run'] and report['inserted']:
+            flash(f'יובאו {report["inserted"]} שאלות', 'success')
+    return render_template('import.html', topics=topics, report=report)
 
 
 @bp.route('/<int:qid>', methods=['GET'])
 def edit(qid):
     db = get_db()
     q = db.execute("""
-        SELECT q.*, t.hebrew as topic_he, t.english as topic_en
+        SELECT q.*, t.hebrew as topic_he, t.english as topic_en, d.stem_he as duplicate_stem
         FROM questions q JOIN topics t ON t.id = q.topic_id
+        LEFT JOIN questions d ON d.id = q.duplicate_of
         WHERE q.id = ?
     """, (qid,)).fetchone()
     if not q:
         flash('שאלה לא נמצאה', 'error')
         return redirect(url_for('questions.bank'))
 
-    topics = db.execute(
-        "SELECT id, hebrew, english FROM topics WHERE level=2 ORDER BY chapter_code, id"
-    ).fetchall()
-    return render_template('question_edit.html', q=q, topics=topics)
+    return render_template('question_edit.html', q=q, topics=get_taxonomy(db).level2)
 
 
 @bp.route('/<int:qid>', methods=['POST'])
@@ -156,12 +352,21 @@ def delete(qid):
     db = get_db()
     db.execute("DELETE FROM exam_questions WHERE question_id=?", (qid,))
     db.execute("DELETE FROM question_tags WHERE question_id=?", (qid,))
+    db.execute("UPDATE questions SET duplicate_of=NULL WHERE duplicate_of=?", (qid,))
     db.execute("DELETE FROM questions WHERE id=?", (qid,))
     db.commit()
     flash('השאלה נמחקה', 'success')
     return redirect(url_for('questions.bank'))
 
 
+@bp.route('/<int:qid>/not-duplicate', methods=['POST'])
+def clear_duplicate(qid):
+    db = get_db()
+    db.execute("UPDATE questions SET duplicate_of=NULL WHERE id=?", (qid,))
+    db.commit()
+    return redirect(url_for('questions.edit', qid=qid))
+
+
 @bp.route('/<int:qid>/status/<status>', methods=['POST'])
 def set_status(qid, status):
     if status not in ('draft', 'review', 'approved', 'rejected'):
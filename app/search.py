@@ -0,0 +1,87 @@
+"""Hebrew-aware full-text search over the question bank (SQLite FTS5).
+
+FTS5's unicode61 tokenizer doesn't know Hebrew: niqqud marks break tokens and
+a word with an attached prefix (ה/ו/ב/ל/מ/ש/כ) is a different token from the
+bare word. Text is therefore stripped of niqqud before indexing, and each
+question also indexes the prefix-stripped forms of its words in a hidden
+`terms` column. Queries get the same treatment.
+"""
+import re
+from markupsafe import Markup, escape
+
+NIQQUD_RE = re.compile('[\u0591-\u05BD\u05BF\u05C1\u05C2\u05C4\u05C5\u05C7]')
+WORD_RE = re.compile(r'\w+')
+HEBREW_WORD_RE = re.compile('^[א-ת]+$')
+HEBREW_PREFIXES = 'והבלמשכ'
+MAX_PREFIX_LETTERS = 3
+MIN_STEM_LENGTH = 3
+
+# snippet() markers; control characters can't occur in question text
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+
+def normalize(text):
+    """Strip niqqud/cantillation marks and lower-case Latin text."""
+    return NIQQUD_RE.sub('', text or '').lower()
+
+
+def prefix_variants(word):
+    """Forms of a Hebrew word with up to MAX_PREFIX_LETTERS prefix letters removed."""
+    variants = []
+    if not HEBREW_WORD_RE.match(word):
+        return variants
+    for i in range(1, MAX_PREFIX_LETTERS + 1):
+        if len(word) - i < MIN_STEM_LENGTH or word[i - 1] not in HEBREW_PREFIXES:
+            break
+        variants.append(word[i:])
+    return variants
+
+
+def index_terms(*texts):
+    """Extra tokens to index for texts: the prefix-stripped forms of their words."""
+    terms = set()
+    for text in texts:
+        for word in WORD_RE.findall(normalize(text)):
+            terms.update(prefix_variants(word))
+    return ' '.join(sorted(terms))
+
+
+def match_query(search):
+    """Turn free text into an FTS5 MATCH expression, or None if it has no words.
+
+    Every word must match (as a prefix), either as typed or without its
+    Hebrew prefix letters.
+    """
+    clauses = []
+    for word in WORD_RE.findall(normalize(search)):
+        forms = [word] + prefix_variants(word)
+        clauses.append('(' + ' OR '.join(f'"{f}"*' for f in forms) + ')')
+    return ' AND '.join(clauses) or None
+
+
+def register_functions(conn):
+    """Make the normalizers available to SQL (used by the questions_fts triggers)."""
+    conn.create_function('he_normalize', 1, normalize, deterministic=True)
+    conn.create_function('he_index_terms', 3, index_terms, deterministic=True)
+
+
+def snippet_sql(column):
+    """SQL for an FTS snippet of one questions_fts column (0 stem, 1 options, 2 explanation)."""
+    return f"snippet(questions_fts, {column}, '{SNIPPET_START}', '{SNIPPET_END}', '…', 16)"
+
+
+def best_snippet(*snippets):
+    """The first snippet that contains a highlighted match, else the first one."""
+    for snippet in snippets:
+        if snippet and SNIPPET_START in snippet:
+            return snippet
+    return snippets[0] if snippets else ''
+
+
+def highlight(snippet):
+    """Render an FTS snippet as HTML with <mark> around the matched terms."""
+    if not snippet:
+        return ''
+    html = str(escape(snippet))
+    return Markup(html.replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
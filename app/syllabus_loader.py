@@ -1,10 +1,10 @@
 import json
-import sqlite3
 import config
 
 
 def import_syllabus_data():
-    conn = sqlite3.connect(config.DB_PATH)
+    from app.db import connect
+    conn = connect()
     count = conn.execute("SELECT COUNT(*) FROM topics").fetchone()[0]
     if count > 0:
         conn.close()
@@ -15,7 +15,11 @@ def import_syllabus_data():
     with open(config.PHASE2_PATH, 'r', encoding='utf-8') as f:
         phase2 = json.load(f)
 
-    for t in phase1['topics']:
+    # The mapper's files aren't guaranteed to list parents first or to only map
+    # listed topics; load them as they are (as before connect() enabled foreign
+    # keys) and report dangling references instead of failing.
+    conn.execute("PRAGMA foreign_keys = OFF")
+    for t in sorted(phase1['topics'], key=lambda t: (t['level'], t['id'])):
         conn.execute(
             "INSERT INTO topics (id, chapter_code, chapter_en, chapter_he, level, hebrew, english, parent_id, notes) "
             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
@@ -37,5 +41,9 @@ def import_syllabus_data():
         )
 
     conn.commit()
+    dangling = conn.execute("PRAGMA foreign_key_check").fetchall()
     conn.close()
     print(f"Imported {len(phase1['topics'])} topics and {len(phase2['results'])} mappings.")
+    if dangling:
+        tables = sorted({row[0] for row in dangling})
+        print(f"Warning: {len(dangling)} row(s) in {', '.join(tables)} reference topics that don't exist.")
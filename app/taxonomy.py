@@ -0,0 +1,68 @@
+"""In-process cache of the syllabus taxonomy (chapters, topics, subtopics).
+
+The topic tree only changes when the syllabus is (re)imported, yet almost every
+page lists it. It is loaded once per process and reused until the 'topics'
+change counter in data_versions moves, which the topics/topic_mappings
+triggers bump; that also keeps several worker processes consistent.
+"""
+import threading
+from app.db import data_version
+
+
+class Taxonomy:
+    """Immutable snapshot of the topic tree at one data version."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.topics = {}      # id -> topic dict (mapping confidence/pages included)
+        self.children = {}    # parent_id -> [subtopic, ...] ordered by id
+        self.by_chapter = {}  # chapter_code -> [level-2 topic, ...] ordered by id
+        self.level2 = []      # level-2 topics ordered by chapter_code, id
+        self.chapters = []    # [{chapter_code, chapter_he, chapter_en}] ordered by code
+        for row in rows:
+            topic = dict(row)
+            self.topics[topic['id']] = topic
+            if topic['level'] == 2:
+                self.level2.append(topic)
+                if topic['chapter_code'] not in self.by_chapter:
+                    self.chapters.append({k: topic[k] for k in ('chapter_code', 'chapter_he', 'chapter_en')})
+                self.by_chapter.setdefault(topic['chapter_code'], []).append(topic)
+            elif topic['level'] == 3 and topic['parent_id'] is not None:
+                self.children.setdefault(topic['parent_id'], []).append(topic)
+        self.subtopics = [s for parent in sorted(self.children) for s in self.children[parent]]
+
+    def chapter_topics(self, chapter_code):
+        return self.by_chapter.get(chapter_code, [])
+
+    def subtopics_of(self, topic_id):
+        return self.children.get(topic_id, [])
+
+
+_cached = None
+_lock = threading.Lock()
+
+
+def _load(db, version):
+    rows = db.execute("""
+        SELECT t.id, t.chapter_code, t.chapter_en, t.chapter_he, t.level, t.hebrew, t.english, t.parent_id,
+               COALESCE(tm.synopsis_confidence, '') as syn_conf,
+               COALESCE(tm.dulcan_confidence, '') as dul_conf,
+               tm.synopsis_pages, tm.dulcan_pages
+        FROM topics t
+        LEFT JOIN topic_mappings tm ON tm.topic_id = t.id
+        ORDER BY t.chapter_code, t.id
+    """).fetchall()
+    return Taxonomy(version, rows)
+
+
+def get_taxonomy(db):
+    """The cached taxonomy, reloaded if the topics changed since it was built."""
+    global _cached
+    version = data_version(db, 'topics')
+    cached = _cached
+    if cached is not None and cached.version == version:
+        return cached
+    with _lock:
+        if _cached is None or _cached.version != version:
+            _cached = _load(db, version)
+        return _cached
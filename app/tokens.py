@@ -0,0 +1,41 @@
+"""Local token estimates for prompt budgeting.
+
+There is no local tokenizer for Claude models, so counts are estimated from
+character classes: Hebrew letters take far fewer characters per token than
+English text, so a character limit over- or under-fills the context depending
+on the language. The rates lean pessimistic so a budget isn't overrun.
+"""
+import math
+import re
+
+HEBREW_RE = re.compile('[\u0590-\u05FF]')
+WORD_CHAR_RE = re.compile('[A-Za-z0-9]')
+SPACE_RE = re.compile(r'\s')
+
+HEBREW_CHARS_PER_TOKEN = 2.0
+LATIN_CHARS_PER_TOKEN = 3.5
+OTHER_TOKENS_PER_CHAR = 0.6  # punctuation, symbols, other scripts
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    hebrew = len(HEBREW_RE.findall(text))
+    latin = len(WORD_CHAR_RE.findall(text))
+    other = len(text) - hebrew - latin - len(SPACE_RE.findall(text))
+    return math.ceil(hebrew / HEBREW_CHARS_PER_TOKEN + latin / LATIN_CHARS_PER_TOKEN
+                     + other * OTHER_TOKENS_PER_CHAR)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """The longest prefix of text estimated at no more than max_tokens."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
@@ -13,6 +13,15 @@ if os.path.exists(_env_path):
                 os.environ.setdefault(_key.strip(), _val.strip())
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 DB_PATH = os.path.join(DATA_DIR, 'exam_tool.db')
+TEXTBOOK_CACHE_PATH = os.path.join(DATA_DIR, 'textbook_cache.db')
+EXPORT_CACHE_DIR = os.path.join(DATA_DIR, 'exports')
+EXPORT_FRAGMENT_CACHE_SIZE = 5000
+# Worker processes rendering bulk exports
+EXPORT_WORKERS = 4
+IMPORT_BATCH_SIZE = 2000
+SQLITE_BUSY_TIMEOUT_MS = 15000
+SQLITE_CACHE_KB = 32768
+SQLITE_MMAP_BYTES = 256 * 1024 * 1024
 
 SYNOPSIS_PATH = os.path.join(
     os.environ.get('USERPROFILE', r'C:\Users\User'),
@@ -35,6 +44,59 @@ PHASE2_PATH = os.path.join(
 
 CLAUDE_API_KEY = os.environ.get('ANTHROPIC_API_KEY', '')
 CLAUDE_MODEL = 'claude-sonnet-4-20250514'
-MAX_EXTRACT_CHARS = 15000
+# Override to point the client at a proxy or a local stub of the API
+ANTHROPIC_BASE_URL = os.environ.get('ANTHROPIC_BASE_URL') or None
+MESSAGE_BATCH_POLL_SECONDS = 30
+# Give up waiting on a Message Batch after this long (the API expires batches after 24 hours)
+MESSAGE_BATCH_TIMEOUT_SECONDS = 25 * 3600
+CLAUDE_TIMEOUT = 600
+CLAUDE_CONNECT_TIMEOUT = 10
+CLAUDE_MAX_RETRIES = 2
+CLAUDE_MAX_CONNECTIONS = 20
+# Also mark a topic's textbook excerpt as cacheable (moves it to the start of the user message)
+CACHE_TEXTBOOK_CONTENT = False
+# Prompt size in estimated tokens (app.tokens): the whole input (system prompt +
+# user prompt) and the part of it given to textbook passages
+PROMPT_TOKEN_BUDGET = 8000
+TEXTBOOK_MAX_TOKENS = 4000
+SUBTOPICS_MAX_TOKENS = 600
+# max_tokens is sized from the number of questions requested. The per-question
+# allowance should sit above what real responses use: check it against
+# generation_log with `flask output-token-stats` (5 questions still get the 8K
+# the fixed limit gave). A response cut at max_tokens keeps its complete questions.
+OUTPUT_TOKENS_BASE = 400
+OUTPUT_TOKENS_PER_QUESTION = 1600
+MAX_OUTPUT_TOKENS = 16000
+MAX_QUESTION_COUNT = 10
+# Textbook passages are ranked by BM25 over the topic's terms; chunks inside the
+# topic's mapped pages score RETRIEVAL_MAPPED_BOOST times higher
+RETRIEVAL_CHUNK_CHARS = 1200
+RETRIEVAL_CANDIDATES = 200
+RETRIEVAL_MAPPED_BOOST = 2.0
+PDF_POOL_MAX_DOCS = 2
+PDF_POOL_MAX_BYTES = 1024 * 1024 * 1024
+# Processes for `flask warm-textbooks`; None uses every CPU
+TEXTBOOK_INDEX_WORKERS = None
 DEFAULT_QUESTION_COUNT = 3
+GENERATION_WORKERS = 4
+# A generation stream must be opened this soon after the form is posted
+STREAM_TOKEN_TTL_SECONDS = 300
+# A queued or running job not updated for this long was lost (worker restart, deploy) and is failed
+JOB_STALE_SECONDS = 900
+BANK_PAGE_SIZE = 50
+# Near-duplicate screening of generated questions (cosine similarity of hashed trigram vectors)
+DUPLICATE_VECTOR_DIM = 1024
+DUPLICATE_FLAG_THRESHOLD = 0.85
+# Drafts at least this similar to an existing question are not stored; None keeps them (flagged)
+DUPLICATE_SUPPRESS_THRESHOLD = 0.97
+BATCH_CONCURRENCY = 4
+# Identical generation requests within the TTL reuse the first one's questions
+GENERATION_CACHE_TTL_SECONDS = 3600
+GENERATION_CACHE_MAX_ENTRIES = 500
+GENERATION_CACHE_LEASE_SECONDS = 900
+GENERATION_CACHE_POLL_SECONDS = 0.5
+# How long a request waits for an identical one in flight before calling the API itself
+GENERATION_CACHE_WAIT_SECONDS = 20
+BATCH_MAX_RETRIES = 5
+BATCH_BACKOFF_SECONDS = 10
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
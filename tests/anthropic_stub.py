@@ -0,0 +1,167 @@
+"""Local stand-in for the Messages and Message Batches endpoints.
+
+Point config.ANTHROPIC_BASE_URL at StubAPI.url and the real SDK client talks
+to it. Every answer is a JSON block of distinct questions (so none is
+suppressed as a duplicate); a batch reports 'in_progress' for
+`batch_polls` retrieves before it ends, and `errored` custom ids fail.
+"""
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HEBREW = 'אבגדהוזחטיכלמנסעפצקרשת'
+
+
+def _words(rng, count):
+    return ' '.join(''.join(rng.choice(HEBREW) for _ in range(rng.randint(3, 7))) for _ in range(count))
+
+
+class StubAPI:
+    def __init__(self, questions_per_message=3, batch_polls=1):
+        self.questions_per_message = questions_per_message
+        self.batch_polls = batch_polls
+        self.errored = set()
+        self.reject_batches = False  # answer batch creation with a 400
+        self.overloaded = 0  # answer this many Messages calls with a 529
+        self.rejected = []  # params of each Messages call answered with a 529
+        self.stop_reason = 'end_turn'
+        self.truncate_at = None  # slice end for the response text, e.g. -200 drops the last 200 characters
+        self.messages = []  # params of each direct Messages call
+        self.batches = {}
+        self._seed = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def questions(self, count):
+        with self._lock:
+            self._seed += 1
+            rng = random.Random(self._seed)
+        return [{'stem': _words(rng, 12), 'options': {k: _words(rng, 3) for k in 'ABCD'},
+                 'correct': 'B', 'explanation': _words(rng, 6), 'difficulty': 'medium', 'clinical_task': 'mixed'}
+                for _ in range(count)]
+
+    def response_text(self):
+        text = '```json\n' + json.dumps({'questions': self.questions(self.questions_per_message)},
+                                        ensure_ascii=False, indent=2) + '\n```'
+        return text[:self.truncate_at] if self.truncate_at else text
+
+    def message(self, params, text=None):
+        return {
+            'id': 'msg_stub', 'type': 'message', 'role': 'assistant', 'model': params['model'],
+            'content': [{'type': 'text', 'text': self.response_text() if text is None else text}],
+            'stop_reason': self.stop_reason, 'stop_sequence': None,
+            'usage': {'input_tokens': 1000, 'output_tokens': 500,
+                      'cache_read_input_tokens': 0, 'cache_creation_input_tokens': 0},
+        }
+
+    def _batch(self, batch_id):
+        batch = self.batches[batch_id]
+        ended = batch['polls'] >= self.batch_polls
+        return {
+            'id': batch_id, 'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': {'processing': 0 if ended else len(batch['requests']),
+                               'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0},
+            'created_at': '2024-01-01T00:00:00Z', 'expires_at': '2024-01-02T00:00:00Z',
+            'ended_at': '2024-01-01T01:00:00Z' if ended else None,
+            'archived_at': None, 'cancel_initiated_at': None,
+            'results_url': f'{self.url}/v1/messages/batches/{batch_id}/results' if ended else None,
+        }
+
+    def _results(self, batch_id):
+        lines = []
+        for request in self.batches[batch_id]['requests']:
+            if request['custom_id'] in self.errored:
+                result = {'type': 'errored',
+                          'error': {'type': 'error', 'error': {'type': 'api_error', 'message': 'stub error'}}}
+            else:
+                result = {'type': 'succeeded', 'message': self.message(request['params'])}
+            lines.append(json.dumps({'custom_id': request['custom_id'], 'result': result}, ensure_ascii=False))
+        return '\n'.join(lines)
+
+    def _stream(self, params):
+        message = self.message(params)
+        text = message['content'][0]['text']
+        events = [
+            ('message_start', {'type': 'message_start',
+                               'message': dict(message, content=[], stop_reason=None,
+                                               usage=dict(message['usage'], output_tokens=1))}),
+            ('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                     'content_block': {'type': 'text', 'text': ''}}),
+        ]
+        events += [('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                             'delta': {'type': 'text_delta', 'text': text[i:i + 20]}})
+                   for i in range(0, len(text), 20)]
+        events += [
+            ('content_block_stop', {'type': 'content_block_stop', 'index': 0}),
+            ('message_delta', {'type': 'message_delta',
+                               'delta': {'stop_reason': self.stop_reason, 'stop_sequence': None},
+                               'usage': {'output_tokens': message['usage']['output_tokens']}}),
+            ('message_stop', {'type': 'message_stop'}),
+        ]
+        return ''.join(f'event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n' for name, data in events)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body, content_type='application/json'):
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _error(self, status, kind, message, headers=None):
+                data = json.dumps({'type': 'error', 'error': {'type': kind, 'message': message}}).encode()
+                self.send_response(status)
+                for name, value in {'Content-Type': 'application/json', 'Content-Length': str(len(data)),
+                                    **(headers or {})}.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                params = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path.startswith('/v1/messages/batches') and stub.reject_batches:
+                    self._error(400, 'invalid_request_error', 'stub rejected batch')
+                elif self.path.startswith('/v1/messages/batches'):
+                    with stub._lock:
+                        batch_id = f'msgbatch_{len(stub.batches) + 1}'
+                        stub.batches[batch_id] = {'requests': params['requests'], 'polls': 0}
+                    self._send(json.dumps(stub._batch(batch_id)))
+                elif stub.overloaded:
+                    stub.overloaded -= 1
+                    stub.rejected.append(params)
+                    self._error(529, 'overloaded_error', 'stub overloaded', {'retry-after-ms': '1'})
+                elif params.get('stream'):
+                    stub.messages.append(params)
+                    self._send(stub._stream(params), 'text/event-stream')
+                else:
+                    stub.messages.append(params)
+                    self._send(json.dumps(stub.message(params), ensure_ascii=False))
+
+            def do_GET(self):
+                parts = self.path.split('?', 1)[0].strip('/').split('/')  # v1/messages/batches/<id>[/results]
+                batch_id = parts[3]
+                if parts[-1] == 'results':
+                    self._send(stub._results(batch_id), 'application/binary')
+                else:
+                    stub.batches[batch_id]['polls'] += 1
+                    self._send(json.dumps(stub._batch(batch_id)))
+
+        return Handler
@@ -0,0 +1,95 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+def _syllabus(path):
+    """Two chapters of two topics with two subtopics each, and their page mappings."""
+    topics, mappings = [], []
+    topic_id = 1
+    for ch in (1, 2):
+        for _ in range(2):
+            parent = topic_id
+            topics.append({'id': topic_id, 'chapter': f'C{ch}', 'chapter_en': f'Chapter {ch}',
+                           'chapter_he': f'פרק {ch}', 'level': 2, 'hebrew': f'נושא {topic_id}',
+                           'english': f'Topic {topic_id}', 'parent_id': None})
+            mappings.append({'id': topic_id, 'synopsis_toc_pages': '2-4', 'synopsis_toc_titles': '',
+                             'synopsis_text_pages_count': 3, 'synopsis_confidence': 'HIGH',
+                             'dulcan_toc_pages': '1-2', 'dulcan_toc_titles': '',
+                             'dulcan_text_pages_count': 2, 'dulcan_confidence': 'LOW',
+                             'search_terms_used': 'ADHD; stimulant'})
+            topic_id += 1
+            for _ in range(2):
+                topics.append({'id': topic_id, 'chapter': f'C{ch}', 'chapter_en': f'Chapter {ch}',
+                               'chapter_he': f'פרק {ch}', 'level': 3, 'hebrew': f'תת-נושא {topic_id}',
+                               'english': f'Subtopic {topic_id}', 'parent_id': parent})
+                topic_id += 1
+    phase1, phase2 = os.path.join(path, 'phase1.json'), os.path.join(path, 'phase2.json')
+    with open(phase1, 'w', encoding='utf-8') as f:
+        json.dump({'topics': topics}, f)
+    with open(phase2, 'w', encoding='utf-8') as f:
+        json.dump({'results': mappings}, f)
+    return phase1, phase2
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Point every data path in config at a temporary directory with a small syllabus."""
+    phase1, phase2 = _syllabus(str(tmp_path))
+    for name, value in {
+        'DATA_DIR': str(tmp_path),
+        'DB_PATH': str(tmp_path / 'exam_tool.db'),
+        'TEXTBOOK_CACHE_PATH': str(tmp_path / 'textbook_cache.db'),
+        'EXPORT_CACHE_DIR': str(tmp_path / 'exports'),
+        'SYNOPSIS_PATH': str(tmp_path / 'synopsis.pdf'),
+        'DULCAN_PATH': str(tmp_path / 'dulcan.pdf'),
+        'PHASE1_PATH': phase1,
+        'PHASE2_PATH': phase2,
+    }.items():
+        monkeypatch.setattr(config, name, value)
+    return tmp_path
+
+
+@pytest.fixture
+def app(data_dir):
+    from app import create_app
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A running StubAPI that the app's Anthropic client is pointed at."""
+    from tests.anthropic_stub import StubAPI
+    stub = StubAPI().start()
+    monkeypatch.setattr(config, 'ANTHROPIC_BASE_URL', stub.url)
+    monkeypatch.setattr(config, 'MESSAGE_BATCH_POLL_SECONDS', 0.01)
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def textbooks(data_dir):
+    """Small Synopsis and Dulcan PDFs with a running header and page numbers."""
+    import fitz
+    lines = ['ADHD stimulant treatment in children and adolescents',
+             'obsessive-compulsive disorder exposure and response prevention',
+             'depression in adolescents and selective serotonin reuptake inhibitors']
+    for path, name in ((config.SYNOPSIS_PATH, 'Synopsis'), (config.DULCAN_PATH, 'Dulcan')):
+        doc = fitz.open()
+        for page_no in range(1, 13):
+            page = doc.new_page()
+            page.insert_text((72, 40), f'{name} of Psychiatry')
+            for i in range(20):
+                page.insert_text((72, 80 + 30 * i), f'{lines[(page_no + i) % 3]} ({page_no}.{i})')
+            page.insert_text((300, 800), str(page_no))
+        doc.save(path)
+        doc.close()
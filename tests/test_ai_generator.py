@@ -0,0 +1,37 @@
+import config
+from app.ai_generator import generate_questions, generate_questions_stream
+from app.db import get_db
+
+
+def _log(db):
+    return db.execute("SELECT questions_created, output_tokens, stop_reason FROM generation_log "
+                      "ORDER BY id DESC LIMIT 1").fetchone()
+
+
+def test_truncated_response_keeps_complete_questions(app, api, textbooks):
+    api.stop_reason = 'max_tokens'
+    api.truncate_at = -200  # cuts into the last of three questions
+    with app.app_context():
+        ids, _ = generate_questions(1, count=3)
+        assert len(ids) == 2
+        log = _log(get_db())
+        assert (log['questions_created'], log['output_tokens'], log['stop_reason']) == (2, 500, 'max_tokens')
+
+
+def test_truncated_stream_records_stop_reason(app, api, textbooks):
+    api.stop_reason = 'max_tokens'
+    api.truncate_at = -200
+    with app.app_context():
+        events = [kind for kind, _, _ in generate_questions_stream(1, count=3)]
+        assert events == ['question', 'question', 'done']
+        assert _log(get_db())['stop_reason'] == 'max_tokens'
+
+
+def test_output_token_stats(app, api, textbooks):
+    with app.app_context():
+        generate_questions(1, count=3)
+    result = app.test_cli_runner().invoke(args=['output-token-stats'])
+    assert result.exit_code == 0, result.output
+    # 500 output tokens for 3 questions
+    assert 'median 167' in result.output
+    assert f'is {config.OUTPUT_TOKENS_PER_QUESTION}; p95 + 20% suggests 200' in result.output
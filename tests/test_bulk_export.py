@@ -0,0 +1,73 @@
+import io
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from app import bulk_export
+from app.db import get_db
+
+
+def _exams(app, count):
+    with app.app_context():
+        db = get_db()
+        for e in range(1, count + 1):
+            db.execute("INSERT INTO exams (id, title) VALUES (?, ?)", (e, f'מבחן {e}'))
+            for pos in range(1, 6):
+                qid = db.execute(
+                    "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, "
+                    "correct_answer) VALUES (1, ?, 'א', 'ב', 'ג', 'ד', 'A')", (f'שאלה {e}-{pos}',)).lastrowid
+                db.execute("INSERT INTO exam_questions (exam_id, question_id, position) VALUES (?, ?, ?)",
+                           (e, qid, pos))
+        db.commit()
+        return bulk_export.load_exams(db, range(1, count + 1))
+
+
+def test_zip_has_every_exam_and_variant(app):
+    _exams(app, 2)
+    response = app.test_client().get('/export/bulk?exam_id=1&exam_id=2&variant=student&variant=key&shuffled=2')
+    names = zipfile.ZipFile(io.BytesIO(response.get_data())).namelist()
+    assert len(names) == 2 * 4
+    assert all(name.endswith('.docx') for name in names)
+
+
+def test_pending_renders_are_cancelled_when_the_client_goes(app, monkeypatch):
+    exams = _exams(app, 3)
+    permits = threading.Semaphore(1)  # only the first render may finish until the stream is closed
+    render = bulk_export.render_variant
+
+    def gated_render(exam, rows, variant):
+        permits.acquire()
+        return render(exam, rows, variant)
+
+    monkeypatch.setattr(bulk_export, 'render_variant', gated_render)
+    # A thread pool, so the test can gate the renders; cancelling works as with processes
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(bulk_export, '_pool', pool)
+    submitted = []
+    submit = pool.submit
+    monkeypatch.setattr(pool, 'submit', lambda *args: submitted.append(submit(*args)) or submitted[-1])
+
+    stream = bulk_export.stream_zip(exams, ['full', 'student', 'key'])
+    next(stream)
+    stream.close()  # what the server does when the client disconnects
+    permits.release()  # let the render already running finish
+    pool.shutdown(wait=True)
+    assert len(submitted) == 9
+    assert sum(f.cancelled() for f in submitted) >= 7  # all but the finished one and a running one
+
+
+def test_failed_render_is_listed_in_the_zip(app, monkeypatch):
+    exams = _exams(app, 2)
+    render = bulk_export.render_variant
+
+    def failing_render(exam, rows, variant):
+        if exam['id'] == 2 and variant == 'key':
+            raise ValueError('bad question')
+        return render(exam, rows, variant)
+
+    monkeypatch.setattr(bulk_export, 'render_variant', failing_render)
+    monkeypatch.setattr(bulk_export, '_pool', ThreadPoolExecutor(max_workers=2))
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(bulk_export.stream_zip(exams, ['full', 'key']))))
+    assert archive.testzip() is None
+    names = archive.namelist()
+    assert len(names) == 4 and names[-1] == bulk_export.ERRORS_NAME
+    assert archive.read(bulk_export.ERRORS_NAME).decode() == '2 מבחן 2 (key): bad question\n'
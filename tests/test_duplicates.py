@@ -0,0 +1,53 @@
+from app.db import get_db
+from app.duplicates import get_index, DuplicateScreen
+
+
+def _insert(db, stem):
+    return db.execute(
+        "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, correct_answer) "
+        "VALUES (1, ?, 'תרופה', 'טיפול', 'הערכה', 'מעקב', 'A')", (stem,)).lastrowid
+
+
+def _unembedded(db):
+    return [r[0] for r in db.execute("SELECT question_id FROM questions_unembedded ORDER BY question_id")]
+
+
+def test_only_queued_questions_are_embedded(app):
+    with app.app_context():
+        db = get_db()
+        imported = _insert(db, 'ילד בן שמונה עם קשיי קשב בכיתה')
+        db.commit()
+        assert _unembedded(db) == [imported]
+        assert imported in get_index(db).ids
+        assert _unembedded(db) == []
+
+        # A generated question stores its vector in the same transaction: nothing to queue
+        screen = DuplicateScreen(db)
+        q = {'stem': 'מתבגרת עם מצב רוח ירוד ונסיגה חברתית', 'options': {'A': 'תרופה'}}
+        vector, _, _ = screen.check(q)
+        generated = _insert(db, q['stem'])
+        screen.add(db, generated, vector)
+        db.commit()
+        screen.committed(db)
+        assert _unembedded(db) == []
+
+        # Editing the text drops the vector and queues the question again
+        db.execute("UPDATE questions SET stem_he = 'נוסח חדש לגמרי' WHERE id = ?", (generated,))
+        db.commit()
+        assert _unembedded(db) == [generated]
+        assert generated in get_index(db).ids
+        assert _unembedded(db) == []
+
+        db.execute("UPDATE questions SET stem_he = 'נוסח שלישי' WHERE id = ?", (imported,))
+        db.execute("DELETE FROM questions WHERE id = ?", (imported,))
+        db.commit()
+        assert _unembedded(db) == []
+
+
+def test_embedding_does_not_scan_the_bank(app):
+    with app.app_context():
+        db = get_db()
+        plan = ' '.join(r['detail'] for r in db.execute("""
+            EXPLAIN QUERY PLAN
+            SELECT q.id FROM questions_unembedded u CROSS JOIN questions q ON q.id = u.question_id"""))
+        assert 'SCAN q' not in plan
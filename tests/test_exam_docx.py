@@ -0,0 +1,50 @@
+import glob
+import os
+import time
+import pytest
+import config
+from app import exam_docx
+from app.db import get_db
+
+
+def _exam(db):
+    db.execute("INSERT INTO exams (id, title) VALUES (1, 'מבחן')")
+    qid = db.execute("INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, "
+                     "correct_answer) VALUES (1, 'שאלה', 'א', 'ב', 'ג', 'ד', 'A')").lastrowid
+    db.execute("INSERT INTO exam_questions (exam_id, question_id, position) VALUES (1, ?, 1)", (qid,))
+    db.commit()
+
+
+def _cached(name, age):
+    path = os.path.join(config.EXPORT_CACHE_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(b'old')
+    os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+
+def test_render_prunes_only_older_renderings(app):
+    os.makedirs(config.EXPORT_CACHE_DIR, exist_ok=True)
+    older = _cached('exam-1-older.docx', 60)
+    newer = _cached('exam-1-newer.docx', -60)  # written by a concurrent request for a later edit
+    with app.app_context():
+        _exam(get_db())
+        path, _ = exam_docx.exam_docx_path(get_db(), 1)
+    assert os.path.exists(path)
+    assert not os.path.exists(older)
+    assert os.path.exists(newer)
+
+
+def test_failed_save_leaves_no_temp_file(app, monkeypatch):
+    def broken(exam, questions):
+        class Doc:
+            def save(self, f):
+                raise RuntimeError('disk full')
+        return Doc()
+
+    monkeypatch.setattr(exam_docx, 'build_document', broken)
+    with app.app_context():
+        _exam(get_db())
+        with pytest.raises(RuntimeError):
+            exam_docx.exam_docx_path(get_db(), 1)
+    assert glob.glob(os.path.join(config.EXPORT_CACHE_DIR, '*')) == []
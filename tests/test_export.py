@@ -0,0 +1,51 @@
+import pytest
+from app.db import get_db
+
+
+def _exams(app):
+    with app.app_context():
+        db = get_db()
+        for e in (1, 2):
+            db.execute("INSERT INTO exams (id, title) VALUES (?, ?)", (e, f'מבחן {e}'))
+            qid = db.execute(
+                "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, correct_answer) "
+                "VALUES (1, ?, 'א', 'ב', 'ג', 'ד', 'A')", (f'שאלה {e}',)).lastrowid
+            db.execute("INSERT INTO exam_questions (exam_id, question_id, position) VALUES (?, ?, 1)", (e, qid))
+        db.commit()
+
+
+def _edit_question(app, exam_id):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE questions SET stem_he = stem_he || ' (עודכן)' WHERE id IN "
+                   "(SELECT question_id FROM exam_questions WHERE exam_id = ?)", (exam_id,))
+        db.commit()
+
+
+@pytest.mark.parametrize('url', ['/export/exam/1/docx', '/export/exam/1/docx?engine=stream', '/export/exam/1/json'])
+def test_etag_follows_the_exam_own_content(app, url):
+    _exams(app)
+    client = app.test_client()
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    _edit_question(app, 2)  # another exam
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    _edit_question(app, 1)
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('url', ['/export/exam/1/docx', '/export/exam/1/json'])
+def test_deleted_exam_is_never_not_modified(app, url):
+    _exams(app)
+    client = app.test_client()
+    etag = client.get(url).headers['ETag']
+    with app.app_context():
+        db = get_db()
+        db.execute("DELETE FROM exam_questions WHERE exam_id = 1")
+        db.execute("DELETE FROM exams WHERE id = 1")
+        db.commit()
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 404
+    assert client.get(url.replace('/1/', '/99/'), headers={'If-None-Match': etag}).status_code == 404
@@ -0,0 +1,35 @@
+import time
+import config
+from app.db import get_db
+
+
+def _events(response):
+    return [block.split('\n', 1)[0].removeprefix('event: ')
+            for block in response.get_data(as_text=True).strip().split('\n\n')]
+
+
+def test_stream_needs_a_token_from_a_post(app, api, textbooks):
+    client = app.test_client()
+    assert _events(client.get('/questions/generate/stream?topic_id=1&count=3')) == ['failure']
+    assert api.messages == []
+
+    response = client.post('/questions/generate/stream', data={'topic_id': '1', 'count': '3'})
+    assert response.status_code == 201
+    url = response.json['stream_url']
+    assert _events(client.get(url)) == ['question', 'question', 'question', 'done']
+    assert len(api.messages) == 1
+
+    # The token is spent: opening the same URL again doesn't generate again
+    assert _events(client.get(url)) == ['failure']
+    assert len(api.messages) == 1
+
+
+def test_expired_token_is_refused(app, api, textbooks):
+    client = app.test_client()
+    url = client.post('/questions/generate/stream', data={'topic_id': '1'}).json['stream_url']
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE stream_tokens SET created_at = ?", (time.time() - config.STREAM_TOKEN_TTL_SECONDS - 1,))
+        db.commit()
+    assert _events(client.get(url)) == ['failure']
+    assert api.messages == []
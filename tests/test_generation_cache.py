@@ -0,0 +1,79 @@
+import time
+import config
+from app import generation_cache
+from app.ai_generator import build_prompt, generate_questions, message_params
+from app.db import get_db
+
+
+def test_generate_batch_rerun_calls_the_api_again(app, api, textbooks):
+    runner = app.test_cli_runner()
+    for _ in range(2):
+        result = runner.invoke(args=['generate-batch', '--topic', '1', '--count', '3'])
+        assert result.exit_code == 0, result.output
+    assert len(api.messages) == 2
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) FROM questions").fetchone()[0] == 6
+
+    # The batch's latest result is still cached for an identical single request
+    with app.app_context():
+        assert generate_questions(1, count=3)[1]
+    assert len(api.messages) == 2
+
+
+def test_waiting_for_an_identical_request_is_capped(app, api, textbooks, monkeypatch):
+    monkeypatch.setattr(config, 'GENERATION_CACHE_WAIT_SECONDS', 0.2)
+    monkeypatch.setattr(config, 'GENERATION_CACHE_POLL_SECONDS', 0.05)
+    with app.app_context():
+        db = get_db()
+        fp = generation_cache.fingerprint(message_params(build_prompt(db, 1, 3, 'medium', 'mixed', None), 3))
+        assert generation_cache.claim(db, fp, 1) is None  # another request owns it
+        start = time.monotonic()
+        assert generation_cache.claim(db, fp, 1) == generation_cache.BUSY
+        assert time.monotonic() - start < 1
+
+        # An identical generation stuck behind that owner calls the API itself
+        ids, from_cache = generate_questions(1, count=3)
+        assert len(ids) == 3 and not from_cache
+        assert len(api.messages) == 1
+
+
+def test_deleted_cached_questions_are_regenerated(app, api, textbooks):
+    with app.app_context():
+        db = get_db()
+        ids, from_cache = generate_questions(1, count=3)
+        assert not from_cache
+        assert generate_questions(1, count=3) == (ids, True)
+        assert len(api.messages) == 1
+
+        db.execute(f"DELETE FROM questions WHERE id IN ({','.join('?' * len(ids))})", ids)
+        db.commit()
+        new_ids, from_cache = generate_questions(1, count=3)
+        assert len(new_ids) == 3 and not from_cache
+        assert len(api.messages) == 2
+        # The regenerated questions are cached in turn
+        assert generate_questions(1, count=3) == (new_ids, True)
+
+
+def test_stream_marks_cached_results(app, api, textbooks):
+    client = app.test_client()
+    for from_cache in (False, True):
+        url = client.post('/questions/generate/stream', data={'topic_id': '1', 'count': '3'}).json['stream_url']
+        done = client.get(url).get_data(as_text=True).strip().split('\n\n')[-1]
+        assert done.startswith('event: done')
+        assert f'"from_cache": {str(from_cache).lower()}' in done
+    assert len(api.messages) == 1
+
+
+def test_job_status_marks_cached_results(app, api, textbooks):
+    from app.jobs import _run_job, get_job
+    with app.app_context():
+        db = get_db()
+        job_ids = [db.execute("INSERT INTO generation_jobs (topic_id, params) VALUES (1, ?)",
+                              ('{"count": 3, "difficulty": "medium", "clinical_task": "mixed", "subtopic_ids": null}',)
+                              ).lastrowid for _ in range(2)]
+        db.commit()
+    for job_id in job_ids:
+        _run_job(app, job_id)
+    with app.app_context():
+        assert [get_job(job_id)['from_cache'] for job_id in job_ids] == [False, True]
+    assert len(api.messages) == 1
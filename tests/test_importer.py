@@ -0,0 +1,25 @@
+import io
+from app.db import get_db
+from app.importer import import_file
+
+CSV = ('stem,option_a,option_b,option_c,option_d,answer\n'
+       'שאלה ראשונה,א,ב,ג,ד,B\n'
+       'שאלה שנייה,א,ב,ג,ד,ג\n').encode('utf-8')
+
+
+def test_import_with_default_topic(app):
+    with app.app_context():
+        report = import_file(get_db(), io.BytesIO(CSV), 'bank.csv', default_topic_id=1)
+        assert (report['valid'], report['inserted'], report['invalid']) == (2, 2, 0)
+
+
+def test_unknown_default_topic_is_a_record_error(app):
+    with app.app_context():
+        report = import_file(get_db(), io.BytesIO(CSV), 'bank.csv', default_topic_id=999)
+        assert (report['inserted'], report['invalid']) == (0, 2)
+        assert report['errors'][0][1] == ['נושא לא נמצא: 999']
+        assert report['unmatched_topics']['999'] == 2
+
+    response = app.test_client().post('/questions/import', data={
+        'file': (io.BytesIO(CSV), 'bank.csv'), 'topic_id': '999', 'status': 'draft'})
+    assert response.status_code == 200
@@ -0,0 +1,106 @@
+import config
+from app.db import get_db
+from app.jobs import fail_stale_jobs, get_job, STALE_JOB_ERROR
+
+
+def _job(db, status, minutes_ago, batch_id=None):
+    cursor = db.execute(
+        "INSERT INTO generation_jobs (topic_id, params, status, batch_id, updated_at) "
+        "VALUES (1, '{}', ?, ?, datetime('now', ?))", (status, batch_id, f'-{minutes_ago} minutes'))
+    db.commit()
+    return cursor.lastrowid
+
+
+def test_stale_single_jobs_are_failed(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO generation_batches (description) VALUES ('b')")
+        stale = _job(db, 'running', 60)
+        queued = _job(db, 'queued', 60)
+        live = _job(db, 'running', 1)
+        batch_job = _job(db, 'running', 60, batch_id=1)
+
+        assert fail_stale_jobs(db) == 2
+        assert get_job(stale)['status'] == 'failed'
+        assert get_job(stale)['error'] == STALE_JOB_ERROR
+        assert get_job(queued)['status'] == 'failed'
+        assert get_job(live)['status'] == 'running'
+        assert get_job(batch_job)['status'] == 'running'
+
+
+def test_polling_a_lost_job_fails_it(app):
+    with app.app_context():
+        job_id = _job(get_db(), 'queued', 60)
+        response = app.test_client().get(f'/api/jobs/{job_id}')
+        assert response.json['status'] == 'failed'
+
+
+def test_a_job_is_claimed_once(app):
+    from app.jobs import _claim_job
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO generation_batches (description) VALUES ('b')")
+        job_id = _job(db, 'queued', 0, batch_id=1)
+        assert _claim_job(db, job_id)
+        assert not _claim_job(db, job_id)  # running and fresh: owned by the first caller
+
+        stale = _job(db, 'running', 60, batch_id=1)
+        assert _claim_job(db, stale)
+
+
+def _api_error(status, headers=None):
+    import anthropic
+    from types import SimpleNamespace
+    response = SimpleNamespace(status_code=status, headers=headers or {}, request=None)
+    return anthropic.APIStatusError('error', response=response, body=None)
+
+
+def _backoff_run(app, monkeypatch, error):
+    from app import ai_generator, jobs
+    calls, sleeps = [], []
+
+    def generate(topic_id, **params):
+        calls.append(topic_id)
+        if len(calls) == 1:
+            raise error
+        return [1], False
+
+    monkeypatch.setattr(ai_generator, 'generate_questions', generate)
+    monkeypatch.setattr(jobs.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(jobs, '_rate_limited_until', 0.0)
+    with app.app_context():
+        db = get_db()
+        job_id = _job(db, 'running', 0)
+        assert jobs._generate_with_backoff(db, job_id, 1, {}) == ([1], False)
+    return sleeps, jobs._rate_limited_until
+
+
+def test_server_errors_back_off_only_their_job(app, monkeypatch):
+    sleeps, paused_until = _backoff_run(app, monkeypatch, _api_error(503))
+    assert len(sleeps) == 1
+    assert paused_until == 0.0
+
+
+def test_rate_limit_pauses_every_worker(app, monkeypatch):
+    sleeps, paused_until = _backoff_run(app, monkeypatch, _api_error(429, {'retry-after': '7'}))
+    assert paused_until > 0.0
+    assert sleeps and 6 < sleeps[0] <= 7  # waited out by _wait_for_rate_limit
+
+
+def test_jobs_retry_once_per_attempt(app, api, textbooks, monkeypatch):
+    from app import jobs
+    monkeypatch.setattr(config, 'BATCH_MAX_RETRIES', 2)
+    monkeypatch.setattr(config, 'BATCH_BACKOFF_SECONDS', 0.001)
+    api.overloaded = 100
+    with app.app_context():
+        job_id = _job(get_db(), 'queued', 0)
+        get_db().execute("UPDATE generation_jobs SET params=? WHERE id=?",
+                         ('{"count": 3, "difficulty": "medium", "clinical_task": "mixed", "subtopic_ids": null}',
+                          job_id))
+        get_db().commit()
+    jobs._run_job(app, job_id)
+    with app.app_context():
+        job = get_job(job_id)
+    assert job['status'] == 'failed' and job['attempts'] == 3
+    # One API call per attempt: the SDK's own retries are off for jobs
+    assert len(api.rejected) == 3
@@ -0,0 +1,92 @@
+import config
+from app.db import get_db
+from app.jobs import create_batch, run_batch, get_batch
+
+
+def _jobs(batch_id):
+    return {r['topic_id']: dict(r) for r in get_db().execute(
+        "SELECT topic_id, status, error, question_ids FROM generation_jobs WHERE batch_id=?", (batch_id,))}
+
+
+def test_submit_poll_and_ingest_results(app, api, textbooks):
+    api.batch_polls = 3
+    with app.app_context():
+        batch_id = create_batch([1, 4], count=3, backend='message-batches')
+        job_ids = [r['id'] for r in get_db().execute("SELECT id FROM generation_jobs ORDER BY id")]
+        api.errored = {f'job-{job_ids[1]}'}
+        run_batch(app, batch_id)
+
+        assert len(api.batches) == 1
+        [submitted] = api.batches.values()
+        assert submitted['polls'] >= 3  # two 'in_progress' answers, then ended
+        assert [r['custom_id'] for r in submitted['requests']] == [f'job-{i}' for i in job_ids]
+        assert submitted['requests'][0]['params']['max_tokens'] > 0
+
+        jobs = _jobs(batch_id)
+        assert jobs[1]['status'] == 'done'
+        assert get_db().execute("SELECT COUNT(*) FROM questions WHERE topic_id=1").fetchone()[0] == 3
+        assert jobs[4]['status'] == 'failed' and jobs[4]['error'] == 'stub error'
+        batch = get_batch(batch_id)
+        assert batch['status'] == 'failed' and batch['api_batch_id'] == ''
+
+        # Resuming resubmits only the failed job
+        api.errored = set()
+        run_batch(app, batch_id)
+        assert len(api.batches) == 2
+        assert len(api.batches['msgbatch_2']['requests']) == 1
+        assert _jobs(batch_id)[4]['status'] == 'done'
+        assert get_batch(batch_id)['status'] == 'done'
+
+
+def test_wait_timeout_keeps_the_submitted_batch(app, api, textbooks, monkeypatch):
+    api.batch_polls = 10 ** 9
+    monkeypatch.setattr(config, 'MESSAGE_BATCH_TIMEOUT_SECONDS', 0.05)
+    with app.app_context():
+        batch_id = create_batch([1], backend='message-batches')
+        run_batch(app, batch_id)
+        job = _jobs(batch_id)[1]
+        assert job['status'] == 'failed' and 'did not finish' in job['error']
+        assert get_batch(batch_id)['api_batch_id'] == 'msgbatch_1'
+
+        # The resumed run polls the batch already paid for instead of submitting again
+        api.batch_polls = 0
+        run_batch(app, batch_id)
+        assert len(api.batches) == 1
+        assert _jobs(batch_id)[1]['status'] == 'done'
+
+
+def test_submit_error_fails_the_jobs_and_the_batch(app, api, textbooks):
+    api.reject_batches = True
+    with app.app_context():
+        batch_id = create_batch([1, 4], backend='message-batches')
+        run_batch(app, batch_id)
+        jobs = _jobs(batch_id)
+        assert [j['status'] for j in jobs.values()] == ['failed', 'failed']
+        assert 'stub rejected batch' in jobs[1]['error']
+        assert get_batch(batch_id)['status'] == 'failed'
+
+        api.reject_batches = False
+        run_batch(app, batch_id)
+        assert get_batch(batch_id)['status'] == 'done'
+
+
+def test_resume_submits_jobs_missing_from_the_stored_batch(app, api, textbooks, monkeypatch):
+    api.batch_polls = 10 ** 9
+    monkeypatch.setattr(config, 'MESSAGE_BATCH_TIMEOUT_SECONDS', 0.05)
+    with app.app_context():
+        db = get_db()
+        batch_id = create_batch([1], backend='message-batches')
+        run_batch(app, batch_id)
+        # A job that wasn't part of msgbatch_1, e.g. its prompt failed to build on the first run
+        missing = db.execute("INSERT INTO generation_jobs (topic_id, params, batch_id, status) "
+                             "SELECT 4, params, batch_id, 'failed' FROM generation_jobs WHERE batch_id=?",
+                             (batch_id,)).lastrowid
+        db.commit()
+
+        api.batch_polls = 0
+        run_batch(app, batch_id)
+        assert [r['custom_id'] for r in api.batches['msgbatch_2']['requests']] == [f'job-{missing}']
+        jobs = _jobs(batch_id)
+        assert jobs[1]['status'] == 'done' and jobs[4]['status'] == 'done'
+        batch = get_batch(batch_id)
+        assert batch['status'] == 'done' and batch['api_batch_id'] == ''
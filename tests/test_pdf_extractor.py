@@ -0,0 +1,80 @@
+import fitz
+import config
+from app import pdf_extractor
+
+
+def _pdf(path, pages):
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page()
+        for i, line in enumerate(lines):
+            page.insert_text((72, 80 + 20 * i), line)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def test_mapped_pages_are_candidates_despite_common_words(data_dir, monkeypatch):
+    common = ['disorder in children and disorder in adolescents'] * 10
+    mapped = ['selective mutism is an anxiety disorder', 'treated with exposure based therapy']
+    pdf = _pdf(data_dir / 'book.pdf', [common] * 30 + [mapped])
+    pdf_extractor.warm_page_cache(pdf, workers=1)
+    monkeypatch.setattr(config, 'RETRIEVAL_CANDIDATES', 5)
+
+    selected = pdf_extractor.retrieve_passages([('Book', pdf, [(31, 31)])], ['disorder'], budget=10000)
+    assert 31 - 1 in [page for page, _ in selected['Book']]
+
+
+def test_line_break_hyphens():
+    text = pdf_extractor.clean_page_text('obsessive-\ncompulsive symptoms and low self-\nesteem\n'
+                                         'the treat-\nment works; treatment is safe')
+    assert 'obsessive-compulsive' in text and 'self-esteem' in text
+    assert 'the treatment works' in text
+
+
+def test_compound_words_stay_searchable(data_dir):
+    pdf = _pdf(data_dir / 'book.pdf', [['checking rituals in obsessive-'] + ['compulsive disorder']])
+    pdf_extractor.warm_page_cache(pdf, workers=1)
+    assert pdf_extractor.search_chunks(pdf, pdf_extractor.fts_query(['compulsive']))
+
+
+BODY = ['tics begin in childhood', 'tourette syndrome persists', 'habit reversal training helps',
+        'alpha agonists reduce tics', 'comorbid attention deficits', 'families need psychoeducation',
+        'premonitory urges precede tics']
+
+
+def _book(path, pages=60, first_lines=None):
+    """Pages with a running header, varied body lines and a page number."""
+    first_lines = first_lines or {}
+    return _pdf(path, [[first_lines.get(i, 'Synopsis of Psychiatry')]
+                       + [BODY[(i + j) % len(BODY)] + ' ' + BODY[(i * 3 + j) % len(BODY)] for j in range(4)]
+                       + [str(i + 1)] for i in range(pages)])
+
+
+def _chunks(pdf):
+    return [r[0] for r in pdf_extractor._cache_conn().execute(
+        "SELECT text FROM chunks WHERE pdf_path = ? ORDER BY page", (pdf,))]
+
+
+def test_pages_read_before_the_first_warm_are_recleaned(data_dir):
+    pdf = _book(data_dir / 'book.pdf')
+    texts = dict(pdf_extractor._page_texts(pdf_extractor._cache_conn(), pdf, [(1, 3)]))
+    assert 'Synopsis of Psychiatry' in texts[0]  # no header set detected yet
+
+    pdf_extractor.warm_page_cache(pdf, workers=1)
+    assert not any('Synopsis of Psychiatry' in chunk for chunk in _chunks(pdf))
+    texts = dict(pdf_extractor._page_texts(pdf_extractor._cache_conn(), pdf, [(1, 3)]))
+    assert 'Synopsis of Psychiatry' not in texts[0] and 'tourette' in texts[0]
+
+
+def test_headers_are_detected_over_the_whole_book(data_dir):
+    import os
+    pdf = _book(data_dir / 'book.pdf', pages=200)
+    pdf_extractor.warm_page_cache(pdf, workers=1)
+
+    # 20 pages change and now share a first line: common among them, rare in the book
+    _book(data_dir / 'book.pdf', pages=200, first_lines={i: 'Clinical vignette' for i in range(20)})
+    os.utime(pdf, ns=(1, 1))
+    assert pdf_extractor.warm_page_cache(pdf, workers=1) == 20
+    assert sum('Clinical vignette' in chunk for chunk in _chunks(pdf)) == 20
+    assert not any('Synopsis of Psychiatry' in chunk for chunk in _chunks(pdf))
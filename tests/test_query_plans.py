@@ -0,0 +1,12 @@
+from app.query_plans import check_route_query_plans
+
+
+def test_route_queries_use_indexes(app):
+    with app.app_context():
+        assert check_route_query_plans() == []
+
+
+def test_check_query_plans_command(app):
+    result = app.test_cli_runner().invoke(args=['check-query-plans'])
+    assert result.exit_code == 0, result.output
+    assert 'All route queries use indexes.' in result.output
@@ -0,0 +1,72 @@
+import config
+from app.db import get_db
+from app.routes.questions import bank_page
+
+
+def _question(db, stem, created_at, topic_id=1, status='draft'):
+    return db.execute(
+        "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, correct_answer, "
+        "explanation_he, status, created_at) VALUES (?, ?, 'א', 'ב', 'ג', 'ד', 'A', '', ?, ?)",
+        (topic_id, stem, status, created_at)).lastrowid
+
+
+def _all_pages(db, args):
+    ids, cursor = [], None
+    while True:
+        questions, cursor = bank_page(db, args, cursor)
+        ids += [q['id'] for q in questions]
+        if cursor is None:
+            return ids
+
+
+def test_pages_have_no_gaps_or_duplicates_across_ties(app, monkeypatch):
+    monkeypatch.setattr(config, 'BANK_PAGE_SIZE', 7)
+    with app.app_context():
+        db = get_db()
+        # Runs of questions created in the same second, so created_at ties span page edges
+        created = {_question(db, f'שאלה {i}', f'2024-01-0{1 + i // 10} 10:00:00'): i for i in range(45)}
+        db.commit()
+        ids = _all_pages(db, {})
+        assert len(ids) == len(set(ids)) == 45
+        assert ids == sorted(created, key=lambda qid: (created[qid] // 10, qid), reverse=True)
+
+
+def test_filtered_pages(app, monkeypatch):
+    monkeypatch.setattr(config, 'BANK_PAGE_SIZE', 4)
+    with app.app_context():
+        db = get_db()
+        approved = {_question(db, f'שאלה {i}', '2024-01-01 10:00:00', status='approved') for i in range(0, 20, 2)}
+        for i in range(1, 20, 2):
+            _question(db, f'שאלה {i}', '2024-01-01 10:00:00')
+        db.commit()
+        ids = _all_pages(db, {'status': 'approved'})
+        assert len(ids) == len(approved) and set(ids) == approved
+
+
+def test_search_pages_have_no_gaps_or_duplicates_across_score_ties(app, monkeypatch):
+    monkeypatch.setattr(config, 'BANK_PAGE_SIZE', 5)
+    with app.app_context():
+        db = get_db()
+        # Identical stems score the same; the rest rank by how often the word appears
+        matching = {_question(db, 'מטופל עם דיכאון מז׳ורי', '2024-01-01 10:00:00') for _ in range(12)}
+        matching |= {_question(db, 'דיכאון ' * n + 'ממושך', '2024-01-01 10:00:00') for n in range(1, 6)}
+        _question(db, 'הפרעת קשב וריכוז', '2024-01-01 10:00:00')
+        db.commit()
+        ids = _all_pages(db, {'search': 'דיכאון'})
+        assert len(ids) == len(set(ids)) == len(matching)
+        assert set(ids) == matching
+
+
+def test_next_page_endpoint_follows_the_cursor(app, monkeypatch):
+    monkeypatch.setattr(config, 'BANK_PAGE_SIZE', 3)
+    with app.app_context():
+        db = get_db()
+        for i in range(7):
+            _question(db, f'שאלה {i}', '2024-01-01 10:00:00')
+        db.commit()
+    client = app.test_client()
+    pages, cursor = 1, client.get('/api/questions').json['next_cursor']
+    while cursor:
+        cursor = client.get('/api/questions', query_string={'cursor': cursor}).json['next_cursor']
+        pages += 1
+    assert pages == 3
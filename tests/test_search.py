@@ -0,0 +1,79 @@
+from app.db import get_db
+from app.routes.questions import bank_page
+from app.search import highlight, match_query, prefix_variants
+
+
+def _question(db, stem, explanation='', option_a='א'):
+    return db.execute(
+        "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, correct_answer, "
+        "explanation_he) VALUES (1, ?, ?, 'ב', 'ג', 'ד', 'A', ?)", (stem, option_a, explanation)).lastrowid
+
+
+def _search(db, text):
+    return [q['id'] for q in bank_page(db, {'search': text})[0]]
+
+
+def test_prefix_variants():
+    assert prefix_variants('והדיכאון') == ['הדיכאון', 'דיכאון']
+    assert prefix_variants('בית') == []  # too short once stripped
+    assert prefix_variants('ADHD') == []
+
+
+def test_word_with_prefix_letters_matches_the_bare_word(app):
+    with app.app_context():
+        db = get_db()
+        prefixed = _question(db, 'מטופל שסובל מדיכאון ממושך')
+        bare = _question(db, 'דיכאון אחרי לידה')
+        _question(db, 'הפרעת קשב וריכוז')
+        db.commit()
+        assert set(_search(db, 'דיכאון')) == {prefixed, bare}
+        # and the other way round: a prefixed query finds the bare word
+        assert set(_search(db, 'ודיכאון')) == {prefixed, bare}
+
+
+def test_niqqud_is_ignored_and_words_match_as_prefixes(app):
+    with app.app_context():
+        db = get_db()
+        pointed = _question(db, 'שָׁלוֹם לַמְּטֻפָּל')
+        db.commit()
+        assert _search(db, 'שלום') == [pointed]
+        assert _search(db, 'שלו') == [pointed]  # words match as prefixes
+
+
+def test_every_word_must_match_and_stem_hits_rank_first(app):
+    with app.app_context():
+        db = get_db()
+        in_explanation = _question(db, 'שאלה כללית', explanation='טיפול בליתיום')
+        in_stem = _question(db, 'טיפול בליתיום במאניה')
+        _question(db, 'טיפול תרופתי')
+        db.commit()
+        assert _search(db, 'טיפול ליתיום') == [in_stem, in_explanation]
+
+
+def test_edits_and_deletes_update_the_index(app):
+    with app.app_context():
+        db = get_db()
+        qid = _question(db, 'חרדה חברתית')
+        db.commit()
+        db.execute("UPDATE questions SET stem_he = 'פוביה ספציפית' WHERE id = ?", (qid,))
+        db.commit()
+        assert _search(db, 'חרדה') == []
+        assert _search(db, 'פוביה') == [qid]
+        db.execute("DELETE FROM questions WHERE id = ?", (qid,))
+        db.commit()
+        assert _search(db, 'פוביה') == []
+
+
+def test_snippet_highlights_the_match(app):
+    with app.app_context():
+        db = get_db()
+        _question(db, 'מטופל עם <b>דיכאון</b>')
+        db.commit()
+        [q] = bank_page(db, {'search': 'דיכאון'})[0]
+        html = str(highlight(q['snippet']))
+        assert '<mark>דיכאון</mark>' in html and '&lt;b&gt;' in html
+
+
+def test_query_without_words_is_no_search():
+    assert match_query('  ?! ') is None
+    assert match_query('"דיכאון') == '("דיכאון"*)'
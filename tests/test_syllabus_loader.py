@@ -0,0 +1,24 @@
+import json
+import config
+from app.db import get_db
+
+
+def test_import_tolerates_forward_and_dangling_references(data_dir, capsys):
+    with open(config.PHASE1_PATH, encoding='utf-8') as f:
+        phase1 = json.load(f)
+    with open(config.PHASE2_PATH, encoding='utf-8') as f:
+        phase2 = json.load(f)
+    phase1['topics'].reverse()  # subtopics listed before their parents
+    phase2['results'].append(dict(phase2['results'][0], id=999))  # mapping for an unlisted topic
+    with open(config.PHASE1_PATH, 'w', encoding='utf-8') as f:
+        json.dump(phase1, f)
+    with open(config.PHASE2_PATH, 'w', encoding='utf-8') as f:
+        json.dump(phase2, f)
+
+    from app import create_app
+    app = create_app()
+    assert '1 row(s) in topic_mappings' in capsys.readouterr().out
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM topics").fetchone()[0] == len(phase1['topics'])
+        assert db.execute("SELECT COUNT(*) FROM topic_mappings").fetchone()[0] == len(phase2['results'])
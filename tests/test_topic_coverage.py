@@ -0,0 +1,71 @@
+from app.db import get_db, connect, _migrate_db
+
+STATUSES = ('draft', 'review', 'approved', 'rejected')
+
+
+def _question(db, topic_id, status='draft'):
+    return db.execute(
+        "INSERT INTO questions (topic_id, stem_he, option_a, option_b, option_c, option_d, correct_answer, status) "
+        "VALUES (?, 'שאלה', 'א', 'ב', 'ג', 'ד', 'A', ?)", (topic_id, status)).lastrowid
+
+
+def _coverage(db):
+    return {r['topic_id']: (r['total'], *(r[s] for s in STATUSES))
+            for r in db.execute("SELECT * FROM topic_coverage") if r['total']}
+
+
+def _recount(db):
+    """What the triggers should maintain, counted from the questions themselves."""
+    return {r['topic_id']: tuple(r)[1:] for r in db.execute(f"""
+        SELECT topic_id, COUNT(*), {', '.join(f"SUM(status = '{s}')" for s in STATUSES)}
+        FROM questions GROUP BY topic_id""")}
+
+
+def test_counts_follow_insert_update_and_delete(app):
+    with app.app_context():
+        db = get_db()
+        a = _question(db, 1)
+        b = _question(db, 1, 'approved')
+        c = _question(db, 4)
+        db.commit()
+        assert _coverage(db) == {1: (2, 1, 0, 1, 0), 4: (1, 1, 0, 0, 0)}
+
+        db.execute("UPDATE questions SET status = 'review' WHERE id = ?", (a,))
+        db.execute("UPDATE questions SET topic_id = 7 WHERE id = ?", (b,))
+        db.execute("UPDATE questions SET topic_id = 4, status = 'rejected' WHERE id = ?", (a,))
+        db.commit()
+        assert _coverage(db) == {4: (2, 1, 0, 0, 1), 7: (1, 0, 0, 1, 0)} == _recount(db)
+
+        db.execute("DELETE FROM questions WHERE id IN (?, ?)", (c, b))
+        db.commit()
+        assert _coverage(db) == {4: (1, 0, 0, 0, 1)} == _recount(db)
+
+        # Updating other columns leaves the counts alone
+        db.execute("UPDATE questions SET stem_he = 'שאלה אחרת' WHERE id = ?", (a,))
+        db.commit()
+        assert _coverage(db) == _recount(db)
+
+
+def test_coverage_endpoint_and_chapter_code(app):
+    with app.app_context():
+        db = get_db()
+        _question(db, 7, 'approved')
+        db.commit()
+        assert db.execute("SELECT chapter_code FROM topic_coverage WHERE topic_id = 7").fetchone()[0] == 'C2'
+    rows = {r['id']: r for r in app.test_client().get('/api/coverage').json}
+    assert (rows[7]['total'], rows[7]['approved'], rows[1]['total']) == (1, 1, 0)
+
+
+def test_migration_backfills_an_empty_table(app, data_dir):
+    with app.app_context():
+        db = get_db()
+        for topic_id, status in ((1, 'draft'), (1, 'review'), (10, 'approved')):
+            _question(db, topic_id, status)
+        db.execute("DELETE FROM topic_coverage")
+        db.commit()
+    conn = connect()
+    try:
+        _migrate_db(conn)
+        assert _coverage(conn) == {1: (2, 1, 1, 0, 0), 10: (1, 0, 0, 1, 0)}
+    finally:
+        conn.close()